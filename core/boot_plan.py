@@ -0,0 +1,174 @@
+######################################################################
+# Compiled boot plan
+#
+# The ordered list of boot scripts is worked out once (precedence walk,
+# then every order.yaml parsed) and saved as json next to the bootstrap
+# lock. The plan carries a checksum of what it was compiled from: the
+# repo's git HEAD, the overrides manifest, the content of each order.yaml
+# it read, the mtime of every directory the walk listed and the server
+# it is for. A new order.yaml changes the mtime of the directory it is
+# created in, so it invalidates the plan like an edited one does.
+# Checking a saved plan only stats those directories and reads those
+# files, it doesn't walk the tree or parse yaml, so restarts and retries
+# after a failed script run straight from the plan until the repo
+# content changes. A repo whose HEAD can't be read always gets a freshly
+# compiled plan. Boot scripts may write a later order.yaml, so the agent
+# checks the plan again after each step that ran scripts.
+######################################################################
+import hashlib
+import json
+import os
+import re
+import time
+
+PLAN_FORMAT = 2
+SHA_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
+
+def file_sha1(path):
+    try:
+        with open(path, 'rb') as content:
+            return hashlib.sha1(content.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _read_line(path):
+    with open(path) as line_file:
+        return line_file.readline().strip()
+
+
+def git_head(repo_dir):
+    """The commit checked out in repo_dir, read from .git without running git; None if unknown"""
+    git_dir = os.path.join(repo_dir, '.git')
+    try:
+        if os.path.isfile(git_dir):
+            # submodules and worktrees have a .git file pointing at the real git dir
+            pointer = _read_line(git_dir)
+            if not pointer.startswith('gitdir: '):
+                return None
+            git_dir = os.path.join(repo_dir, pointer[len('gitdir: '):])
+        head = _read_line(os.path.join(git_dir, 'HEAD'))
+        if not head.startswith('ref: '):
+            return head if SHA_PATTERN.match(head) else None
+        ref = head[len('ref: '):]
+        # a worktree keeps its branches in the main repo's git dir
+        ref_dirs = [git_dir]
+        if os.path.isfile(os.path.join(git_dir, 'commondir')):
+            ref_dirs.append(os.path.join(git_dir, _read_line(os.path.join(git_dir, 'commondir'))))
+        for ref_dir in ref_dirs:
+            if os.path.isfile(os.path.join(ref_dir, ref)):
+                sha = _read_line(os.path.join(ref_dir, ref))
+                return sha if SHA_PATTERN.match(sha) else None
+            if os.path.isfile(os.path.join(ref_dir, 'packed-refs')):
+                with open(os.path.join(ref_dir, 'packed-refs')) as packed_refs:
+                    for line in packed_refs:
+                        if line.rstrip('\n').endswith(' ' + ref):
+                            return line.split(' ', 1)[0]
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def manifest_digest(manifest_path):
+    # the manifest is rewritten on every bootstrap; compare what it records, not how json.dump ordered it
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            return hashlib.sha1(json.dumps(json.load(manifest_file), sort_keys=True)).hexdigest()
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class BootPlan(object):
+    """(order.yaml path, script paths) steps in run order, plus the checksum of their inputs"""
+
+    def __init__(self, key, checksum, steps, order_files, walked_dirs, created=None):
+        self.key = key
+        self.checksum = checksum
+        self.steps = steps
+        self.order_files = order_files
+        self.walked_dirs = walked_dirs
+        self.created = created or time.time()
+
+    def scripts(self):
+        return [script for _, scripts in self.steps for script in scripts]
+
+    def to_dict(self):
+        return {'format': PLAN_FORMAT, 'key': self.key, 'checksum': self.checksum, 'created': self.created,
+                'order_files': self.order_files, 'walked_dirs': self.walked_dirs,
+                'steps': [[order_file, scripts] for order_file, scripts in self.steps]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['key'], data['checksum'], [(order_file, scripts) for order_file, scripts in data['steps']],
+                   data['order_files'], data['walked_dirs'], data['created'])
+
+
+class BootPlanner(object):
+    """Loads the saved plan while its inputs are unchanged, otherwise compiles and saves a new one"""
+
+    def __init__(self, plan_path, repo_dir, manifest_path=None):
+        self.plan_path = plan_path
+        self.repo_dir = repo_dir
+        self.manifest_path = manifest_path
+
+    def checksum(self, key, order_files, walked_dirs):
+        inputs = {
+            'format': PLAN_FORMAT,
+            'key': key,
+            'head': git_head(self.repo_dir),
+            'manifest': manifest_digest(self.manifest_path) if self.manifest_path else None,
+            'order_files': [[path, file_sha1(path)] for path in order_files],
+            'walked_dirs': [[path, dir_mtime(path)] for path in walked_dirs]
+        }
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+    def stale(self, plan):
+        """True if the files plan was compiled from have changed since"""
+        return self.checksum(plan.key, plan.order_files, plan.walked_dirs) != plan.checksum
+
+    def load(self, key):
+        """The saved plan for key if its inputs haven't changed, else None"""
+        if git_head(self.repo_dir) is None:
+            # without the checked out commit the checksum can't tell a new checkout from the old one
+            return None
+        try:
+            with open(self.plan_path, 'r') as plan_file:
+                data = json.load(plan_file)
+            if data.get('format') != PLAN_FORMAT or data.get('key') != key:
+                return None
+            plan = BootPlan.from_dict(data)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        if self.stale(plan):
+            return None
+        return plan
+
+    def compile(self, key, compile_fn):
+        """compile_fn() returns (order files read, steps, directories the walk listed)"""
+        order_files, steps, walked_dirs = compile_fn()
+        walked_dirs = sorted(set(walked_dirs))
+        return BootPlan(key, self.checksum(key, order_files, walked_dirs), steps, order_files, walked_dirs)
+
+    def save(self, plan):
+        temp_path = "%s.tmp" % self.plan_path
+        with open(temp_path, 'w') as plan_file:
+            json.dump(plan.to_dict(), plan_file, indent=2)
+        os.rename(temp_path, self.plan_path)
+
+    def plan(self, key, compile_fn, save=True):
+        """(plan, True if it was compiled rather than loaded)"""
+        plan = self.load(key)
+        if plan is not None:
+            return plan, False
+        plan = self.compile(key, compile_fn)
+        if save:
+            self.save(plan)
+        return plan, True
@@ -0,0 +1,89 @@
+######################################################################
+# Bootstrap state
+#
+# In-memory index of the entries recorded in bootstrap.lock (cloned repo
+# urls, boot scripts that ran, bootstrap markers). The lock file is read
+# once; each new entry is appended to it as a JSON record and fsync'd so
+# a crash never loses a completed step. Lines written by older agents
+# (one plain entry per line) are still understood.
+######################################################################
+import json
+import os
+import threading
+import time
+
+
+class BootstrapState(object):
+    """Set of completed bootstrap entries backed by an append-only lock file"""
+
+    def __init__(self, lock_file_path, markers=()):
+        self.lock_file_path = lock_file_path
+        # older agents wrote some markers without a trailing newline, so a
+        # following entry may be glued onto the same line
+        self._markers = markers
+        self._entries = set()
+        self._lock = threading.Lock()
+        self._file_id = None
+        self._loaded = False
+
+    def load(self):
+        with self._lock:
+            self._entries = set()
+            if not os.path.isfile(self.lock_file_path):
+                # touch the bootstrap lock file to indicate we have started to run through it
+                with open(self.lock_file_path, 'a'):
+                    pass
+            with open(self.lock_file_path, 'r') as lock_file:
+                for line in lock_file:
+                    self._parse_line(line.rstrip('\n'))
+            self._file_id = self._stat()
+            self._loaded = True
+        return len(self._entries)
+
+    def _parse_line(self, line):
+        if not line:
+            return
+        if line.startswith('{'):
+            try:
+                self._entries.add(json.loads(line)['entry'])
+                return
+            except (ValueError, KeyError, TypeError):
+                pass
+        for marker in self._markers:
+            if line.startswith(marker) and line != marker:
+                self._entries.add(marker)
+                line = line[len(marker):]
+        self._entries.add(line)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.lock_file_path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def refresh(self):
+        """Reload if the lock file was removed or replaced, so people can still delete it to rerun everything"""
+        if not self._loaded or self._stat() != self._file_id:
+            self.load()
+
+    def __contains__(self, entry):
+        if not self._loaded:
+            self.load()
+        return entry in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def mark(self, entry):
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            if entry in self._entries:
+                return
+            record = json.dumps({'entry': entry, 'time': time.time()})
+            with open(self.lock_file_path, 'a') as lock_file:
+                lock_file.write("%s\n" % record)
+                lock_file.flush()
+                os.fsync(lock_file.fileno())
+            self._entries.add(entry)
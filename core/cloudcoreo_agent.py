@@ -4,138 +4,254 @@
 #
 ######################################################################
 import time
-import boto3
 import json
 import logging
 import string
 import traceback
 import subprocess
 import argparse
-from tempfile import mkstemp
 
 import os
 import shutil
 import uuid
 import re
-import requests
 import stat
 import sys
-import yaml
 import socket
+import threading
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 from core import __version__
+from core.boot_plan import BootPlanner
+from core.bootstrap_state import BootstrapState
+from core.config import ConfigError, load_config, save_config
+from core.dispatch import MessageDispatcher, PRIORITY_CONTROL
+from core.environment import EnvironmentBuilder
+from core.git_cache import GitMirrorCache
+from core.git_ssh import GitSSHSession
+from core.governor import CgroupV2, GovernedRun, ScriptLimits, LIMIT_OPTIONS, LIMIT_OUTPUT
+from core.lazy import LazyModule
+from core.log_pipeline import LogBuffer, LogShipper, DEFAULT_FLUSH_INTERVAL, \
+    DEFAULT_MAX_ENTRIES as DEFAULT_MAX_LOG_ENTRIES, DEFAULT_MAX_BYTES as DEFAULT_MAX_LOG_BYTES
+from core.message_store import ProcessedMessageStore, DEFAULT_TTL, DEFAULT_MAX_ENTRIES
+from core.metadata import MetadataClient, MetadataError, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from core.metrics import MetricsRegistry
+from core.op_script_index import OperationalScriptIndex
+from core.output_capture import relay_output
+from core.output_spool import OutputSpooler, DEFAULT_CHUNK_BYTES, MAX_CHUNK_BYTES
+from core.overrides import OverrideApplier, OverrideManifest
+from core.runtime import AgentRuntime
+from core.script_executor import ScriptExecutor, DEFAULT_SCRIPT_WORKERS, DEFAULT_SCRIPT_CONCURRENCY, \
+    DEFAULT_COALESCE_WINDOW
+from core.telemetry import ProcSampler, TelemetryCollector, DEFAULT_SAMPLE_INTERVAL
+from core.transport import Boto3Transport
+from core.workers import WorkerPool
+
+# only imported once they are first used, so --version and --check-config start fast
+boto3 = LazyModule('boto3')
+yaml = LazyModule('yaml')
 
 # times are in seconds
 SQS_GET_MESSAGES_SLEEP_TIME = 10
 MAX_EXCEPTION_WAIT_DELAY = 60
-HEARTBEAT_INTERVAL = 3600
+DEFAULT_HEARTBEAT_INTERVAL = 3600
+HEARTBEAT_INTERVAL = DEFAULT_HEARTBEAT_INTERVAL
 BOOTSCRIPT_LOG_INTERVAL = 10
 SQS_VISIBILITY_TIMEOUT = 0
-
-SNS_CLIENT = None
-SQS_CLIENT = None
+# SQS returns at most 10 messages per receive and accepts at most 10 entries per batch delete
+SQS_MAX_MESSAGES = 10
+DEFAULT_SQS_WORKERS = 4
+DEFAULT_OVERRIDE_WORKERS = 4
+# runtime: 'loop' runs everything from main_loop(), 'threaded' gives each job its own thread
+RUNTIME_LOOP = 'loop'
+RUNTIME_THREADED = 'threaded'
+
+# SQS/SNS access, see core/transport.py
+TRANSPORT = None
+MESSAGE_WORKERS = None
+MESSAGE_DISPATCHER = None
+SCRIPT_EXECUTOR = None
+TELEMETRY = None
 logging.basicConfig()
 DEFAULT_CONFIG_FILE_LOCATION = '/etc/cloudcoreo/agent.conf'
+COMMAND_LINE = None
+REQUIRED_CONFIG_OPTIONS = ('coreo_access_id', 'coreo_access_key', 'queue_url', 'topic_arn', 'work_dir')
 # globals for caching
-MY_AZ = None
+METADATA_CLIENT = None
 COMPLETE_STRING = "COREO::BOOTSTRAP::complete"
 SENT_OP_SCRIPTS_STRING = "COREO::BOOTSTRAP::opscripts_sent"
 OPTIONS_FROM_CONFIG_FILE = None
 LOCK_FILE_PATH = ''
+# the compiled boot plan, next to the lock file in work_dir
+BOOT_PLAN_FILE = 'boot-plan.json'
+BOOTSTRAP_STATE = None
+OP_SCRIPT_INDEX = None
+ENVIRONMENT_BUILDER = None
+# resource limits for scripts: script_<limit> options, overridden per script by script_limits
+SCRIPT_LIMITS = ScriptLimits()
+# reported as the return code of an operational script that couldn't be run at all
+OP_SCRIPT_FAILED = -1
+SCRIPT_CGROUPS = CgroupV2()
 PIP_PACKAGE_NAME = 'run_client'
+# PROCESSED_SQS_MESSAGES_DICT_PATH is only read to migrate ids saved by older agents
 PROCESSED_SQS_MESSAGES_DICT_PATH = '/tmp/processed-messages.txt'
-LOGS = []
-PROCESSED_SQS_MESSAGES = {}
+PROCESSED_SQS_MESSAGES_JOURNAL_PATH = '/tmp/processed-messages.journal'
+LOGS = LogBuffer()
+LOG_SHIPPER = None
+# script_output_mode: lines copies script output into LOGS, spool ships it from the log file in chunks
+OUTPUT_MODE_LINES = 'lines'
+OUTPUT_MODE_SPOOL = 'spool'
+OUTPUT_SPOOLER = None
+# set while no bootstrap attempt is running; runcommand requests that arrive before then are held
+BOOTSTRAP_SETTLED = threading.Event()
+DEFERRED_SCRIPT_MESSAGES = []
+DEFERRED_SCRIPT_LOCK = threading.Lock()
+METRICS = MetricsRegistry()
+PROCESSED_SQS_MESSAGES = None
 ALL_SERVERS_TARGET = "COREO::ALL_SERVERS"
+# git_clone_mode: full clones everything, shallow fetches only a pinned revision,
+# filtered clones history without file contents until they are checked out
+GIT_CLONE_FULL = 'full'
+GIT_CLONE_SHALLOW = 'shallow'
+GIT_CLONE_FILTERED = 'filtered'
+DEFAULT_GIT_SUBMODULE_JOBS = 4
+# git submodule update --jobs needs git 2.9
+GIT_VERSION = None
 
 # sort directories by extends, stack-, overrides, services, shutdown-, boot-, operational-
 PRECEDENCE_ORDER = {'t': 0, 'e': 1, 's': 2, 'p': 3, 'v': 4, 'o': 5, 'b': 6}
+# how precedence_walk treats a directory, first match wins: (pattern, label, when to descend into it)
+DESCEND_ALWAYS = 'always'
+DESCEND_ON_OVERRIDE = 'override'
+DESCEND_NEVER = 'never'
+PRECEDENCE_DIR_RULES = [
+    (re.compile(r'\.git'), 'git', DESCEND_NEVER),
+    (re.compile('extends'), 'extends', DESCEND_ALWAYS),
+    (re.compile('stack-'), 'stack-', DESCEND_ALWAYS),
+    (re.compile('overrides'), 'overrides', DESCEND_ON_OVERRIDE),
+]
+PRECEDENCE_DIR_DEFAULT = ('any directory for override', DESCEND_ON_OVERRIDE)
+# directory names repeat all over a composite repo, so classify and key each name only once
+PRECEDENCE_DIR_CACHE = {}
 
 
 def log(log_text):
     log_text = str(log_text)
     print log_text
-    log_dict = {'log_message': log_text, 'date': time.time()}
-    LOGS.append(log_dict)
+    LOGS.add(log_text)
 
 
 def read_processed_messages_from_file():
-    if os.path.isfile(PROCESSED_SQS_MESSAGES_DICT_PATH):
-        log("checking for unprocessed SQS messages in file %s" % PROCESSED_SQS_MESSAGES_DICT_PATH)
-        try:
-            return eval(open(PROCESSED_SQS_MESSAGES_DICT_PATH, 'r').read())
-        except Exception as ex:
-            log(ex)
-    else:
-        log("no messages to process in file %s" % PROCESSED_SQS_MESSAGES_DICT_PATH)
-
-    return {}
+    store = ProcessedMessageStore(PROCESSED_SQS_MESSAGES_JOURNAL_PATH,
+                                  ttl=int(OPTIONS_FROM_CONFIG_FILE.processed_messages_ttl or DEFAULT_TTL),
+                                  max_entries=int(OPTIONS_FROM_CONFIG_FILE.processed_messages_max or DEFAULT_MAX_ENTRIES))
+    log("checking for processed SQS messages in file %s" % PROCESSED_SQS_MESSAGES_JOURNAL_PATH)
+    try:
+        num_loaded = store.load(legacy_path=PROCESSED_SQS_MESSAGES_DICT_PATH)
+        log("loaded %d processed SQS message ids" % num_loaded)
+    except Exception as ex:
+        log(ex)
+    return store
 
 
 def publish_to_sns(message_text, subject, topic_arn):
     if not OPTIONS_FROM_CONFIG_FILE.debug:
-        sns_response = SNS_CLIENT.publish(
-            TopicArn=topic_arn,
-            Subject=subject,
-            Message=json.dumps(message_text)
-        )
+        with METRICS.span('sns_publish', subject=subject):
+            sns_response = TRANSPORT.publish(topic_arn, subject, json.dumps(message_text))
         return sns_response
 
 
 def get_sqs_messages(queue_url):
-    response = SQS_CLIENT.receive_message(
-        QueueUrl=queue_url,
-        VisibilityTimeout=SQS_VISIBILITY_TIMEOUT,
-        WaitTimeSeconds=20
-    )
+    with METRICS.span('sqs_receive'):
+        response = TRANSPORT.receive(queue_url, SQS_MAX_MESSAGES, 20, SQS_VISIBILITY_TIMEOUT)
+    METRICS.inc('sqs_messages_received_total', len(response.get(u'Messages', [])) if response else 0)
     return response
 
 
-class DotDict(dict):
-    """dot.notation access to dictionary attributes"""
+def delete_sqs_messages(queue_url, messages):
+    for start in range(0, len(messages), SQS_MAX_MESSAGES):
+        entries = [{'Id': str(index), 'ReceiptHandle': message[u'ReceiptHandle']}
+                   for index, message in enumerate(messages[start:start + SQS_MAX_MESSAGES])]
+        with METRICS.span('sqs_delete'):
+            response = TRANSPORT.delete_batch(queue_url, entries)
+        for failure in response.get(u'Failed', []):
+            log("error deleting SQS message [%s]: %s" % (failure[u'Id'], failure.get(u'Message')))
 
-    def __getattr__(self, attr):
-        return self.get(attr)
 
-    __setattr__ = dict.__setitem__
-    __delattr__ = dict.__delitem__
+def parse_command_line():
+    # parsed once; the version, config path and check flags all come from the same arguments
+    global COMMAND_LINE
+    if COMMAND_LINE is None:
+        parser = argparse.ArgumentParser(description='CloudCoreo agent')
+        parser.add_argument('--config', help="Set config file location")
+        parser.add_argument('--version', action='store_true', help="Get script version")
+        parser.add_argument('--check-config', action='store_true', help="Validate the config file and exit")
+        parser.add_argument('--plan', action='store_true', help="Print the boot script plan without running anything")
+        COMMAND_LINE = parser.parse_args()
+    return COMMAND_LINE
 
 
 def get_config_path():
-    parser = argparse.ArgumentParser(description='Get config file path')
-    parser.add_argument('--config', help="Set config file location")
-    config_file_location_from_console = parser.parse_args().config
+    config_file_location_from_console = parse_command_line().config
     config_file_location = config_file_location_from_console or DEFAULT_CONFIG_FILE_LOCATION
     return config_file_location
 
 
+def check_configs(options):
+    """Problems with the loaded config, empty when it looks usable"""
+    problems = ["missing required option [%s]" % name for name in REQUIRED_CONFIG_OPTIONS if not options.get(name)]
+    if options.topic_arn and len(str(options.topic_arn).split(':')) != 6:
+        problems.append("topic_arn [%s] is not an SNS topic ARN" % options.topic_arn)
+    if options.runtime and options.runtime not in (RUNTIME_LOOP, RUNTIME_THREADED):
+        problems.append("runtime must be %s or %s" % (RUNTIME_LOOP, RUNTIME_THREADED))
+    if options.git_clone_mode and options.git_clone_mode not in (GIT_CLONE_FULL, GIT_CLONE_SHALLOW, GIT_CLONE_FILTERED):
+        problems.append("git_clone_mode must be one of %s, %s, %s" %
+                        (GIT_CLONE_FULL, GIT_CLONE_SHALLOW, GIT_CLONE_FILTERED))
+    if options.script_output_mode and options.script_output_mode not in (OUTPUT_MODE_LINES, OUTPUT_MODE_SPOOL):
+        problems.append("script_output_mode must be %s or %s" % (OUTPUT_MODE_LINES, OUTPUT_MODE_SPOOL))
+    if options.script_output_chunk_bytes is not None and not 0 < options.script_output_chunk_bytes <= MAX_CHUNK_BYTES:
+        problems.append("script_output_chunk_bytes must be between 1 and %d so a chunk fits in one SNS message" %
+                        MAX_CHUNK_BYTES)
+    problems.extend(script_limits_problems(options.script_limits))
+    return problems
+
+
+def script_limits_problems(script_limits):
+    # checked up front: ScriptLimits only rejects a bad entry when that script runs
+    problems = []
+    for script_name, overrides in sorted((script_limits or {}).items()):
+        if not isinstance(overrides, dict):
+            problems.append("script_limits for [%s] is not a mapping" % script_name)
+            continue
+        unknown = sorted(set(overrides) - set(LIMIT_OPTIONS))
+        if unknown:
+            problems.append("script_limits for [%s] has unknown limits: %s (expected %s)" %
+                            (script_name, ", ".join(unknown), ", ".join(LIMIT_OPTIONS)))
+    return problems
+
+
 def get_configs(conffile=''):
-    config_file_location = get_config_path()
-    if conffile:
-        config_file_location = conffile
+    config_file_location = conffile or get_config_path()
     print '*Reading configs from ' + config_file_location
-    with open(config_file_location, 'r') as ymlfile:
-        configs = yaml.load(ymlfile)
-    return DotDict(configs)
+    return load_config(config_file_location)
 
 
 def set_agent_uuid():
-    config_file_location = get_config_path()
-    with open(config_file_location, 'r') as ymlfile:
-        configs = yaml.load(ymlfile)
+    # try to use ec2 instance-id as uuid
+    agent_uuid = ec2_instance_id()
+    if not agent_uuid:
+        # if we can't get instance-id, generate a uuid
+        agent_uuid = uuid.uuid1()
+        log("generating uuid")
 
     # Save agent_uuid to config file
-    with open(config_file_location, 'w') as ymlfile:
-        # try to use ec2 instance-id as uuid
-        agent_uuid = ec2_instance_id()
-        if not agent_uuid:
-            # if we can't get instance-id, generate a uuid
-            agent_uuid = uuid.uuid1()
-            log("generating uuid")
-        configs['agent_uuid'] = str(agent_uuid)
-        ymlfile.write(yaml.dump(configs, default_style="'"))
-
     global OPTIONS_FROM_CONFIG_FILE
-    OPTIONS_FROM_CONFIG_FILE = get_configs()
+    OPTIONS_FROM_CONFIG_FILE = save_config(OPTIONS_FROM_CONFIG_FILE, agent_uuid=str(agent_uuid))
     log("OPTIONS.agent_uuid: %s" % OPTIONS_FROM_CONFIG_FILE.agent_uuid)
 
 
@@ -158,13 +274,22 @@ def create_message_template(message_type, data):
     return message
 
 
+def publish_log_batch(log_entries):
+    message_with_logs_for_webapp = create_message_template("SCRIPT_LOGS", log_entries)
+    publish_to_sns(message_with_logs_for_webapp, 'AGENT_LOGS', OPTIONS_FROM_CONFIG_FILE.topic_arn)
+
+
+def publish_output_chunk(chunk):
+    message = create_message_template("SCRIPT_OUTPUT", chunk)
+    publish_to_sns(message, 'AGENT_LOGS', OPTIONS_FROM_CONFIG_FILE.topic_arn)
+
+
 def publish_agent_logs():
-    message_with_logs_for_webapp = create_message_template("SCRIPT_LOGS", LOGS)
-    try:
-        publish_to_sns(message_with_logs_for_webapp, 'AGENT_LOGS', OPTIONS_FROM_CONFIG_FILE.topic_arn)
-        del LOGS[:]
-    except Exception as ex:
-        log(ex)
+    # the shipper publishes from its own thread; before the agent starts logs just stay buffered
+    if LOG_SHIPPER is not None:
+        LOG_SHIPPER.request_flush()
+    if OUTPUT_SPOOLER is not None:
+        OUTPUT_SPOOLER.request_flush()
 
 
 def publish_agent_online():
@@ -178,36 +303,66 @@ def publish_agent_online():
     publish_to_sns(message, 'AGENT_INFO', OPTIONS_FROM_CONFIG_FILE.topic_arn)
 
 
+def agent_internals():
+    internals = {'log_buffer_depth': len(LOGS)}
+    if MESSAGE_WORKERS is not None:
+        internals['pending_messages'] = MESSAGE_WORKERS.pending()
+    if SCRIPT_EXECUTOR is not None:
+        internals['pending_scripts'] = len(SCRIPT_EXECUTOR.pending())
+        internals['running_scripts'] = len(SCRIPT_EXECUTOR.running())
+        internals['coalesced_script_requests'] = SCRIPT_EXECUTOR.coalesced
+    if OUTPUT_SPOOLER is not None:
+        internals['spooled_outputs'] = OUTPUT_SPOOLER.stats()['tracked']
+    return internals
+
+
 def publish_agent_heartbeat():
     message_data = {
         "load": json.dumps(os.getloadavg())
     }
+    if TELEMETRY is not None:
+        message_data["telemetry"] = TELEMETRY.take_summary()
+    if MESSAGE_DISPATCHER is not None:
+        message_data["messages"] = MESSAGE_DISPATCHER.stats()
     message = create_message_template("AGENT_HEARTBEAT", message_data)
     publish_to_sns(message, 'AGENT_INFO', OPTIONS_FROM_CONFIG_FILE.topic_arn)
+    publish_agent_metrics()
+
+
+def publish_agent_metrics():
+    metrics_file = OPTIONS_FROM_CONFIG_FILE.metrics_file or "%s/agent-metrics.prom" % OPTIONS_FROM_CONFIG_FILE.work_dir
+    try:
+        METRICS.write_prometheus(metrics_file)
+    except (IOError, OSError) as ex:
+        log("error writing metrics to [%s]: %s" % (metrics_file, ex))
+    message = create_message_template("AGENT_METRICS", METRICS.snapshot())
+    publish_to_sns(message, 'AGENT_INFO', OPTIONS_FROM_CONFIG_FILE.topic_arn)
 
 
-def publish_script_result(script_name, script_return_code):
+def publish_script_result(script_name, script_return_code, limits_hit=None, error=None):
     message_data = {
         "script_name": script_name,
-        "return_code": script_return_code
+        "return_code": script_return_code,
+        "limits_hit": limits_hit or []
     }
+    if error is not None:
+        message_data["error"] = error
     message = create_message_template("SCRIPT_RESULT", message_data)
     publish_to_sns(message, 'AGENT_INFO', OPTIONS_FROM_CONFIG_FILE.topic_arn)
 
 
 def publish_op_scripts(repo_dir, server_name):
-    if SENT_OP_SCRIPTS_STRING in open(LOCK_FILE_PATH, 'r').read():
+    if SENT_OP_SCRIPTS_STRING in BOOTSTRAP_STATE:
         log("already sent operational scripts")
         return
 
-    op_scripts = collect_operational_scripts(repo_dir, server_name)
+    op_scripts = OP_SCRIPT_INDEX.scripts(repo_dir, server_name)
     # remove path from scripts
     message_data = [os.path.basename(test_file) for test_file in op_scripts]
     message = create_message_template("OP_SCRIPTS", message_data)
     publish_to_sns(message, 'AGENT_INFO', OPTIONS_FROM_CONFIG_FILE.topic_arn)
 
-    with open(LOCK_FILE_PATH, 'a') as lockFile:
-        lockFile.write("%s\n" % SENT_OP_SCRIPTS_STRING)
+    BOOTSTRAP_STATE.mark(SENT_OP_SCRIPTS_STRING)
 
 
 def collect_operational_scripts(repo_dir, server_name):
@@ -218,14 +373,10 @@ def collect_operational_scripts(repo_dir, server_name):
 
 
 def get_availability_zone():
-    # cached
-    global MY_AZ
-    if MY_AZ is None:
-        if OPTIONS_FROM_CONFIG_FILE.debug:
-            MY_AZ = 'us-east-1a'
-        else:
-            MY_AZ = meta_data("placement/availability-zone")
-    return MY_AZ
+    # cached by the metadata client
+    if OPTIONS_FROM_CONFIG_FILE.debug:
+        return 'us-east-1a'
+    return meta_data("placement/availability-zone")
 
 
 def get_region():
@@ -239,14 +390,15 @@ def ec2_instance_id():
 
 
 def meta_data(data_path):
-    # using 169.254.169.254 instead of 'instance-data' because some people
-    # like to modify their dhcp tables...
-    url = 'http://169.254.169.254/latest/meta-data/%s' % data_path
-    resp = requests.get(url)
-    if 200 <= resp.status_code < 300:
-        return resp.text
-    else:
-        log("error [%d] retrieving metadata: %s" % (resp.status_code, url))
+    global METADATA_CLIENT
+    if METADATA_CLIENT is None:
+        METADATA_CLIENT = MetadataClient(
+            connect_timeout=float(OPTIONS_FROM_CONFIG_FILE.metadata_connect_timeout or DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=float(OPTIONS_FROM_CONFIG_FILE.metadata_read_timeout or DEFAULT_READ_TIMEOUT))
+    try:
+        return METADATA_CLIENT.get(data_path)
+    except MetadataError as ex:
+        log(ex)
     return ''
 
 
@@ -280,91 +432,158 @@ def mkdir_p(path):
 def clone_for_asi(branch, revision, repo_url, key_material, work_dir):
     gitError = False
 
-    if repo_url.strip() in open(LOCK_FILE_PATH, 'r').read():
+    if repo_url.strip() in BOOTSTRAP_STATE:
         log("skipping git clone for repo [%s]. Already cloned." % repo_url.strip())
         return gitError
 
-    fd, temp_key_path = mkstemp()
-
-    # lets write the private key material to a temp file
-    # this creates a file in the most secure way possible
-    # so no chmod is necessary
-    pkey = open(temp_key_path, 'w')
-    log("writing private key material to %s" % temp_key_path)
-    pkey.write(key_material)
-    pkey.close()
-    os.close(fd)
-
-    # now we need to have the public key there as well
-    # p = subprocess.Popen(['ssh-keygen', '-y', '-f', temp_key_path, '>', "%s.pub" % temp_key_path],
-    #                      stdin=subprocess.PIPE,
-    #                      stdout=subprocess.PIPE,
-    #                      stderr=subprocess.PIPE,
-    #                      preexec_fn=os.setsid
-    #                      )
-
-    # now we set up the git-ssh wrapper script
-    fd_ssh, ssh_wrapper_path = mkstemp()
-    log("writing ssh wrapper script to %s" % ssh_wrapper_path)
-    wrap = open(ssh_wrapper_path, 'w')
-    wrap.write("""#!/bin/sh
-/usr/bin/ssh -o StrictHostKeyChecking=no -i "%s" "$@" 
-    """ % temp_key_path)
-    wrap.close()
-    os.close(fd_ssh)
-    st = os.stat(ssh_wrapper_path)
-    os.chmod(ssh_wrapper_path, st.st_mode | stat.S_IEXEC)
+    # the session writes the private key and the ssh wrapper script to a private temp directory.
+    # Every git command of this bootstrap shares one multiplexed ssh connection through it.
+    session = GitSSHSession(key_material).open()
+    log("writing private key material and ssh wrapper script to %s" % session.session_dir)
+    try:
+        gitError = clone_with_session(session, branch, revision, repo_url, work_dir)
+    finally:
+        log("removing temporary files for git operations")
+        session.close()
+    log("git phase times: %s" % ", ".join("%s %.2fs" % phase for phase in session.phase_times.items()))
+
+    # If all git operations succeeded, mark that repo was cloned successfully. On failure the
+    # partial clone is kept so the next attempt can fetch into it.
+    if not gitError:
+        BOOTSTRAP_STATE.mark(repo_url.strip())
+
+    return gitError
+
 
+def clone_with_session(session, branch, revision, repo_url, work_dir):
     # now we do the cloning
     mkdir_p(work_dir)
-    log("os.chdir(%s)" % work_dir)
-    os.chdir(work_dir)
-    log("cloning repo from url: %s" % repo_url.strip())
-    process = git(ssh_wrapper_path, work_dir, "clone", repo_url.strip(), "repo")
-    log("git clone returned: %s" % process.returncode)
-    if process.returncode != 0:
-        gitError = True
-    log("os.chdir(%s/repo)" % work_dir)
-    os.chdir("%s/repo" % work_dir)
-
-    if branch is not None:
-        log("checking out branch %s" % branch)
-        process = git(ssh_wrapper_path, "%s/repo" % work_dir, "checkout", branch)
-        log("git checkout branch returned: %s" % process.returncode)
-        if process.returncode != 0:
-            gitError = True
+    repo_dir = "%s/repo" % work_dir
+    clone_mode = OPTIONS_FROM_CONFIG_FILE.git_clone_mode or GIT_CLONE_FULL
+    if clone_mode == GIT_CLONE_SHALLOW and revision is None:
+        log("shallow clone needs a pinned revision, doing a full clone")
+        clone_mode = GIT_CLONE_FULL
+    if clone_mode == GIT_CLONE_FILTERED and git_version() < (2, 19):
+        # older git rejects --filter outright
+        log("filtered clone needs git 2.19 or later, doing a full clone")
+        clone_mode = GIT_CLONE_FULL
+
+    gitError = True
+    if os.path.isdir(os.path.join(repo_dir, ".git")):
+        origin_url = git_origin_url(repo_dir)
+        if origin_url != repo_url.strip():
+            log("existing clone at %s is of [%s], not [%s]" % (repo_dir, origin_url, repo_url.strip()))
+        else:
+            # an earlier attempt got this far, so only fetch what it is missing instead of cloning again
+            log("fetching into existing clone at %s" % repo_dir)
+            # --force: overrides leave submodule files modified, which would block moving the submodule
+            gitError = not (fetch_for_asi(session, repo_dir, revision, clone_mode) and
+                            checkout_for_asi(session, repo_dir, branch, revision, clone_mode) and
+                            update_submodules(session, repo_dir, force=True))
+        if gitError:
+            # a broken or foreign checkout would fail the same way on every attempt, so start over
+            log("cloning again instead of reusing %s" % repo_dir)
 
-    if revision is not None:
-        log("checking out revision %s" % revision)
-        process = git(ssh_wrapper_path, "%s/repo" % work_dir, "checkout", revision)
-        log("git checkout revision returned: %s" % process.returncode)
-        if process.returncode != 0:
-            gitError = True
+    if gitError:
+        if os.path.isdir(repo_dir):
+            shutil.rmtree(repo_dir)
+        log("cloning repo from url: %s" % repo_url.strip())
+        gitError = not (initial_clone_for_asi(session, work_dir, repo_url.strip(), revision, clone_mode) and
+                        checkout_for_asi(session, repo_dir, branch, revision, clone_mode) and
+                        update_submodules(session, repo_dir))
 
+    return gitError
+
+
+def update_submodules(session, repo_dir, force=False):
     log("starting recursive checkout")
-    process = git(ssh_wrapper_path, "%s/repo" % work_dir, "submodule", "update", "--recursive", "--init")
-    log("git submodule checkout returned: %s" % process.returncode)
-    if process.returncode != 0:
-        gitError = True
+    submodule_args = ["submodule", "update", "--recursive", "--init"]
+    if force:
+        submodule_args.append("--force")
+    submodule_jobs = int(OPTIONS_FROM_CONFIG_FILE.git_submodule_jobs or DEFAULT_GIT_SUBMODULE_JOBS)
+    if submodule_jobs > 1 and git_version() >= (2, 9):
+        submodule_args += ["--jobs", str(submodule_jobs)]
+    ok = git_ok(session, repo_dir, *submodule_args)
     log("completed recursive checkout")
+    return ok
 
-    log("removing temporary files for git operations")
-    os.remove(temp_key_path)
-    os.remove(ssh_wrapper_path)
 
-    # If all git operations succeeded, mark that repo was cloned successfully
-    if gitError:
-        shutil.rmtree("%s/repo" % work_dir)
+def git_origin_url(repo_dir):
+    try:
+        output = subprocess.Popen(['git', 'config', '--get', 'remote.origin.url'], cwd=repo_dir,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+    except OSError:
+        return None
+    return output.strip() or None
+
+
+def checkout_for_asi(session, repo_dir, branch, revision, clone_mode):
+    # -f because overrides leave tracked files modified; -B so the branch is the tip just fetched,
+    # not whatever a previous attempt left checked out
+    if branch is not None and clone_mode != GIT_CLONE_SHALLOW:
+        log("checking out branch %s" % branch)
+        if not git_ok(session, repo_dir, "checkout", "-f", "-B", branch, "origin/%s" % branch):
+            return False
+    if revision is not None:
+        log("checking out revision %s" % revision)
+        if not git_ok(session, repo_dir, "checkout", "-f", revision):
+            return False
+    return True
+
+
+def initial_clone_for_asi(session, work_dir, repo_url, revision, clone_mode):
+    repo_dir = "%s/repo" % work_dir
+    if clone_mode == GIT_CLONE_SHALLOW:
+        return git_ok(session, work_dir, "init", "repo") and \
+            git_ok(session, repo_dir, "remote", "add", "origin", repo_url) and \
+            fetch_for_asi(session, repo_dir, revision, clone_mode)
+
+    clone_args = ["clone"]
+    mirror_dir = None
+    # --dissociate (git 2.3+) copies the borrowed objects, so pruning the mirror can never break the clone
+    if git_version() >= (2, 3):
+        mirror_dir = GitMirrorCache(OPTIONS_FROM_CONFIG_FILE.git_mirror_dir or "%s/git-mirrors" % work_dir).update(
+            repo_url, lambda cwd, *args: git_ok(session, cwd, *args))
+    if mirror_dir:
+        clone_args += ["--reference", mirror_dir, "--dissociate"]
     else:
-        with open(LOCK_FILE_PATH, 'a') as lockFile:
-            lockFile.write("%s\n" % repo_url.strip())
+        log("no local mirror of %s, cloning without one" % repo_url)
+    if clone_mode == GIT_CLONE_FILTERED:
+        clone_args += ["--filter=blob:none"]
+    return git_ok(session, work_dir, *(clone_args + [repo_url, "repo"]))
+
+
+def fetch_for_asi(session, repo_dir, revision, clone_mode):
+    if clone_mode == GIT_CLONE_SHALLOW:
+        if git_ok(session, repo_dir, "fetch", "--depth", "1", "origin", revision):
+            return True
+        # not every server lets a client fetch an arbitrary sha
+        log("shallow fetch of revision %s failed, fetching full history" % revision)
+    return git_ok(session, repo_dir, "fetch", "origin")
+
+
+def git_ok(session, git_dir, *args):
+    phase = " ".join(args[:2]) if args[0] in ("remote", "submodule") or "--mirror" in args else args[0]
+    started = time.time()
+    process = git(session.wrapper_path, git_dir, *args)
+    session.record(phase, time.time() - started)
+    log("git %s returned: %s" % (phase, process.returncode))
+    return process.returncode == 0
 
-    return gitError
+
+def git_version():
+    global GIT_VERSION
+    if GIT_VERSION is None:
+        try:
+            output = subprocess.Popen(['git', '--version'], stdout=subprocess.PIPE).communicate()[0]
+            GIT_VERSION = tuple(int(part) for part in re.findall(r'\d+', output)[:3])
+        except OSError:
+            GIT_VERSION = ()
+    return GIT_VERSION
 
 
 def git(ssh_wrapper, git_dir, *args):
-    log("setting environment GIT_SSH=%s" % ssh_wrapper)
-    os.environ['GIT_SSH'] = "%s" % ssh_wrapper
+    log("using GIT_SSH=%s" % ssh_wrapper)
     log("cwd=%s" % git_dir)
     log("running command: %s" % str(['git'] + list(args)))
     p = subprocess.Popen(['git'] + list(args),
@@ -373,26 +592,22 @@ def git(ssh_wrapper, git_dir, *args):
                          stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE,
                          preexec_fn=os.setsid,
-                         shell=False
+                         shell=False,
+                         env=dict(os.environ, GIT_SSH=ssh_wrapper)
                          )
     (std_out_data, std_err_data) = p.communicate()
     log("(std_out_data, std_err_data) = (%s, %s)" % (std_out_data, std_err_data))
     return p
 
 
-def get_environment_dict():
-    environment = {}
-    asi_vars = get_coreo_appstackinstance_config()
-    all_vars = {'variables': asi_vars}
-    for var in all_vars['variables']:
-        value = all_vars['variables'][var]
-        # if ! value['value'].nil? then
-        if 'value' in value.keys() and value['value'] is not None:
-            # environment[var.to_s] = value['value']
-            environment[var] = value['value']
-        else:
-            # elsif ! value['default'].nil? then
-            environment[var] = value.get('default', '')
+def get_environment():
+    # parsed again only when appstack_instance_config.out or env.out changed since the last script
+    rebuilt = ENVIRONMENT_BUILDER.rebuild_needed()
+    environment = ENVIRONMENT_BUILDER.build()
+    if rebuilt:
+        log("built script environment from %s and %s: %s" % (ENVIRONMENT_BUILDER.instance_config_path,
+                                                            ENVIRONMENT_BUILDER.env_out_path,
+                                                            ENVIRONMENT_BUILDER.instance_variables()))
     return environment
 
 
@@ -429,85 +644,155 @@ def get_script_order_files(root_dir, server_name):
 ## </DEPRECATED_CODE>
 
 
-def precedence_walk(start_dir, look_for, stackdash="", override=False, debug=False):
-    collected = []
-    walk_params = next(os.walk(start_dir, topdown=True))
-    for dirname in sorted(walk_params[1], key=lambda word: [PRECEDENCE_ORDER.get(c, ord(c)) for c in word]):
-        full_path = os.path.join(start_dir, dirname)
-        debug_path = re.sub('.*/repo', 'repo', start_dir)
-        if ".git" in dirname:
-            if debug: log("skipping git directory %s/%s : git" % (debug_path, dirname))
-            continue
-        elif "extends" in dirname:
-            if debug: log("got %s/%s : extends" % (debug_path, dirname))
-            collected.extend(precedence_walk(full_path, look_for, stackdash, override, debug))
-        elif "stack-" in dirname:
-            if debug: log("got %s/%s : stack-" % (debug_path, dirname))
-            collected.extend(precedence_walk(full_path, look_for, stackdash, override, debug))
-        elif "overrides" in dirname and override:
-            if debug: log("got %s/%s : overrides" % (debug_path, dirname))
-            collected.extend(precedence_walk(full_path, look_for, stackdash, override, debug))
-        elif override:
-            if debug: log("got %s/%s : any directory for override" % (debug_path, dirname))
-            collected.extend(precedence_walk(full_path, look_for, stackdash, override, debug))
+class _ListdirEntry(object):
+    """Stand-in for os.scandir entries when neither os.scandir nor the scandir package is available"""
+
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+
+def scan_dir(path):
+    if scandir is not None:
+        return scandir(path)
+    return [_ListdirEntry(path, name) for name in os.listdir(path)]
+
+
+def classify_precedence_dir(dirname):
+    """(sort key, label, when to descend) for a directory name"""
+    cached = PRECEDENCE_DIR_CACHE.get(dirname)
+    if cached is None:
+        label, descend = PRECEDENCE_DIR_DEFAULT
+        for pattern, rule_label, rule_descend in PRECEDENCE_DIR_RULES:
+            if pattern.search(dirname):
+                label, descend = rule_label, rule_descend
+                break
+        cached = ([PRECEDENCE_ORDER.get(c, ord(c)) for c in dirname], label, descend)
+        PRECEDENCE_DIR_CACHE[dirname] = cached
+    return cached
+
+
+def precedence_walk(start_dir, look_for, stackdash="", override=False, debug=False, applier=None, visited=None):
+    return list(iter_precedence_walk(start_dir, look_for, stackdash, override, debug, applier, visited))
+
+
+def precedence_subdirs(start_dir):
+    """Subdirectories of start_dir in precedence order, each as ((sort key, label, descend), dirname)"""
+    # directory entries (following symlinks, like os.walk and os.path.isfile did) come from a single
+    # scandir pass whose d_type answers is_dir() without a stat on most filesystems
+    subdirs = [(classify_precedence_dir(entry.name), entry.name) for entry in scan_dir(start_dir) if entry.is_dir()]
+    subdirs.sort(key=lambda subdir: subdir[0][0])
+    return subdirs
+
+
+def iter_precedence_walk(start_dir, look_for, stackdash="", override=False, debug=False, applier=None, visited=None):
+    """visited, if given, collects every directory that was listed"""
+    if visited is not None:
+        visited.append(start_dir)
+    for classified, dirname in precedence_subdirs(start_dir):
+        for found in iter_precedence_subdir(start_dir, classified, dirname, look_for, stackdash, override, debug,
+                                            applier, visited):
+            yield found
+
+
+def iter_precedence_subdir(start_dir, classified, dirname, look_for, stackdash, override, debug, applier,
+                           visited=None):
+    (sort_key, label, descend) = classified
+    debug_path = re.sub('.*/repo', 'repo', start_dir) if debug else None
+    full_path = os.path.join(start_dir, dirname)
+    if descend == DESCEND_NEVER:
+        if debug: log("skipping git directory %s/%s : git" % (debug_path, dirname))
+        return
+    elif descend == DESCEND_ALWAYS or override:
+        if debug: log("got %s/%s : %s" % (debug_path, dirname, label))
+        for found in iter_precedence_walk(full_path, look_for, stackdash, override, debug, applier, visited):
+            yield found
+    if debug:
+        for script_dir in ("services", "boot-scripts", "operational-scripts", "shutdown-scripts"):
+            if script_dir in dirname:
+                log("got %s/%s : %s" % (debug_path, dirname, script_dir))
+                break
+
+    # listed after descending: applying overrides below may have added files here
+    if visited is not None:
+        visited.append(full_path)
+    full_debug_path = re.sub('.*/repo', 'repo', full_path) if debug else None
+    for entry in list(scan_dir(full_path)):
+        filename = entry.name
         if debug:
-            if "services" in dirname:
-                log("got %s/%s : services" % (debug_path, dirname))
-            elif "boot-scripts" in dirname:
-                log("got %s/%s : boot-scripts" % (debug_path, dirname))
-            elif "operational-scripts" in dirname:
-                log("got %s/%s : operational-scripts" % (debug_path, dirname))
-            elif "shutdown-scripts" in dirname:
-                log("got %s/%s : shutdown-scripts" % (debug_path, dirname))
-
-        for filename in os.listdir(full_path):
-            debug_path = re.sub('.*/repo', 'repo', full_path)
+            log("considering filename: %s/%s" % (full_debug_path, filename))
+        full_path_filename = os.path.join(full_path, filename)
+        # Only consider files, not directories
+        if not entry.is_file():
             if debug:
-                log("considering filename: %s/%s" % (debug_path, filename))
-            full_path_filename = os.path.join(full_path, filename)
-            # Only consider files, not directories
-            if not os.path.isfile(full_path_filename):
-                if debug:
-                    log("not a file: %s/%s" % (debug_path, filename))
-                continue
-            contains = look_for in full_path_filename and stackdash in full_path_filename
-            if override and contains and "overrides" in full_path_filename:
-                collected.append(full_path_filename)
-                # Just replace first instance of overrides to do the copy
-                dest = re.sub("overrides", "", full_path_filename, 1)
-                if not os.path.isfile(dest):
-                    dest = os.path.dirname(dest)
-                    if not os.path.isdir(dest):
-                        if debug: log("creating directory: %s" % re.sub('.*/repo', 'repo', dest))
-                        os.makedirs(dest)
+                log("not a file: %s/%s" % (full_debug_path, filename))
+            continue
+        contains = look_for in full_path_filename and stackdash in full_path_filename
+        if override and contains and "overrides" in full_path_filename:
+            # Just replace first instance of overrides to do the copy
+            dest = full_path_filename.replace("overrides", "", 1)
+            if not os.path.isfile(dest):
+                dest = os.path.dirname(dest)
+                if not os.path.isdir(dest):
+                    if debug: log("creating directory: %s" % re.sub('.*/repo', 'repo', dest))
+                    os.makedirs(dest)
+            if applier is None:
                 shutil.copy(full_path_filename, dest)
-                if debug:
-                    command = "cp %s %s" % (re.sub('.*/repo', 'repo', full_path_filename), re.sub('.*/repo', 'repo', dest))
-                    log("---> command: %s" % command)
-            elif not override and contains:
-                if debug: log("collecting file: %s" % full_path_filename)
-                collected.append(full_path_filename)
-            elif debug:
-                log("skipping file: %s/%s" % (debug_path, filename))
+                copied = True
+            else:
+                copied = applier.copy(full_path_filename, dest)
+            if debug:
+                command = "cp %s %s" % (re.sub('.*/repo', 'repo', full_path_filename), re.sub('.*/repo', 'repo', dest))
+                log("---> command: %s%s" % (command, "" if copied else " (unchanged, skipped)"))
+            yield full_path_filename
+        elif not override and contains:
+            if debug: log("collecting file: %s" % full_path_filename)
+            yield full_path_filename
+        elif debug:
+            log("skipping file: %s/%s" % (full_debug_path, filename))
+
+
+def apply_overrides(repo_dir, applier, num_workers=DEFAULT_OVERRIDE_WORKERS, debug=False):
+    """precedence_walk(repo_dir, "", "", override=True) with top-level subtrees copied in parallel"""
+    subdirs = precedence_subdirs(repo_dir)
+    # A top-level subtree only copies within itself unless "overrides" appears in its own name
+    # (or above the repo), so neighbouring subtrees can be walked at the same time. A subtree
+    # that copies into its siblings runs on its own, between what comes before and after it.
+    groups = []
+    for classified, dirname in subdirs:
+        independent = "overrides" not in dirname and "overrides" not in repo_dir
+        if independent and groups and groups[-1][0]:
+            groups[-1][1].append((classified, dirname))
+        else:
+            groups.append((independent, [(classified, dirname)]))
 
-    return collected
+    def walk_subdir(classified, dirname):
+        return list(iter_precedence_subdir(repo_dir, classified, dirname, "", "", True, debug, applier))
 
+    pool = WorkerPool(num_workers, name='overrides')
+    collected = []
+    try:
+        for independent, group in groups:
+            tasks = [pool.submit(walk_subdir, classified, dirname) for classified, dirname in group]
+            for task in tasks:
+                collected.extend(task.result())
+    finally:
+        pool.shutdown(wait=False)
+    return collected
 
-def set_env(env_list):
-    for (key, val) in env_list.items():
-        log("os.environ[%s] = %s" % (key, str(val)))
-        os.environ[key] = str(val).strip().strip('"')
 
-    # the order matters here - the env.out has to be last
-    with open("%s/env.out" % OPTIONS_FROM_CONFIG_FILE.work_dir) as f:
-        for line in f:
-            values = line.split('=')
-            if len(values) == 2:
-                log("os.environ[%s] = %s" % (values[0], values[1]))
-                os.environ[values[0]] = str(values[1]).strip().strip('"')
+def script_limits_for(script_name):
+    overrides = (OPTIONS_FROM_CONFIG_FILE.script_limits or {}).get(script_name)
+    return SCRIPT_LIMITS.merged(overrides) if overrides else SCRIPT_LIMITS
 
 
-def run_cmd(full_script_path, environment):
+def run_cmd(full_script_path, environment, log_filename=None):
     log("running script [%s]" % full_script_path)
     if OPTIONS_FROM_CONFIG_FILE.debug:
         command = "date"
@@ -515,92 +800,184 @@ def run_cmd(full_script_path, environment):
         os.chmod(full_script_path, stat.S_IEXEC)
         command = "./%s" % os.path.basename(full_script_path)
 
-    set_env(environment)
-
     work_dir = os.path.dirname(full_script_path)
     log("running command: %s" % command)
     log("cwd=%s" % work_dir)
 
-    log_filename = "/tmp/%s.log" % os.path.basename(full_script_path)
+    if log_filename is None:
+        log_filename = "/tmp/%s.log" % os.path.basename(full_script_path)
     if os.path.exists(log_filename):
         os.remove(log_filename)
-    with open(log_filename, 'w+') as log_file:
+    script_name = os.path.basename(full_script_path)
+    limits = script_limits_for(script_name)
+    if limits.uses_cgroup() and not SCRIPT_CGROUPS.available():
+        log("cgroup limits for [%s] not applied: %s" % (script_name, SCRIPT_CGROUPS.error))
+    # a new process group per script, so a kill also reaches whatever it started
+    governed = GovernedRun(limits, SCRIPT_CGROUPS)
+    spooler = OUTPUT_SPOOLER if OPTIONS_FROM_CONFIG_FILE.script_output_mode == OUTPUT_MODE_SPOOL else None
+    started = time.time()
+    with open(log_filename, 'w') as log_file:
+        # spooled output is shipped from log_file, so the lines never go through LOGS
+        spooled = spooler.track(script_name, log_filename) if spooler is not None else None
         proc = subprocess.Popen(
             command,
             cwd=work_dir,
             shell=False,
-            stdout=log_file,
-            stderr=log_file)
-
-        where = log_file.tell()
-        count = 0
-        while proc.poll() is None:
-            count += 1
-            if count % (BOOTSCRIPT_LOG_INTERVAL*10) == 0:
-                count = 0
-                log_file.seek(where)
-                for line in log_file:
-                    log(line)
-                    where = log_file.tell()
-                log("[CloudCoreo agent still waiting on [%s] with pid: %d]" % (command, proc.pid))
-                publish_agent_logs()
-            time.sleep(.1)
-
-    # get any remaining log messages
-    with open(log_filename, 'r') as log_file:
-        log_file.seek(where)
-        for line in log_file:
-            log(line)
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=environment,
+            preexec_fn=governed.preexec_fn)
+        governed.started(proc)
+
+        def still_waiting():
+            log("[CloudCoreo agent still waiting on [%s] with pid: %d]" % (command, proc.pid))
+            publish_agent_logs()
+
+        def relay_line(line):
+            governed.note_output(len(line) + 1)
+            if spooled is None and LIMIT_OUTPUT not in governed.limits_hit:
+                log(line)
+
+        # lines are relayed as they arrive and teed to log_file
+        try:
+            proc_ret_code = relay_output(proc, log_file, relay_line, still_waiting, BOOTSCRIPT_LOG_INTERVAL)
+        finally:
+            limits_hit = governed.finished(proc.returncode)
+            if spooled is not None:
+                try:
+                    spooler.finish(spooled, proc.returncode)
+                except Exception as ex:
+                    # the spooler thread retries from the last published offset
+                    log("error publishing output of [%s], will retry: %s" % (script_name, ex))
 
-    proc_ret_code = proc.returncode
     log("[%s] return code: [%d]" % (command, proc_ret_code))
-
-    publish_script_result(os.path.basename(command), proc_ret_code)
+    if limits_hit:
+        log("[%s] stopped by limits: %s" % (command, ", ".join(limits_hit)))
+        for limit in limits_hit:
+            METRICS.inc('script_limits_hit_total', script=script_name, limit=limit)
+    METRICS.observe('script_duration_seconds', time.time() - started, script=script_name)
+    METRICS.inc('script_runs_total', script=script_name, result='ok' if proc_ret_code == 0 else 'failed')
+
+    publish_script_result(os.path.basename(command), proc_ret_code, limits_hit)
     publish_agent_logs()
 
     return proc_ret_code
 
 
-def run_all_boot_scripts(repo_dir, server_name_dir):
-    env = get_environment_dict()
-    log("setting env [%s]" % env)
+def run_op_script(full_script_path, environment, log_filename=None):
+    """run_cmd for the script executor; nothing waits on those runs, so failures are reported here"""
+    try:
+        return run_cmd(full_script_path, environment, log_filename)
+    except Exception as ex:
+        script_name = os.path.basename(full_script_path)
+        log("exception running operational script [%s]: %s" % (script_name, str(ex)))
+        METRICS.inc('script_runs_total', script=script_name, result='failed')
+        try:
+            publish_script_result(script_name, OP_SCRIPT_FAILED, error=str(ex))
+        except Exception as publish_ex:
+            log("exception: %s" % str(publish_ex))
+        publish_agent_logs()
+        return OP_SCRIPT_FAILED
 
+
+def iter_boot_script_plan(repo_dir, server_name_dir, walked_dirs=None):
+    """(order.yaml path, script paths) in run order, one order.yaml at a time; an empty order.yaml has no scripts"""
     # PLA-513 changes the method used to get files
     # script_order_files = get_script_order_files(repo_dir, server_name_dir)
     bootscripts_name = "boot-scripts/order.yaml"
     # Get the scripts to run assuming that overrides have already been applied earlier
     override = False
-    script_order_files = precedence_walk(repo_dir, bootscripts_name, server_name_dir, override)
+    script_order_files = precedence_walk(repo_dir, bootscripts_name, server_name_dir, override, visited=walked_dirs)
 
-    num_order_files_processed = 0
-    full_run_error = None
     for f in script_order_files:
         log("loading file [%s]" % f)
-        my_doc = yaml.load(open(f, "r"))
+        with METRICS.span('bootstrap_phase', phase='parse_order_yaml'):
+            my_doc = yaml.load(open(f, "r"))
         log("got yaml doc [%s]" % my_doc)
         if my_doc is None or my_doc['script-order'] is None:
+            yield f, []
             continue
         log("[%s]" % my_doc['script-order'])
-        num_order_files_processed += 1
-        for script in my_doc['script-order']:
-            full_path = os.path.join(os.path.dirname(f), script)
-            if full_path in open(LOCK_FILE_PATH, 'r').read():
+        yield f, [os.path.join(os.path.dirname(f), script) for script in my_doc['script-order']]
+
+
+def compile_boot_plan(repo_dir, server_name_dir):
+    """(order.yaml files read, steps with scripts, directories walked) for a BootPlan"""
+    order_files = []
+    steps = []
+    walked_dirs = []
+    for f, script_paths in iter_boot_script_plan(repo_dir, server_name_dir, walked_dirs):
+        order_files.append(f)
+        if script_paths:
+            steps.append((f, script_paths))
+    return order_files, steps, walked_dirs
+
+
+def boot_planner(repo_dir):
+    work_dir = OPTIONS_FROM_CONFIG_FILE.work_dir
+    return BootPlanner(os.path.join(work_dir, BOOT_PLAN_FILE), repo_dir, "%s/overrides-manifest.json" % work_dir)
+
+
+def get_boot_plan(repo_dir, server_name_dir, save=True):
+    """The boot plan for server_name_dir, compiled again only if the repo content it came from changed"""
+    # keyed by repo too, so a plan for another checkout is never picked up
+    plan, compiled = boot_planner(repo_dir).plan("%s:%s" % (os.path.abspath(repo_dir), server_name_dir),
+                                  lambda: compile_boot_plan(repo_dir, server_name_dir), save)
+    log("%s boot plan %s: %d scripts from %d order.yaml files" % ("compiled" if compiled else "loaded", plan.checksum,
+                                                                  len(plan.scripts()), len(plan.order_files)))
+    return plan
+
+
+def print_boot_plan():
+    repo_dir = os.path.join(OPTIONS_FROM_CONFIG_FILE.work_dir, "repo")
+    # a dry run: the plan is not saved and no lock file is created
+    plan = get_boot_plan(repo_dir, get_server_name(), save=False)
+    already_run = BOOTSTRAP_STATE if os.path.isfile(LOCK_FILE_PATH) else ()
+    print "boot plan %s" % plan.checksum
+    for order_file, script_paths in plan.steps:
+        print order_file
+        for full_path in script_paths:
+            print "  %s%s" % (os.path.basename(full_path), " (already run)" if full_path in already_run else "")
+
+
+def run_all_boot_scripts(repo_dir, server_name_dir):
+    env = get_environment()
+
+    with METRICS.span('bootstrap_phase', phase='boot_plan'):
+        plan = get_boot_plan(repo_dir, server_name_dir)
+    planner = boot_planner(repo_dir)
+    processed = []
+    full_run_error = None
+    steps = list(plan.steps)
+    while steps:
+        f, script_paths = steps.pop(0)
+        processed.append(f)
+        ran_scripts = False
+        for full_path in script_paths:
+            script = os.path.basename(full_path)
+            if full_path in BOOTSTRAP_STATE:
                 log("skipping run of [%s]. Already run" % script)
                 continue
 
             err = run_cmd(full_path, env)
+            ran_scripts = True
             if not err:
-                with open(LOCK_FILE_PATH, 'a') as lockFile:
-                    lockFile.write("%s\n" % full_path)
+                BOOTSTRAP_STATE.mark(full_path)
             else:
-                return err
+                # the next attempt starts again from the plan, skipping the scripts that already ran
+                return err, len(processed)
+
+        # boot scripts may generate or edit a later order.yaml, which is then read before its scripts run
+        if ran_scripts and planner.stale(plan):
+            log("order.yaml files changed while boot scripts ran, compiling the boot plan again")
+            plan = get_boot_plan(repo_dir, server_name_dir)
+            steps = [step for step in plan.steps if step[0] not in processed]
 
     # if we have not received any errors for the whole run, lets mark the bootstrap lock as complete
     if not full_run_error:
-        with open(LOCK_FILE_PATH, 'a') as lockFile:
-            lockFile.write(COMPLETE_STRING)
+        BOOTSTRAP_STATE.mark(COMPLETE_STRING)
 
-    return full_run_error, num_order_files_processed
+    return full_run_error, len(processed)
 
 
 def get_server_name():
@@ -617,64 +994,107 @@ def bootstrap():
     asi = get_coreo_appstackinstance()
     appstack = get_coreo_appstack()
     key = get_coreo_key()
-    git_error = clone_for_asi(asi['branch'], asi['revision'], appstack['gitUrl'], key['keyMaterial'],
-                  OPTIONS_FROM_CONFIG_FILE.work_dir)
+    with METRICS.span('bootstrap_phase', phase='clone'):
+        git_error = clone_for_asi(asi['branch'], asi['revision'], appstack['gitUrl'], key['keyMaterial'],
+                                  OPTIONS_FROM_CONFIG_FILE.work_dir)
     if git_error:
         raise RuntimeError("error cloning repo")
         return git_error
 
     # First apply any overrides in the repo for all files
     repo_dir = os.path.join(OPTIONS_FROM_CONFIG_FILE.work_dir, "repo")
-    override = True
-    precedence_walk(repo_dir, "", "", override)
+    started = time.time()
+    manifest = OverrideManifest("%s/overrides-manifest.json" % OPTIONS_FROM_CONFIG_FILE.work_dir)
+    manifest.load()
+    applier = OverrideApplier(manifest)
+    with METRICS.span('bootstrap_phase', phase='overrides'):
+        apply_overrides(repo_dir, applier, int(OPTIONS_FROM_CONFIG_FILE.override_workers or DEFAULT_OVERRIDE_WORKERS))
+    manifest.save()
+    report = applier.report()
+    log("applied overrides in %.2fs: %d files copied, %d unchanged files skipped, %d bytes copied" %
+        (time.time() - started, report['copied'], report['skipped'], report['bytes_copied']))
 
     server_name = get_server_name()
 
-    publish_op_scripts(repo_dir, server_name)
+    # overrides may have added or replaced operational scripts, so index them again now
+    OP_SCRIPT_INDEX.invalidate()
+    OP_SCRIPT_INDEX.scripts(repo_dir, server_name)
+
+    with METRICS.span('bootstrap_phase', phase='publish_op_scripts'):
+        publish_op_scripts(repo_dir, server_name)
 
     # This should be last in bootstrap() because if no errors, the bootstrap file is marked completed
-    (full_run_error, num_bootscripts_run) = run_all_boot_scripts(repo_dir, server_name)
+    with METRICS.span('bootstrap_phase', phase='boot_scripts'):
+        (full_run_error, num_bootscripts_run) = run_all_boot_scripts(repo_dir, server_name)
+    publish_agent_metrics()
     return full_run_error
 
 
 def process_incoming_sqs_messages(sqs_response):
     sqs_messages = sqs_response[u'Messages']
-    if len(sqs_messages):
-        for message in sqs_messages:
-            process_message(message)
-
+    if not len(sqs_messages):
+        return
 
-def process_message(message):
+    started = time.time()
+    dispatcher = get_message_dispatcher()
+    for message in sqs_messages:
+        dispatcher.enqueue(message)
+    # control messages come out of the dispatcher queue first
+    targets = (ALL_SERVERS_TARGET, get_server_name())
+    messages = dispatcher.drain()
+    tasks = [MESSAGE_WORKERS.submit(process_message, message, targets) for message in messages]
+    for task in tasks:
+        task.wait()
+    elapsed = time.time() - started
+    log("handled %d SQS messages in %.3fs (%.1f messages/sec)" %
+        (len(tasks), elapsed, len(tasks) / max(elapsed, 0.001)))
+
+    # the queue may be shared by every server in the stack, so only acknowledge when told we own it
+    if OPTIONS_FROM_CONFIG_FILE.delete_handled_messages:
+        handled = [message for message, task in zip(messages, tasks) if task.exception() is None]
+        if handled:
+            delete_sqs_messages(OPTIONS_FROM_CONFIG_FILE.queue_url, handled)
+
+    # re-raise on the main thread; an update terminates the agent from inside its handler
+    failed = [task for task in tasks if task.exception() is not None]
+    failed.sort(key=lambda task: not isinstance(task.exception(), SystemExit))
+    if failed:
+        failed[0].result()
+
+
+def process_message(message, targets=None):
     message_id = message[u'MessageId']
-    if message_id not in PROCESSED_SQS_MESSAGES:
-        PROCESSED_SQS_MESSAGES[message_id] = time.time()
-        message_body = json.loads(message[u'Body'])
+    if PROCESSED_SQS_MESSAGES.add(message_id):
         print 'Got message via SQS'
-
         # only process messages intended for me
-        message_server_name = message_body['server']
-        print 'Message server is ' + message_server_name
-        if message_server_name != ALL_SERVERS_TARGET and message_server_name != get_server_name():
-            return
+        if targets is None:
+            targets = (ALL_SERVERS_TARGET, get_server_name())
+        get_message_dispatcher().dispatch(message, targets)
 
-        message_type = message_body['type']
-        print 'Message type is ' + message_type
-        if message_type.lower() == 'runcommand':
-            run_script(message_body)
-        elif message_type.lower() == u'update':
-            try:
-                open(PROCESSED_SQS_MESSAGES_DICT_PATH, 'w+').write(str(PROCESSED_SQS_MESSAGES))
-                update_package()
-                run_packet_start_command()
-                terminate_script()
-            except Exception as ex:
-                log(ex)
-        else:
-            log("unknown message type" + message_type)
-            # SQS_CLIENT.delete_message(
-            #     QueueUrl=OPTIONS_FROM_CONFIG_FILE.queue_url,
-            #     ReceiptHandle=first_sqs_message['ReceiptHandle']
-            # )
+
+def handle_update_message(message_body):
+    try:
+        PROCESSED_SQS_MESSAGES.close()
+        update_package()
+        run_packet_start_command()
+        terminate_script()
+    except Exception as ex:
+        log(ex)
+
+
+def handle_unknown_message(message_body):
+    log("unknown message type" + message_body['type'])
+
+
+def get_message_dispatcher():
+    # new message types only need a handler taking the parsed body and a register() call here
+    global MESSAGE_DISPATCHER
+    if MESSAGE_DISPATCHER is None:
+        dispatcher = MessageDispatcher(unknown_handler=handle_unknown_message, metrics=METRICS)
+        dispatcher.register('update', handle_update_message, priority=PRIORITY_CONTROL)
+        dispatcher.register('runcommand', handle_runcommand_message)
+        MESSAGE_DISPATCHER = dispatcher
+    return MESSAGE_DISPATCHER
 
 
 def terminate_script():
@@ -689,21 +1109,57 @@ def update_package():
     subprocess.call(['pip', 'install', '--upgrade', 'git+git://' + OPTIONS_FROM_CONFIG_FILE.agent_git_url])
 
 
+def handle_runcommand_message(message_body):
+    # op scripts run from repo/, which a bootstrap attempt may be cloning into or overriding right now
+    with DEFERRED_SCRIPT_LOCK:
+        if not BOOTSTRAP_SETTLED.is_set():
+            DEFERRED_SCRIPT_MESSAGES.append(message_body)
+            log("bootstrap in progress, holding operational script [%s]" % message_body.get('payload'))
+            return
+    run_script(message_body)
+
+
+def set_bootstrap_settled(settled):
+    """Mark a bootstrap attempt as running (False) or over (True); held script requests run once it is over"""
+    if not settled:
+        BOOTSTRAP_SETTLED.clear()
+        return
+    with DEFERRED_SCRIPT_LOCK:
+        BOOTSTRAP_SETTLED.set()
+        deferred = DEFERRED_SCRIPT_MESSAGES[:]
+        del DEFERRED_SCRIPT_MESSAGES[:]
+    for message_body in deferred:
+        run_script(message_body)
+
+
 def run_script(message_body):
     try:
         script_name = message_body['payload']
         repo_dir = os.path.join(OPTIONS_FROM_CONFIG_FILE.work_dir, "repo")
         server_name = get_server_name()
-        op_scripts = collect_operational_scripts(repo_dir, server_name)
-        full_script_path = [test_file for test_file in op_scripts if script_name in test_file]
+        full_script_path = OP_SCRIPT_INDEX.lookup(repo_dir, server_name, script_name)
         if len(full_script_path) == 0:
             log("operational script [%s] not found for server [%s]" % (script_name, server_name))
         elif len(full_script_path) > 1:
             log("Error: found [%d] operational scripts [%s] for server [%s]" %
                 (len(full_script_path), script_name, server_name))
         elif len(full_script_path) and len(full_script_path[0]):
-            env = get_environment_dict()
-            run_cmd(full_script_path[0], env)
+            env = get_environment()
+            script_basename = os.path.basename(full_script_path[0])
+            log_filename = None
+            if SCRIPT_EXECUTOR.limit_for(script_basename) > 1:
+                # overlapping runs of the same script each need their own output file
+                log_filename = "/tmp/%s.%s.log" % (script_basename, uuid.uuid4().hex[:8])
+            # double clicks and retried broadcasts share one run instead of starting the script again
+            coalesce_key = (script_basename, json.dumps(script_name, sort_keys=True))
+            script_run, attached = SCRIPT_EXECUTOR.submit_coalesced(coalesce_key, script_basename,
+                                                                    full_script_path[0], env, log_filename)
+            if attached:
+                log("operational script [%s] already %s as run %d, not running it again" %
+                    (script_name, script_run.state, script_run.run_id))
+            else:
+                log("queued operational script [%s] as run %d, %d runs pending" %
+                    (script_name, script_run.run_id, len(SCRIPT_EXECUTOR.pending())))
     except Exception as ex:
         log("exception: %s" % str(ex))
 
@@ -711,14 +1167,19 @@ def run_script(message_body):
 def main_loop():
     delay = 1
     start = time.time()
+    bootstrap_error = False
     while True:
         try:
-            if not os.path.isfile(LOCK_FILE_PATH):
-                # touch the bootstrap lock file to indicate we have started to run through it
-                with open(LOCK_FILE_PATH, 'a'):
-                    os.utime(LOCK_FILE_PATH, None)
-            if COMPLETE_STRING not in open(LOCK_FILE_PATH, 'r').read():
-                bootstrap_error = bootstrap()
+            # picks up a removed bootstrap lock file without re-reading it every iteration
+            BOOTSTRAP_STATE.refresh()
+            if COMPLETE_STRING not in BOOTSTRAP_STATE:
+                set_bootstrap_settled(False)
+                try:
+                    bootstrap_error = bootstrap()
+                finally:
+                    set_bootstrap_settled(True)
+            else:
+                set_bootstrap_settled(True)
 
             sqs_response = get_sqs_messages(OPTIONS_FROM_CONFIG_FILE.queue_url)
             if not sqs_response:
@@ -756,6 +1217,47 @@ def main_loop():
         time.sleep(delay)
 
 
+def poll_sqs_once():
+    sqs_response = get_sqs_messages(OPTIONS_FROM_CONFIG_FILE.queue_url)
+    if not sqs_response:
+        raise ValueError("Error while getting SQS messages.")
+    if u'Messages' in sqs_response:
+        process_incoming_sqs_messages(sqs_response)
+
+
+def bootstrap_once():
+    # picks up a removed bootstrap lock file without re-reading it every iteration
+    BOOTSTRAP_STATE.refresh()
+    if COMPLETE_STRING in BOOTSTRAP_STATE:
+        set_bootstrap_settled(True)
+        return
+    set_bootstrap_settled(False)
+    try:
+        bootstrap_error = bootstrap()
+    finally:
+        # failed or not, the attempt no longer touches repo/ until the next retry
+        set_bootstrap_settled(True)
+    if bootstrap_error:
+        raise RuntimeError("error in bootstrap()")
+
+
+def runtime_error(loop_name, ex):
+    log("Exception caught in %s: [%s]" % (loop_name, str(ex)))
+    print traceback.format_exc()
+    if OPTIONS_FROM_CONFIG_FILE.debug:
+        terminate_script()
+
+
+def threaded_main():
+    # log shipping and script runs already have their own threads (LOG_SHIPPER, SCRIPT_EXECUTOR)
+    runtime = AgentRuntime()
+    runtime.add_loop('sqs-poller', poll_sqs_once, 0, max_backoff=MAX_EXCEPTION_WAIT_DELAY, on_error=runtime_error)
+    runtime.add_loop('bootstrap', bootstrap_once, 1, max_backoff=MAX_EXCEPTION_WAIT_DELAY, on_error=runtime_error)
+    runtime.add_loop('heartbeat', publish_agent_heartbeat, HEARTBEAT_INTERVAL, delay_first=True,
+                     max_backoff=MAX_EXCEPTION_WAIT_DELAY, on_error=runtime_error)
+    runtime.run_forever()
+
+
 def load_configs(conffile=''):
     global OPTIONS_FROM_CONFIG_FILE
     OPTIONS_FROM_CONFIG_FILE = get_configs(conffile)
@@ -764,47 +1266,113 @@ def load_configs(conffile=''):
     # also allow people to remove the lock file to rerun everything
     global LOCK_FILE_PATH
     LOCK_FILE_PATH = "%s/bootstrap.lock" % OPTIONS_FROM_CONFIG_FILE.work_dir
+    global BOOTSTRAP_STATE, OP_SCRIPT_INDEX, ENVIRONMENT_BUILDER
+    BOOTSTRAP_STATE = BootstrapState(LOCK_FILE_PATH, markers=(COMPLETE_STRING, SENT_OP_SCRIPTS_STRING))
+    OP_SCRIPT_INDEX = OperationalScriptIndex(collect_operational_scripts)
+    ENVIRONMENT_BUILDER = EnvironmentBuilder(OPTIONS_FROM_CONFIG_FILE.work_dir)
+    global HEARTBEAT_INTERVAL
+    HEARTBEAT_INTERVAL = int(OPTIONS_FROM_CONFIG_FILE.heartbeat_interval or DEFAULT_HEARTBEAT_INTERVAL)
+    problems = script_limits_problems(OPTIONS_FROM_CONFIG_FILE.script_limits)
+    if problems:
+        raise ConfigError(OPTIONS_FROM_CONFIG_FILE.path, problems)
+    global SCRIPT_LIMITS
+    SCRIPT_LIMITS = ScriptLimits(**dict((name, OPTIONS_FROM_CONFIG_FILE.get('script_%s' % name))
+                                        for name in LIMIT_OPTIONS))
 
 
 def start_agent():
+    command_line = parse_command_line()
+    if command_line.version:
+        print "%s" % __version__
+        terminate_script()
+
+    if command_line.check_config:
+        try:
+            problems = check_configs(get_configs())
+        except ConfigError as ex:
+            problems = ex.problems
+        for problem in problems:
+            print "config error: %s" % problem
+        if problems:
+            sys.exit(1)
+        print "config OK"
+        terminate_script()
+
     print '*Starting agent... Version ' + __version__
 
     load_configs()
+    if command_line.plan:
+        print_boot_plan()
+        terminate_script()
     if OPTIONS_FROM_CONFIG_FILE.version:
         print "%s" % __version__
         terminate_script()
 
-    global SQS_CLIENT, SNS_CLIENT
+    global TRANSPORT, LOGS, LOG_SHIPPER, OUTPUT_SPOOLER
 
     sqs_sns_region = OPTIONS_FROM_CONFIG_FILE.topic_arn.split(':')[3]
     log("SQS/SNS region from topic ARN: %s" % sqs_sns_region)
     aws_access_id = OPTIONS_FROM_CONFIG_FILE.coreo_access_id
     aws_secret_access_key = OPTIONS_FROM_CONFIG_FILE.coreo_access_key
-    SQS_CLIENT = boto3.client('sqs',
+    sqs_client = boto3.client('sqs',
                               aws_access_key_id='%s' % aws_access_id,
                               aws_secret_access_key='%s' % aws_secret_access_key,
                               region_name='%s' % sqs_sns_region)
-    SNS_CLIENT = boto3.client('sns',
+    sns_client = boto3.client('sns',
                               aws_access_key_id='%s' % aws_access_id,
                               aws_secret_access_key='%s' % aws_secret_access_key,
                               region_name='%s' % sqs_sns_region)
+    TRANSPORT = Boto3Transport(sqs_client, sns_client)
+
+    if OPTIONS_FROM_CONFIG_FILE.log_buffer_entries or OPTIONS_FROM_CONFIG_FILE.log_buffer_bytes:
+        buffered = LOGS.drain()
+        LOGS = LogBuffer(max_entries=int(OPTIONS_FROM_CONFIG_FILE.log_buffer_entries or DEFAULT_MAX_LOG_ENTRIES),
+                         max_bytes=int(OPTIONS_FROM_CONFIG_FILE.log_buffer_bytes or DEFAULT_MAX_LOG_BYTES))
+        LOGS.requeue(buffered)
+    LOG_SHIPPER = LogShipper(LOGS, publish_log_batch,
+                             interval=float(OPTIONS_FROM_CONFIG_FILE.log_flush_interval or DEFAULT_FLUSH_INTERVAL))
+    LOG_SHIPPER.start()
+    if OPTIONS_FROM_CONFIG_FILE.script_output_mode == OUTPUT_MODE_SPOOL:
+        OUTPUT_SPOOLER = OutputSpooler(
+            publish_output_chunk,
+            interval=float(OPTIONS_FROM_CONFIG_FILE.log_flush_interval or DEFAULT_FLUSH_INTERVAL),
+            chunk_bytes=int(OPTIONS_FROM_CONFIG_FILE.script_output_chunk_bytes or DEFAULT_CHUNK_BYTES))
+        OUTPUT_SPOOLER.start()
 
     if not OPTIONS_FROM_CONFIG_FILE.agent_uuid:
         set_agent_uuid()
 
     publish_agent_online()
 
+    global SCRIPT_EXECUTOR
+    script_concurrency = OPTIONS_FROM_CONFIG_FILE.script_concurrency or {}
+    # 0 still coalesces with queued and running runs, just not finished ones
+    coalesce_window = OPTIONS_FROM_CONFIG_FILE.script_coalesce_window
+    if coalesce_window is None:
+        coalesce_window = DEFAULT_COALESCE_WINDOW
+    SCRIPT_EXECUTOR = ScriptExecutor(run_op_script,
+                                     num_workers=int(OPTIONS_FROM_CONFIG_FILE.script_workers or DEFAULT_SCRIPT_WORKERS),
+                                     limits=dict((name, int(limit)) for name, limit in script_concurrency.items()),
+                                     default_limit=DEFAULT_SCRIPT_CONCURRENCY,
+                                     coalesce_window=coalesce_window)
+
+    global MESSAGE_WORKERS
+    MESSAGE_WORKERS = WorkerPool(int(OPTIONS_FROM_CONFIG_FILE.sqs_workers or DEFAULT_SQS_WORKERS),
+                                 max_pending=SQS_MAX_MESSAGES, name='sqs')
+
     global PROCESSED_SQS_MESSAGES
     PROCESSED_SQS_MESSAGES = read_processed_messages_from_file()
-    print PROCESSED_SQS_MESSAGES
 
-    main_loop()
+    global TELEMETRY
+    TELEMETRY = TelemetryCollector(
+        ProcSampler(disk_path=OPTIONS_FROM_CONFIG_FILE.work_dir, internals_fn=agent_internals),
+        interval=float(OPTIONS_FROM_CONFIG_FILE.telemetry_sample_interval or DEFAULT_SAMPLE_INTERVAL))
+    TELEMETRY.start()
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Parse version argument')
-    parser.add_argument('--version', action='store_true', help="Get script version")
-    if parser.parse_args().version:
-        print "%s" % __version__
-        terminate_script()
+    if (OPTIONS_FROM_CONFIG_FILE.runtime or RUNTIME_LOOP) == RUNTIME_THREADED:
+        threaded_main()
+    else:
+        main_loop()
 
+if __name__ == "__main__":
     start_agent()
@@ -0,0 +1,183 @@
+######################################################################
+# Agent configuration
+#
+# The config file is parsed once, with libyaml's safe loader when it is
+# available, and checked against a table of known options into an
+# immutable AgentConfig. Every known option is a slot, so reading one
+# in a hot path is a plain attribute lookup; options the table doesn't
+# know about are kept as they were read so a rewrite doesn't drop them.
+# Persisting a value (the agent_uuid) rewrites the file atomically from
+# what was already read instead of reading it again.
+######################################################################
+import os
+import tempfile
+
+from core.lazy import LazyModule
+
+yaml = LazyModule('yaml')
+
+TRUE_STRINGS = ('true', 'yes', 'on', '1')
+FALSE_STRINGS = ('false', 'no', 'off', '0', '')
+
+
+class ConfigError(Exception):
+    def __init__(self, path, problems):
+        Exception.__init__(self, "invalid config [%s]: %s" % (path, "; ".join(problems)))
+        self.path = path
+        self.problems = problems
+
+
+def to_bool(value):
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    if str(value).strip().lower() in TRUE_STRINGS:
+        return True
+    if str(value).strip().lower() in FALSE_STRINGS:
+        return False
+    raise ValueError("not a boolean")
+
+
+def to_str(value):
+    return value if isinstance(value, basestring) else str(value)
+
+
+def to_dict(value):
+    if not isinstance(value, dict):
+        raise ValueError("not a mapping")
+    return value
+
+
+# option -> converter; options that are not set read as None (False for booleans)
+CONFIG_OPTIONS = (
+    ('agent_git_url', to_str),
+    ('agent_uuid', to_str),
+    ('asi_id', to_str),
+    ('coreo_access_id', to_str),
+    ('coreo_access_key', to_str),
+    ('debug', to_bool),
+    ('delete_handled_messages', to_bool),
+    ('git_clone_mode', to_str),
+    ('git_mirror_dir', to_str),
+    ('git_submodule_jobs', int),
+    ('heartbeat_interval', int),
+    ('log_buffer_bytes', int),
+    ('log_buffer_entries', int),
+    ('log_file', to_str),
+    ('log_flush_interval', float),
+    ('metadata_connect_timeout', float),
+    ('metadata_read_timeout', float),
+    ('metrics_file', to_str),
+    ('namespace', to_str),
+    ('override_workers', int),
+    ('processed_messages_max', int),
+    ('processed_messages_ttl', int),
+    ('queue_url', to_str),
+    ('run_id', to_str),
+    ('runtime', to_str),
+    ('script_cgroup_cpu_percent', float),
+    ('script_cgroup_memory_bytes', int),
+    ('script_coalesce_window', float),
+    ('script_concurrency', to_dict),
+    ('script_cpu_seconds', int),
+    ('script_file_size_bytes', int),
+    ('script_kill_grace', float),
+    ('script_limits', to_dict),
+    ('script_max_output_bytes', int),
+    ('script_memory_bytes', int),
+    ('script_output_chunk_bytes', int),
+    ('script_output_mode', to_str),
+    ('script_timeout', float),
+    ('script_workers', int),
+    ('server_name', to_str),
+    ('sqs_workers', int),
+    ('telemetry_sample_interval', float),
+    ('topic_arn', to_str),
+    ('version', to_bool),
+    ('work_dir', to_str),
+)
+CONFIG_CONVERTERS = dict(CONFIG_OPTIONS)
+
+
+def _loader_class():
+    base = getattr(yaml, 'CSafeLoader', None) or yaml.SafeLoader
+
+    class ConfigLoader(base):
+        pass
+
+    # older agents wrote unicode values with python tags, which the safe loaders refuse
+    for tag in ('tag:yaml.org,2002:python/unicode', 'tag:yaml.org,2002:python/str'):
+        ConfigLoader.add_constructor(tag, lambda loader, node: loader.construct_scalar(node))
+    return ConfigLoader
+
+
+class AgentConfig(object):
+    """Immutable, typed agent options"""
+
+    __slots__ = tuple(name for name, _ in CONFIG_OPTIONS) + ('path', 'raw')
+
+    def __init__(self, raw, path=None):
+        problems = []
+        values = {}
+        for name, convert in CONFIG_OPTIONS:
+            value = raw.get(name)
+            try:
+                if convert is to_bool:
+                    values[name] = to_bool(value)
+                else:
+                    values[name] = None if value is None else convert(value)
+            except (TypeError, ValueError) as ex:
+                problems.append("option [%s] %s, got [%s]" % (name, ex, value))
+        if problems:
+            raise ConfigError(path, problems)
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, 'path', path)
+        # as read from the file, including options this table doesn't know about
+        object.__setattr__(self, 'raw', dict(raw))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("AgentConfig is immutable, use replace()")
+
+    def get(self, name, default=None):
+        if name in CONFIG_CONVERTERS:
+            return getattr(self, name)
+        return self.raw.get(name, default)
+
+    def replace(self, **changes):
+        raw = dict(self.raw)
+        raw.update(changes)
+        return AgentConfig(raw, self.path)
+
+    def __repr__(self):
+        return "AgentConfig(%r)" % self.path
+
+
+def load_config(path):
+    with open(path, 'r') as config_file:
+        raw = yaml.load(config_file, Loader=_loader_class())
+    if raw is None:
+        raw = {}
+    if not isinstance(raw, dict):
+        raise ConfigError(path, ["top level is not a mapping"])
+    return AgentConfig(raw, path)
+
+
+def save_config(config, **changes):
+    """Write config.raw plus changes to config.path atomically; returns the updated config"""
+    updated = config.replace(**changes)
+    directory = os.path.dirname(os.path.abspath(config.path))
+    fd, temp_path = tempfile.mkstemp(prefix='.agent-conf-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as config_file:
+            dumper = getattr(yaml, 'CSafeDumper', None) or yaml.SafeDumper
+            yaml.dump(updated.raw, config_file, Dumper=dumper, default_style="'", default_flow_style=False)
+            config_file.flush()
+            os.fsync(config_file.fileno())
+        if os.path.exists(config.path):
+            os.chmod(temp_path, os.stat(config.path).st_mode & 0o7777)
+        os.rename(temp_path, config.path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return updated
@@ -0,0 +1,126 @@
+######################################################################
+# SQS message dispatch
+#
+# Handlers are registered per message type with a priority. Received
+# messages wait in a priority queue, so control messages like update
+# are handed to the workers ahead of runcommand work that arrived in the
+# same batch. The server a message is for, and its type, are peeked out
+# of the raw body with a regex. A message meant for another server is
+# dropped without the full json.loads. Per-type counts and handler
+# latency are kept for reporting.
+######################################################################
+import heapq
+import itertools
+import json
+import re
+import threading
+import time
+
+PRIORITY_CONTROL = 0
+PRIORITY_NORMAL = 10
+UNKNOWN_TYPE = 'unknown'
+
+# only plain string values; anything with escapes falls back to the full parse
+PEEK_SERVER = re.compile(r'"server"\s*:\s*"([^"\\]*)"')
+PEEK_TYPE = re.compile(r'"type"\s*:\s*"([^"\\]*)"')
+
+
+def peek(body, pattern):
+    """The value for pattern's key, or None unless the body has exactly one such value"""
+    values = set(pattern.findall(body))
+    return values.pop() if len(values) == 1 else None
+
+
+class TypeStats(object):
+    __slots__ = ('count', 'errors', 'total_seconds', 'max_seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def report(self):
+        return {'count': self.count, 'errors': self.errors, 'max_seconds': round(self.max_seconds, 6),
+                'avg_seconds': round(self.total_seconds / self.count, 6) if self.count else 0.0}
+
+
+class MessageDispatcher(object):
+    """Registry of message type -> (handler, priority) plus a priority queue of received messages"""
+
+    def __init__(self, unknown_handler=None, metrics=None):
+        self._handlers = {}
+        self._unknown_handler = unknown_handler
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._stats = {}
+        self.skipped = 0
+
+    def register(self, message_type, handler, priority=PRIORITY_NORMAL):
+        self._handlers[message_type.lower()] = (handler, priority)
+
+    def priority(self, message_type):
+        if message_type is None:
+            return PRIORITY_NORMAL
+        return self._handlers.get(message_type.lower(), (None, PRIORITY_NORMAL))[1]
+
+    def enqueue(self, message):
+        # ties keep arrival order
+        entry = (self.priority(peek(message[u'Body'], PEEK_TYPE)), next(self._sequence), message)
+        with self._lock:
+            heapq.heappush(self._queue, entry)
+
+    def drain(self):
+        """Every queued message, highest priority first"""
+        with self._lock:
+            queued, self._queue = self._queue, []
+        return [heapq.heappop(queued)[2] for _ in range(len(queued))]
+
+    def _record(self, message_type, seconds, failed):
+        with self._lock:
+            stats = self._stats.get(message_type)
+            if stats is None:
+                stats = self._stats[message_type] = TypeStats()
+            stats.count += 1
+            stats.errors += failed
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+        if self._metrics is not None:
+            self._metrics.observe('message_handler_seconds', seconds, type=message_type)
+
+    def dispatch(self, message, targets):
+        """Run the handler for message if it is for one of targets; returns True if a handler ran"""
+        server = peek(message[u'Body'], PEEK_SERVER)
+        if server is not None and server not in targets:
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        message_body = json.loads(message[u'Body'])
+        if message_body['server'] not in targets:
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        message_type = message_body['type']
+        handler = self._handlers.get(message_type.lower(), (self._unknown_handler, None))[0]
+        stats_type = message_type.lower() if message_type.lower() in self._handlers else UNKNOWN_TYPE
+        started = time.time()
+        failed = False
+        try:
+            if handler is not None:
+                handler(message_body)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._record(stats_type, time.time() - started, failed)
+        return True
+
+    def stats(self):
+        with self._lock:
+            report = dict((message_type, stats.report()) for message_type, stats in self._stats.items())
+            report['skipped_other_servers'] = self.skipped
+        return report
@@ -0,0 +1,101 @@
+######################################################################
+# Script environment
+#
+# Builds the environment scripts run with: the agent's own environment,
+# then the appstack instance variables, then env.out (which has to win).
+# The result is cached against the mtimes of the two source files, so
+# they are only parsed again after they change, and it is handed to
+# subprocess.Popen(env=...) as a read-only mapping instead of being
+# written into os.environ, where concurrent runs would clobber it.
+######################################################################
+import json
+import os
+import threading
+from collections import Mapping
+
+
+class FrozenEnvironment(Mapping):
+    """Read-only str -> str mapping"""
+
+    def __init__(self, variables):
+        self._variables = dict(variables)
+
+    def __getitem__(self, key):
+        return self._variables[key]
+
+    def __iter__(self):
+        return iter(self._variables)
+
+    def __len__(self):
+        return len(self._variables)
+
+    def __repr__(self):
+        return "FrozenEnvironment(%r)" % self._variables
+
+
+def clean_value(value):
+    return str(value).strip().strip('"')
+
+
+class EnvironmentBuilder(object):
+    """Merged script environment for a work_dir, rebuilt only when its source files change"""
+
+    def __init__(self, work_dir, base_environ=None):
+        self.instance_config_path = os.path.join(work_dir, "appstack_instance_config.out")
+        self.env_out_path = os.path.join(work_dir, "env.out")
+        self._base_environ = base_environ
+        self._lock = threading.Lock()
+        self._signature = None
+        self._variables = None
+        self._environment = None
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+            return st.st_ino, st.st_size, st.st_mtime
+        except OSError:
+            return None
+
+    def _read_instance_variables(self):
+        with open(self.instance_config_path, 'r') as config_file:
+            asi_vars = json.load(config_file)
+        variables = {}
+        for var, value in asi_vars.items():
+            if 'value' in value.keys() and value['value'] is not None:
+                variables[var] = value['value']
+            else:
+                variables[var] = value.get('default', '')
+        return variables
+
+    def _read_env_out(self):
+        variables = {}
+        with open(self.env_out_path, 'r') as env_file:
+            for line in env_file:
+                values = line.split('=')
+                if len(values) == 2:
+                    variables[values[0]] = values[1]
+        return variables
+
+    def rebuild_needed(self):
+        return self._signature != (self._stat(self.instance_config_path), self._stat(self.env_out_path))
+
+    def instance_variables(self):
+        """The appstack instance variables with their raw (not yet stringified) values"""
+        self.build()
+        return self._variables
+
+    def build(self):
+        with self._lock:
+            signature = (self._stat(self.instance_config_path), self._stat(self.env_out_path))
+            if self._environment is None or signature != self._signature:
+                variables = self._read_instance_variables()
+                merged = dict(os.environ if self._base_environ is None else self._base_environ)
+                for key, value in variables.items():
+                    merged[key] = clean_value(value)
+                # the order matters here - the env.out has to be last
+                for key, value in self._read_env_out().items():
+                    merged[key] = clean_value(value)
+                self._variables = variables
+                self._environment = FrozenEnvironment(merged)
+                self._signature = signature
+            return self._environment
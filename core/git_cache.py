@@ -0,0 +1,49 @@
+######################################################################
+# Git mirror cache
+#
+# Keeps one bare mirror per git url on local disk. Clones of the stack
+# repo use the mirror as a --reference source, so after the first
+# bootstrap only new objects cross the network. Clones are made with
+# --dissociate: they copy what they borrow instead of keeping an
+# alternates link, because the mirror prunes refs and may gc objects a
+# clone still needs. The mirror lives outside the repo so it outlives it.
+######################################################################
+import hashlib
+import os
+import re
+import shutil
+
+
+class GitMirrorCache(object):
+    """Bare mirrors of remote repos under cache_dir"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def mirror_dir(self, repo_url):
+        # readable tail of the url plus a hash so different urls never share a mirror
+        readable = re.sub(r'[^A-Za-z0-9._-]', '_', repo_url)[-48:]
+        return os.path.join(self.cache_dir, "%s-%s.git" % (readable, hashlib.sha1(repo_url).hexdigest()[:12]))
+
+    def update(self, repo_url, run_git):
+        """Create or refresh the mirror; returns its path, or None if there is no usable mirror.
+
+        run_git(cwd, *args) runs one git command and returns True when it succeeded.
+        """
+        mirror_dir = self.mirror_dir(repo_url)
+        if os.path.isdir(mirror_dir):
+            # even if the refresh fails the objects already there still save a full download
+            run_git(mirror_dir, "remote", "update", "--prune")
+            return mirror_dir
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        temp_dir = "%s.tmp" % mirror_dir
+        if os.path.isdir(temp_dir):
+            shutil.rmtree(temp_dir)
+        if not run_git(self.cache_dir, "clone", "--mirror", repo_url, temp_dir):
+            if os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir)
+            return None
+        os.rename(temp_dir, mirror_dir)
+        return mirror_dir
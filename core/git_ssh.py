@@ -0,0 +1,69 @@
+######################################################################
+# Git over ssh
+#
+# A GitSSHSession holds the deploy key and the GIT_SSH wrapper for one
+# bootstrap. The wrapper turns on ssh connection multiplexing, so the
+# clone, fetches, checkouts and every submodule fetch reuse one master
+# connection instead of each doing its own handshake. The session also
+# records how long each git phase took.
+######################################################################
+import os
+import shutil
+import stat
+import subprocess
+from collections import OrderedDict
+from tempfile import mkdtemp
+
+# keep the master connection alive between git commands run back to back
+DEFAULT_CONTROL_PERSIST = 60
+
+
+class GitSSHSession(object):
+    """Private key, GIT_SSH wrapper and ssh control socket directory for a series of git commands"""
+
+    def __init__(self, key_material, control_persist=DEFAULT_CONTROL_PERSIST):
+        self._key_material = key_material
+        self.control_persist = control_persist
+        self.session_dir = None
+        self.key_path = None
+        self.wrapper_path = None
+        self.phase_times = OrderedDict()
+
+    def open(self):
+        # mkdtemp creates the directory readable by us only, so the key and sockets stay private
+        self.session_dir = mkdtemp(prefix="coreo-git-")
+        self.key_path = os.path.join(self.session_dir, "key")
+        fd = os.open(self.key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IRUSR | stat.S_IWUSR)
+        with os.fdopen(fd, 'w') as key_file:
+            key_file.write(self._key_material)
+
+        self.wrapper_path = os.path.join(self.session_dir, "ssh")
+        with open(self.wrapper_path, 'w') as wrapper:
+            wrapper.write("""#!/bin/sh
+exec /usr/bin/ssh -o StrictHostKeyChecking=no -o ControlMaster=auto -o ControlPath="%s/cm-%%r@%%h:%%p" \\
+    -o ControlPersist=%d -i "%s" "$@"
+""" % (self.session_dir, self.control_persist, self.key_path))
+        os.chmod(self.wrapper_path, stat.S_IRWXU)
+        return self
+
+    def record(self, phase, seconds):
+        self.phase_times[phase] = self.phase_times.get(phase, 0) + seconds
+
+    def close(self):
+        if self.session_dir is None:
+            return
+        # shut down any master connections that are still lingering for ControlPersist
+        for name in os.listdir(self.session_dir):
+            if name.startswith("cm-"):
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.call(['/usr/bin/ssh', '-o', 'ControlPath=%s' % os.path.join(self.session_dir, name),
+                                     '-O', 'exit', 'coreo-git'], stdout=devnull, stderr=devnull)
+        shutil.rmtree(self.session_dir, ignore_errors=True)
+        self.session_dir = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
@@ -0,0 +1,229 @@
+######################################################################
+# Script resource governor
+#
+# Puts every script the agent starts in its own process group and, when
+# configured, under rlimits (cpu seconds, address space, file size), a
+# cgroup v2 group (memory.max, cpu.max) and a wall-clock timeout and
+# output cap. A script that runs over its time or output is stopped with
+# SIGTERM to the whole process group, then SIGKILL if it is still there
+# after a grace period. Which limits were hit is worked out when the
+# script finishes so it can be reported with the result.
+#
+# Every limit is off unless configured: boot scripts often start
+# long-lived daemons, which inherit rlimits and cgroup membership.
+######################################################################
+import errno
+import itertools
+import os
+import resource
+import signal
+import threading
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+CGROUP_PARENT = 'cloudcoreo-agent'
+CPU_MAX_PERIOD = 100000
+DEFAULT_KILL_GRACE = 10
+_RUN_IDS = itertools.count(1)
+
+LIMIT_TIMEOUT = 'timeout'
+LIMIT_OUTPUT = 'output'
+LIMIT_CPU = 'cpu'
+LIMIT_MEMORY = 'memory'
+
+# ScriptLimits fields; the agent config spells each one script_<field>
+LIMIT_OPTIONS = ('timeout', 'kill_grace', 'cpu_seconds', 'memory_bytes', 'file_size_bytes', 'max_output_bytes',
+                 'cgroup_memory_bytes', 'cgroup_cpu_percent')
+
+
+class ScriptLimits(object):
+    """Limits for one script run; None means unlimited"""
+
+    __slots__ = LIMIT_OPTIONS
+
+    def __init__(self, **limits):
+        for name in LIMIT_OPTIONS:
+            setattr(self, name, limits.pop(name, None))
+        if limits:
+            raise ValueError("unknown script limits: %s" % ", ".join(sorted(limits)))
+        if self.kill_grace is None:
+            self.kill_grace = DEFAULT_KILL_GRACE
+
+    def merged(self, overrides):
+        """A copy with the non-None values of the overrides mapping applied"""
+        values = dict((name, getattr(self, name)) for name in LIMIT_OPTIONS)
+        values.update((name, value) for name, value in (overrides or {}).items() if value is not None)
+        return ScriptLimits(**values)
+
+    def uses_cgroup(self):
+        return self.cgroup_memory_bytes is not None or self.cgroup_cpu_percent is not None
+
+
+def _write(path, value):
+    with open(path, 'w') as control_file:
+        control_file.write(value)
+
+
+class CgroupV2(object):
+    """A parent group for agent scripts with one child group per run"""
+
+    def __init__(self, root=CGROUP_ROOT, parent=CGROUP_PARENT):
+        self.root = root
+        self.parent_dir = os.path.join(root, parent)
+        self._lock = threading.Lock()
+        self._ready = None
+        self.error = None
+
+    def available(self):
+        with self._lock:
+            if self._ready is None:
+                self._ready = self._setup()
+            return self._ready
+
+    def _setup(self):
+        if not os.path.isfile(os.path.join(self.root, 'cgroup.controllers')):
+            self.error = "cgroup v2 is not mounted at %s" % self.root
+            return False
+        try:
+            if not os.path.isdir(self.parent_dir):
+                os.mkdir(self.parent_dir)
+            # the parent group holds no processes itself, so it can delegate controllers to the runs
+            _write(os.path.join(self.root, 'cgroup.subtree_control'), '+memory +cpu')
+            _write(os.path.join(self.parent_dir, 'cgroup.subtree_control'), '+memory +cpu')
+        except (IOError, OSError) as ex:
+            self.error = "can't set up cgroup %s: %s" % (self.parent_dir, ex)
+            return False
+        return True
+
+    def create(self, name, limits):
+        group_dir = os.path.join(self.parent_dir, name)
+        os.mkdir(group_dir)
+        if limits.cgroup_memory_bytes is not None:
+            _write(os.path.join(group_dir, 'memory.max'), str(int(limits.cgroup_memory_bytes)))
+        if limits.cgroup_cpu_percent is not None:
+            quota = max(1000, int(CPU_MAX_PERIOD * limits.cgroup_cpu_percent / 100.0))
+            _write(os.path.join(group_dir, 'cpu.max'), "%d %d" % (quota, CPU_MAX_PERIOD))
+        return group_dir
+
+    def oom_kills(self, group_dir):
+        try:
+            with open(os.path.join(group_dir, 'memory.events')) as events:
+                for line in events:
+                    name, _, count = line.partition(' ')
+                    if name == 'oom_kill':
+                        return int(count)
+        except (IOError, OSError, ValueError):
+            pass
+        return 0
+
+    def remove(self, group_dir):
+        try:
+            os.rmdir(group_dir)
+        except OSError as ex:
+            # daemons the script started are still in the group; it goes once they exit
+            if ex.errno not in (errno.EBUSY, errno.ENOENT):
+                raise
+
+
+class GovernedRun(object):
+    """Applies ScriptLimits to one process: pass preexec_fn to Popen, then started(proc) and finished()"""
+
+    def __init__(self, limits, cgroups=None, name=None):
+        self.limits = limits
+        self.limits_hit = []
+        self._cgroups = cgroups
+        self._group_dir = None
+        self._procs_fd = None
+        self._proc = None
+        self._lock = threading.Lock()
+        self._timers = []
+        self._output_bytes = 0
+        self._stopping = False
+        if limits.uses_cgroup() and cgroups is not None and cgroups.available():
+            self._group_dir = cgroups.create(name or "run-%d-%d" % (os.getpid(), next(_RUN_IDS)),
+                                             limits)
+            # opened before the fork so the child only has to write to it
+            self._procs_fd = os.open(os.path.join(self._group_dir, 'cgroup.procs'), os.O_WRONLY)
+        self._rlimits = []
+        if limits.cpu_seconds is not None:
+            # SIGXCPU at the soft limit, SIGKILL a grace period of cpu time later
+            self._rlimits.append((resource.RLIMIT_CPU, int(limits.cpu_seconds),
+                                  int(limits.cpu_seconds) + max(1, int(limits.kill_grace))))
+        for which, value in ((resource.RLIMIT_AS, limits.memory_bytes), (resource.RLIMIT_FSIZE, limits.file_size_bytes)):
+            if value is not None:
+                self._rlimits.append((which, int(value), int(value)))
+
+    def preexec_fn(self):
+        """Runs in the child between fork and exec; keep it to system calls"""
+        os.setsid()
+        if self._procs_fd is not None:
+            # "0" moves the writing process, so the script is in the group before it runs
+            os.write(self._procs_fd, '0')
+        for which, soft, hard in self._rlimits:
+            resource.setrlimit(which, (soft, hard))
+
+    def started(self, proc):
+        self._proc = proc
+        if self._procs_fd is not None:
+            os.close(self._procs_fd)
+            self._procs_fd = None
+        if self.limits.timeout is not None:
+            self._start_timer(self.limits.timeout, self.stop, LIMIT_TIMEOUT)
+
+    def _start_timer(self, seconds, fn, *args):
+        timer = threading.Timer(seconds, fn, args)
+        timer.daemon = True
+        with self._lock:
+            self._timers.append(timer)
+        timer.start()
+
+    def note_output(self, num_bytes):
+        """Count script output; stops the script once it passes max_output_bytes"""
+        if self.limits.max_output_bytes is None:
+            return
+        self._output_bytes += num_bytes
+        if self._output_bytes > self.limits.max_output_bytes:
+            self.stop(LIMIT_OUTPUT)
+
+    def _signal_group(self, signum):
+        try:
+            os.killpg(self._proc.pid, signum)
+        except OSError as ex:
+            if ex.errno != errno.ESRCH:
+                raise
+
+    def stop(self, reason):
+        """SIGTERM the process group now and SIGKILL it after the grace period"""
+        with self._lock:
+            if self._stopping or self._proc is None or self._proc.returncode is not None:
+                return
+            self._stopping = True
+            self.limits_hit.append(reason)
+        self._signal_group(signal.SIGTERM)
+        self._start_timer(self.limits.kill_grace, self._kill)
+
+    def _kill(self):
+        # the script itself may be gone while the rest of its group lingers
+        self._signal_group(signal.SIGKILL)
+
+    def finished(self, return_code):
+        """Release the cgroup and return the limits that were hit"""
+        with self._lock:
+            timers, self._timers = self._timers, []
+            stopping = self._stopping
+        for timer in timers:
+            # once stopping, the SIGKILL still goes to whatever is left of the group
+            if not stopping or timer.function != self._kill:
+                timer.cancel()
+        if self._procs_fd is not None:
+            os.close(self._procs_fd)
+            self._procs_fd = None
+        oom_killed = False
+        if self._group_dir is not None:
+            oom_killed = self._cgroups.oom_kills(self._group_dir) > 0
+            self._cgroups.remove(self._group_dir)
+        if oom_killed:
+            self.limits_hit.append(LIMIT_MEMORY)
+        elif self.limits.cpu_seconds is not None and not stopping and return_code in (
+                -signal.SIGXCPU, 128 + signal.SIGXCPU, -signal.SIGKILL):
+            self.limits_hit.append(LIMIT_CPU)
+        return list(self.limits_hit)
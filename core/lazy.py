@@ -0,0 +1,35 @@
+######################################################################
+# Lazy module imports
+#
+# boto3 alone takes a good part of a second to import on a small
+# instance, and the --version and --check-config paths never touch it.
+# A LazyModule stands in for a module at the top of a file and imports
+# the real thing on first attribute access.
+######################################################################
+import importlib
+import sys
+
+
+class LazyModule(object):
+    """Proxy for a module that is imported the first time one of its attributes is used"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        loaded = self.__dict__['_module'] is not None or self.__dict__['_name'] in sys.modules
+        return "<lazy module %r%s>" % (self.__dict__['_name'], "" if loaded else " (not loaded)")
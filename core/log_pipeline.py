@@ -0,0 +1,182 @@
+######################################################################
+# Log pipeline
+#
+# log() lines go into a ring buffer bounded by line count and total
+# size; when either is exceeded the oldest lines are dropped. A
+# background shipper drains the buffer, splits the lines into batches
+# that fit in one SNS message and publishes them off the calling
+# thread. Batches that fail to publish are put back at the front of
+# the buffer. Dropped and truncated lines are counted and reported in
+# the next batch rather than disappearing silently.
+######################################################################
+import json
+import threading
+import time
+from collections import deque
+
+SNS_MAX_MESSAGE_BYTES = 256 * 1024
+# leave room for the message envelope (header, subject, json framing)
+MAX_BATCH_BYTES = SNS_MAX_MESSAGE_BYTES - 16 * 1024
+MAX_ENTRY_BYTES = 32 * 1024
+DEFAULT_MAX_ENTRIES = 20000
+# a chatty script can fill every entry close to MAX_ENTRY_BYTES, so size is bounded separately
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 5
+TRUNCATED_SUFFIX = "... [truncated]"
+
+
+class LogBuffer(object):
+    """Thread-safe ring buffer of log entries, bounded by entry count and by total message size"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_entry_bytes=MAX_ENTRY_BYTES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self.max_bytes = max_bytes
+        self._entries = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.truncated = 0
+
+    def _trim(self):
+        # called with the lock held; the newest entry always stays
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._bytes -= len(self._entries.popleft()['log_message'])
+            self.dropped += 1
+
+    def add(self, log_text):
+        if isinstance(log_text, str):
+            # script output may not be valid utf-8, and json.dumps would refuse it later
+            log_text = log_text.decode('utf-8', 'replace')
+        if len(log_text) > self.max_entry_bytes:
+            log_text = log_text[:self.max_entry_bytes - len(TRUNCATED_SUFFIX)] + TRUNCATED_SUFFIX
+            with self._lock:
+                self.truncated += 1
+        entry = {'log_message': log_text, 'date': time.time()}
+        with self._lock:
+            self._entries.append(entry)
+            self._bytes += len(log_text)
+            self._trim()
+
+    def drain(self):
+        with self._lock:
+            entries = list(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        return entries
+
+    def requeue(self, entries):
+        """Put entries back in front of anything logged since they were drained"""
+        with self._lock:
+            self._entries.extendleft(reversed(entries))
+            self._bytes += sum(len(entry['log_message']) for entry in entries)
+            self._trim()
+
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def split_batches(entries, max_batch_bytes=MAX_BATCH_BYTES):
+    """Group entries into lists whose json encoding stays under max_batch_bytes"""
+    batches = []
+    batch = []
+    batch_bytes = 2
+    for entry in entries:
+        # +2 for the ", " separator between list items
+        entry_bytes = len(json.dumps(entry)) + 2
+        if batch and batch_bytes + entry_bytes > max_batch_bytes:
+            batches.append(batch)
+            batch = []
+            batch_bytes = 2
+        batch.append(entry)
+        batch_bytes += entry_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class LogShipper(object):
+    """Publishes the contents of a LogBuffer in size-limited batches from a background thread"""
+
+    def __init__(self, log_buffer, publish_fn, interval=DEFAULT_FLUSH_INTERVAL, max_batch_bytes=MAX_BATCH_BYTES):
+        self._buffer = log_buffer
+        self._publish_fn = publish_fn
+        self.interval = interval
+        self.max_batch_bytes = max_batch_bytes
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+        self._reported_dropped = 0
+        self._reported_truncated = 0
+        self.published = 0
+        self.failed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-shipper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request_flush(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # never let the shipper thread die; the entries were requeued by flush()
+                pass
+
+    def _loss_report(self):
+        dropped = self._buffer.dropped - self._reported_dropped
+        truncated = self._buffer.truncated - self._reported_truncated
+        if not dropped and not truncated:
+            return None
+        self._reported_dropped += dropped
+        self._reported_truncated += truncated
+        return {'log_message': "[CloudCoreo agent dropped %d and truncated %d log lines since the last publish]" %
+                               (dropped, truncated),
+                'date': time.time()}
+
+    def flush(self):
+        with self._flush_lock:
+            entries = self._buffer.drain()
+            report = self._loss_report()
+            if report:
+                entries.append(report)
+            if not entries:
+                return 0
+            batches = split_batches(entries, self.max_batch_bytes)
+            for index, batch in enumerate(batches):
+                try:
+                    self._publish_fn(batch)
+                except Exception as ex:
+                    self.failed += 1
+                    remaining = [entry for rest in batches[index:] for entry in rest]
+                    self._buffer.requeue(remaining)
+                    self._buffer.add("error publishing %d log lines, will retry: %s" % (len(remaining), ex))
+                    raise
+                self.published += len(batch)
+            return len(entries)
+
+    def stats(self):
+        return {
+            'buffered': len(self._buffer),
+            'published': self.published,
+            'failed_publishes': self.failed,
+            'dropped': self._buffer.dropped,
+            'truncated': self._buffer.truncated
+        }
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
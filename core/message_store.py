@@ -0,0 +1,133 @@
+######################################################################
+# Processed SQS message store
+#
+# Keeps the ids of SQS messages the agent has already handled so that
+# redelivered messages are ignored. Entries expire after a TTL and the
+# store never holds more than max_entries ids. Every new id is appended
+# to an on-disk journal which is compacted once it holds too many stale
+# records, so both memory use and startup load time stay bounded.
+# Timestamps never go backwards in the store: one older than the newest
+# entry is raised to it, which keeps expiry a scan of the front only.
+######################################################################
+import ast
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# SQS keeps messages for at most 14 days, so an id older than that can't be redelivered
+DEFAULT_TTL = 14 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 10000
+# compact once the journal holds this many times more records than live entries
+COMPACT_RATIO = 2
+COMPACT_MIN_RECORDS = 1000
+
+
+class ProcessedMessageStore(object):
+    """TTL and size bounded set of processed message ids backed by an append-only journal"""
+
+    def __init__(self, journal_path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.journal_path = journal_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # message_id -> time processed, oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journal_records = 0
+
+    def load(self, legacy_path=None):
+        """Read the journal (and a legacy str(dict) file if present) and compact it"""
+        with self._lock:
+            if legacy_path and os.path.isfile(legacy_path):
+                self._load_legacy(legacy_path)
+            if os.path.isfile(self.journal_path):
+                with open(self.journal_path, 'r') as journal:
+                    for line in journal:
+                        try:
+                            message_id, timestamp = json.loads(line)
+                        except ValueError:
+                            # a torn write at the end of the journal, skip it
+                            continue
+                        self._entries.pop(message_id, None)
+                        self._entries[message_id] = self._clamp(timestamp)
+            self._evict(time.time())
+            self._compact()
+        return len(self._entries)
+
+    def _load_legacy(self, legacy_path):
+        try:
+            with open(legacy_path, 'r') as legacy_file:
+                legacy = ast.literal_eval(legacy_file.read())
+            for message_id, timestamp in sorted(legacy.items(), key=lambda item: item[1]):
+                self._entries[message_id] = timestamp
+        except (ValueError, SyntaxError, AttributeError):
+            pass
+        os.remove(legacy_path)
+
+    def __contains__(self, message_id):
+        with self._lock:
+            timestamp = self._entries.get(message_id)
+            return timestamp is not None and timestamp > time.time() - self.ttl
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, message_id, timestamp=None):
+        """Record message_id as processed. Returns False if it was already recorded."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._evict(timestamp)
+            if message_id in self._entries:
+                return False
+            timestamp = self._clamp(timestamp)
+            self._entries[message_id] = timestamp
+            self._append(message_id, timestamp)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self._journal_records > max(COMPACT_MIN_RECORDS, COMPACT_RATIO * len(self._entries)):
+                self._compact()
+            return True
+
+    def _clamp(self, timestamp):
+        # an older timestamp (a caller's or a clock stepped back) would sit behind newer entries and never expire
+        if self._entries:
+            return max(timestamp, self._entries[next(reversed(self._entries))])
+        return timestamp
+
+    def _evict(self, now):
+        # entries are kept in insertion order, so expired ones are always at the front
+        cutoff = now - self.ttl
+        while self._entries:
+            message_id, timestamp = next(self._entries.iteritems())
+            if timestamp > cutoff:
+                break
+            del self._entries[message_id]
+
+    def _append(self, message_id, timestamp):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write("%s\n" % json.dumps([message_id, timestamp]))
+        self._journal.flush()
+        self._journal_records += 1
+
+    def _compact(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        temp_path = "%s.tmp" % self.journal_path
+        with open(temp_path, 'w') as journal:
+            for message_id, timestamp in self._entries.iteritems():
+                journal.write("%s\n" % json.dumps([message_id, timestamp]))
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(temp_path, self.journal_path)
+        self._journal_records = len(self._entries)
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -0,0 +1,107 @@
+######################################################################
+# EC2 instance metadata client
+#
+# One pooled HTTP session with connect/read timeouts for every lookup,
+# an IMDSv2 session token that is fetched once and reused until it is
+# about to expire (falling back to IMDSv1 where tokens aren't offered
+# or the token request gets no answer),
+# and a TTL cache per metadata path. When the metadata service can't be
+# reached at all (not an EC2 host) that is remembered for a while, so
+# callers fail fast instead of each waiting out the timeouts.
+######################################################################
+import threading
+import time
+
+# using 169.254.169.254 instead of 'instance-data' because some people
+# like to modify their dhcp tables...
+METADATA_URL = 'http://169.254.169.254'
+DEFAULT_CONNECT_TIMEOUT = 1.0
+DEFAULT_READ_TIMEOUT = 2.0
+DEFAULT_CACHE_TTL = 3600
+DEFAULT_TOKEN_TTL = 21600
+# refresh the token this long before it expires
+TOKEN_REFRESH_MARGIN = 60
+# how long to remember that the metadata service is unreachable
+UNAVAILABLE_RETRY_INTERVAL = 60
+TOKEN_TTL_HEADER = 'X-aws-ec2-metadata-token-ttl-seconds'
+TOKEN_HEADER = 'X-aws-ec2-metadata-token'
+
+
+class MetadataError(Exception):
+    pass
+
+
+class MetadataClient(object):
+    """Cached, token-aware reader of http://169.254.169.254/latest/meta-data/"""
+
+    def __init__(self, base_url=METADATA_URL, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, cache_ttl=DEFAULT_CACHE_TTL, token_ttl=DEFAULT_TOKEN_TTL):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_ttl = cache_ttl
+        self.token_ttl = token_ttl
+        # imported here rather than at the top so the agent only loads requests once metadata is needed
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+        self._lock = threading.Lock()
+        # path -> (value, expires)
+        self._cache = {}
+        self._token = None
+        self._token_expires = 0
+        self._unavailable_until = 0
+
+    def _send(self, method, path, headers):
+        return self._session.request(method, "%s%s" % (self.base_url, path), headers=headers,
+                                     timeout=self.timeout, allow_redirects=False)
+
+    def _request(self, method, path, headers):
+        try:
+            return self._send(method, path, headers)
+        except (self._requests.ConnectionError, self._requests.Timeout) as ex:
+            self._unavailable_until = time.time() + UNAVAILABLE_RETRY_INTERVAL
+            raise MetadataError("metadata service unreachable: %s" % ex)
+
+    def _token_headers(self, refresh=False):
+        now = time.time()
+        if refresh or now >= self._token_expires - TOKEN_REFRESH_MARGIN:
+            try:
+                resp = self._send('PUT', '/latest/api/token', {TOKEN_TTL_HEADER: str(self.token_ttl)})
+            except (self._requests.ConnectionError, self._requests.Timeout):
+                # in a container with a hop limit of 1 the token reply never arrives, but IMDSv1 still does
+                resp = None
+            if resp is not None and resp.status_code == 200:
+                self._token = resp.text
+            else:
+                # IMDSv1 only; ask again when the token would have expired
+                self._token = None
+            self._token_expires = now + self.token_ttl
+        return {TOKEN_HEADER: self._token} if self._token else {}
+
+    def get(self, data_path):
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(data_path)
+            if cached and cached[1] > now:
+                return cached[0]
+            if now < self._unavailable_until:
+                raise MetadataError("metadata service unreachable, not retrying until %s" %
+                                    time.ctime(self._unavailable_until))
+
+            path = '/latest/meta-data/%s' % data_path
+            resp = self._request('GET', path, self._token_headers())
+            if resp.status_code == 401:
+                # the token was revoked or expired early
+                resp = self._request('GET', path, self._token_headers(refresh=True))
+            if not 200 <= resp.status_code < 300:
+                raise MetadataError("error [%d] retrieving metadata: %s%s" % (resp.status_code, self.base_url, path))
+
+            self._cache[data_path] = (resp.text, now + self.cache_ttl)
+            return resp.text
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._unavailable_until = 0
@@ -0,0 +1,134 @@
+######################################################################
+# Agent metrics
+#
+# Counters and fixed-bucket histograms keyed by name and labels, plus a
+# span() timer for wrapping a phase of work. The registry can be written
+# out in the Prometheus text exposition format (for node_exporter's
+# textfile collector or anything that scrapes files) and summarised into
+# a compact dict for the AGENT_METRICS message.
+######################################################################
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds; covers api calls up to long boot scripts
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, 900, 1800)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """Bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        self.max = value if self.max is None else max(self.max, value)
+
+
+class MetricsRegistry(object):
+    """Thread-safe counters and histograms"""
+
+    def __init__(self, prefix='coreo_agent_'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Times the block into the <name>_seconds histogram; failures are counted in <name>_errors_total"""
+        started = time.time()
+        try:
+            yield
+        except BaseException:
+            self.inc("%s_errors_total" % name, **labels)
+            raise
+        finally:
+            self.observe("%s_seconds" % name, time.time() - started, **labels)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h.buckets, list(h.counts), h.total, h.count))
+                                for key, h in self._histograms.items())
+        typed = set()
+        for (name, label_key), value in counters:
+            full_name = self.prefix + name
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append("# TYPE %s counter" % full_name)
+            lines.append("%s%s %s" % (full_name, _format_labels(label_key), _format_number(value)))
+        for (name, label_key), (buckets, counts, total, count) in histograms:
+            full_name = self.prefix + name
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append("# TYPE %s histogram" % full_name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append("%s_bucket%s %d" % (full_name, _format_labels(label_key, [('le', _format_number(bound))]),
+                                                 cumulative))
+            lines.append("%s_sum%s %s" % (full_name, _format_labels(label_key), _format_number(total)))
+            lines.append("%s_count%s %d" % (full_name, _format_labels(label_key), count))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically replace path, so a scraper never reads half a file"""
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write(self.prometheus_text())
+        os.rename(temp_path, path)
+
+    def snapshot(self):
+        """Compact form for the AGENT_METRICS message: counters as values, histograms as count/sum/max"""
+        def flat_name(name, label_key):
+            return name + ''.join('.%s' % value for _, value in label_key)
+
+        with self._lock:
+            counters = dict((flat_name(name, label_key), value)
+                            for (name, label_key), value in self._counters.items())
+            histograms = dict((flat_name(name, label_key),
+                               {'count': h.count, 'sum': round(h.total, 3), 'max': round(h.max, 3)})
+                              for (name, label_key), h in self._histograms.items())
+        return {'counters': counters, 'histograms': histograms}
@@ -0,0 +1,62 @@
+######################################################################
+# Operational script index
+#
+# Caches the result of the operational-scripts precedence walk as a map
+# from script name to resolved path, so a runcommand message doesn't pay
+# for a walk of the whole repo. The cache is keyed on the mtimes of the
+# repo directory and its git HEAD/index, which change whenever the repo
+# is re-cloned or checked out, and can be dropped explicitly after
+# overrides have been applied.
+######################################################################
+import os
+import threading
+
+
+def repo_signature(repo_dir):
+    signature = []
+    for path in (repo_dir, os.path.join(repo_dir, ".git", "HEAD"), os.path.join(repo_dir, ".git", "index")):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_ino, st.st_mtime))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class OperationalScriptIndex(object):
+    """Script name -> full path index built from collect_fn(repo_dir, server_name)"""
+
+    def __init__(self, collect_fn):
+        self._collect_fn = collect_fn
+        self._lock = threading.Lock()
+        # (repo_dir, server_name) -> (signature, ordered paths, {basename: [paths]})
+        self._cache = {}
+
+    def _entry(self, repo_dir, server_name):
+        key = (repo_dir, server_name)
+        signature = repo_signature(repo_dir)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] != signature:
+                scripts = self._collect_fn(repo_dir, server_name)
+                by_name = {}
+                for script in scripts:
+                    by_name.setdefault(os.path.basename(script), []).append(script)
+                entry = (signature, scripts, by_name)
+                self._cache[key] = entry
+            return entry
+
+    def scripts(self, repo_dir, server_name):
+        return list(self._entry(repo_dir, server_name)[1])
+
+    def lookup(self, repo_dir, server_name, script_name):
+        """All paths matching script_name; more than one means the name is ambiguous"""
+        signature, scripts, by_name = self._entry(repo_dir, server_name)
+        if script_name in by_name:
+            return list(by_name[script_name])
+        # names that aren't a plain basename keep the old substring match
+        return [script for script in scripts if script_name in script]
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
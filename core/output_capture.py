@@ -0,0 +1,95 @@
+######################################################################
+# Script output capture
+#
+# Relays the combined stdout/stderr pipe of a script line by line as soon
+# as output arrives, while teeing the raw bytes to the script's log file.
+# The loop sleeps in select() until there is output, the process exits,
+# or it is time for the periodic "still waiting" callback. A reaper
+# thread blocks in wait() and wakes the loop through a self-pipe, so an
+# exit is noticed immediately without polling, even when a daemonized
+# child keeps the output pipe open after the script itself is gone.
+# Output without newlines is relayed in MAX_ENTRY_BYTES pieces rather
+# than held until a newline that may never come.
+######################################################################
+import errno
+import os
+import select
+import threading
+import time
+
+from core.log_pipeline import MAX_ENTRY_BYTES
+
+READ_SIZE = 64 * 1024
+
+
+def _select(read_fds, timeout):
+    while True:
+        try:
+            return select.select(read_fds, [], [], timeout)[0]
+        except select.error as ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+
+
+def relay_output(proc, log_file, on_line, on_idle=None, idle_interval=None, max_line_bytes=MAX_ENTRY_BYTES):
+    """Copy proc.stdout to log_file and on_line() until proc exits; returns its return code"""
+    out_fd = proc.stdout.fileno()
+    wake_r, wake_w = os.pipe()
+
+    def reap():
+        proc.wait()
+        os.write(wake_w, 'x')
+
+    reaper = threading.Thread(target=reap, name="reaper-%d" % proc.pid)
+    reaper.daemon = True
+    reaper.start()
+
+    partial = ['']
+
+    def consume(data):
+        log_file.write(data)
+        log_file.flush()
+        lines = (partial[0] + data).split('\n')
+        partial[0] = lines.pop()
+        for line in lines:
+            on_line(line)
+        while len(partial[0]) >= max_line_bytes:
+            on_line(partial[0][:max_line_bytes])
+            partial[0] = partial[0][max_line_bytes:]
+
+    watching = [out_fd, wake_r]
+    next_idle = time.time() + idle_interval if idle_interval else None
+    exited = False
+    try:
+        while not exited:
+            timeout = max(0, next_idle - time.time()) if next_idle else None
+            ready = _select(watching, timeout)
+            if out_fd in ready:
+                data = os.read(out_fd, READ_SIZE)
+                if data:
+                    consume(data)
+                else:
+                    # the script closed its output but may still be running
+                    watching.remove(out_fd)
+            if wake_r in ready:
+                exited = True
+                # take whatever is already buffered, but don't wait for an EOF that a
+                # daemonized child holding the pipe open would never send
+                while out_fd in watching and _select([out_fd], 0):
+                    data = os.read(out_fd, READ_SIZE)
+                    if not data:
+                        break
+                    consume(data)
+            if next_idle and time.time() >= next_idle:
+                next_idle = time.time() + idle_interval
+                if on_idle and not exited:
+                    on_idle()
+        if partial[0]:
+            on_line(partial[0])
+    finally:
+        reaper.join()
+        os.close(wake_r)
+        os.close(wake_w)
+        proc.stdout.close()
+
+    return proc.returncode
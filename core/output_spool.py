@@ -0,0 +1,166 @@
+######################################################################
+# Spooled script output
+#
+# In spool mode a script's output is not copied line by line into the
+# log buffer; it stays in the script's log file. The spooler follows
+# each tracked file by byte offset and publishes whatever has been
+# written since the last publish, one fixed-size chunk per message,
+# base64 encoded, with a sequence number and the chunk's offset so the
+# receiver can put the output back together in order and notice a gap.
+# Only one chunk is ever held in memory, however much a script prints.
+# The file is read through a descriptor opened when tracking starts, so
+# a later run that deletes and recreates the same path can't leak into
+# this stream. A chunk that fails to publish is read again from the same
+# offset on the next flush; after MAX_PUBLISH_FAILURES failures in a row
+# the stream is abandoned rather than retried forever.
+######################################################################
+import base64
+import threading
+import time
+import uuid
+
+DEFAULT_CHUNK_BYTES = 128 * 1024
+# base64 grows a chunk by 4/3; this keeps a message well inside SNS's 256KB
+MAX_CHUNK_BYTES = 140 * 1024
+MAX_PUBLISH_FAILURES = 5
+DEFAULT_FLUSH_INTERVAL = 5
+
+
+class SpooledOutput(object):
+    """One script's log file and how much of it has been published"""
+
+    def __init__(self, script_name, path):
+        self.script_name = script_name
+        self.path = path
+        self.spool_file = open(path, 'rb')
+        self.stream_id = str(uuid.uuid4())
+        self.offset = 0
+        self.sequence = 0
+        self.finished = False
+        self.closed = False
+        self.return_code = None
+        self.failures = 0
+        self.lock = threading.Lock()
+
+
+class OutputSpooler(object):
+    """Publishes the growth of tracked log files in sequenced chunks from a background thread"""
+
+    def __init__(self, publish_fn, interval=DEFAULT_FLUSH_INTERVAL, chunk_bytes=DEFAULT_CHUNK_BYTES):
+        self._publish_fn = publish_fn
+        self.interval = interval
+        self.chunk_bytes = min(chunk_bytes, MAX_CHUNK_BYTES)
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.published_chunks = 0
+        self.published_bytes = 0
+        self.failed = 0
+        self.abandoned = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='output-spooler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request_flush(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # never let the spooler thread die; offsets only move forward once a chunk is published
+                pass
+
+    def track(self, script_name, path):
+        stream = SpooledOutput(script_name, path)
+        with self._lock:
+            self._streams[stream.stream_id] = stream
+        return stream
+
+    def finish(self, stream, return_code):
+        """Publish the rest of stream's file, ending with a final message, and stop following it"""
+        stream.finished = True
+        stream.return_code = return_code
+        self._flush_stream(stream)
+
+    def _message(self, stream, data, final):
+        message = {
+            'script_name': stream.script_name,
+            'stream_id': stream.stream_id,
+            'sequence': stream.sequence,
+            'offset': stream.offset,
+            'encoding': 'base64',
+            'data': base64.b64encode(data),
+            'date': time.time(),
+            'final': final
+        }
+        if final:
+            message['size'] = stream.offset + len(data)
+            message['return_code'] = stream.return_code
+        return message
+
+    def _close(self, stream):
+        stream.closed = True
+        stream.spool_file.close()
+        with self._lock:
+            self._streams.pop(stream.stream_id, None)
+
+    def _flush_stream(self, stream):
+        with stream.lock:
+            if stream.closed:
+                return
+            while True:
+                stream.spool_file.seek(stream.offset)
+                data = stream.spool_file.read(self.chunk_bytes)
+                final = stream.finished and len(data) < self.chunk_bytes
+                if not data and not final:
+                    return
+                try:
+                    self._publish_fn(self._message(stream, data, final))
+                except Exception:
+                    self.failed += 1
+                    stream.failures += 1
+                    if stream.failures >= MAX_PUBLISH_FAILURES:
+                        self.abandoned += 1
+                        self._close(stream)
+                    raise
+                stream.failures = 0
+                stream.offset += len(data)
+                stream.sequence += 1
+                self.published_chunks += 1
+                self.published_bytes += len(data)
+                if final:
+                    self._close(stream)
+                    return
+
+    def flush(self):
+        with self._lock:
+            streams = list(self._streams.values())
+        for stream in streams:
+            # a finished stream is still here if its last chunks failed to publish
+            self._flush_stream(stream)
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._streams)
+        return {
+            'tracked': tracked,
+            'published_chunks': self.published_chunks,
+            'published_bytes': self.published_bytes,
+            'failed_publishes': self.failed,
+            'abandoned_streams': self.abandoned
+        }
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,98 @@
+######################################################################
+# Override application
+#
+# Copies files out of overrides/ directories the way precedence_walk
+# always has, but skips a copy when the destination already holds the
+# same content and mode. Content digests are kept in a manifest keyed by
+# path and (size, mtime), so unchanged files are not re-read on the next
+# bootstrap attempt. Counts of copied and skipped files and bytes moved
+# are kept for the bootstrap report.
+######################################################################
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class OverrideManifest(object):
+    """path -> (size, mtime, sha1) cache persisted as json"""
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as manifest_file:
+                    self._digests = json.load(manifest_file)
+            except ValueError:
+                self._digests = {}
+        return len(self._digests)
+
+    def save(self):
+        temp_path = "%s.tmp" % self.manifest_path
+        with self._lock:
+            with open(temp_path, 'w') as manifest_file:
+                json.dump(self._digests, manifest_file)
+        os.rename(temp_path, self.manifest_path)
+
+    def digest(self, path, st):
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+            return cached[2]
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as content:
+            for block in iter(lambda: content.read(HASH_BLOCK_SIZE), ''):
+                sha1.update(block)
+        self.record(path, st, sha1.hexdigest())
+        return sha1.hexdigest()
+
+    def record(self, path, st, digest):
+        with self._lock:
+            self._digests[path] = [st.st_size, st.st_mtime, digest]
+
+
+class OverrideApplier(object):
+    """Copies override files unless the destination already matches"""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self._lock = threading.Lock()
+        self.copied = 0
+        self.skipped = 0
+        self.bytes_copied = 0
+
+    def copy(self, src, dest):
+        """Same destination rules as shutil.copy: dest may be a file or the directory to copy into"""
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+        src_st = os.stat(src)
+        try:
+            dest_st = os.stat(dest)
+        except OSError:
+            dest_st = None
+
+        if dest_st is not None and stat.S_IMODE(src_st.st_mode) == stat.S_IMODE(dest_st.st_mode) and \
+                src_st.st_size == dest_st.st_size and \
+                self.manifest.digest(src, src_st) == self.manifest.digest(dest, dest_st):
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        digest = self.manifest.digest(src, src_st)
+        shutil.copy(src, dest)
+        self.manifest.record(dest, os.stat(dest), digest)
+        with self._lock:
+            self.copied += 1
+            self.bytes_copied += src_st.st_size
+        return True
+
+    def report(self):
+        return {'copied': self.copied, 'skipped': self.skipped, 'bytes_copied': self.bytes_copied}
@@ -0,0 +1,124 @@
+######################################################################
+# Agent runtime
+#
+# Runs each of the agent's periodic jobs (SQS polling, bootstrap, the
+# heartbeat) as its own loop on its own thread, so a long boot script or
+# a slow long poll can't make the heartbeat late. A loop that raises is
+# retried with a doubling back-off; SystemExit raised by any loop stops
+# the runtime and is re-raised from run_forever() in the main thread.
+# Starts are scheduled from the previous start, so intervals don't drift
+# by however long the job took.
+######################################################################
+import sys
+import threading
+import time
+
+DEFAULT_MAX_BACKOFF = 60
+SUPERVISE_INTERVAL = 1
+
+
+class Loop(object):
+    """One named job run every interval seconds on its own thread"""
+
+    def __init__(self, name, fn, interval, delay_first=False, max_backoff=DEFAULT_MAX_BACKOFF, on_error=None):
+        self.name = name
+        self._fn = fn
+        self.interval = interval
+        self.delay_first = delay_first
+        self.max_backoff = max_backoff
+        self._on_error = on_error
+        self.runs = 0
+        self.failures = 0
+        self.last_start = None
+        self.last_duration = None
+        self.thread = None
+
+    def run(self, stop_event):
+        """Loop body; returns exc_info if the job raised SystemExit, None once stop_event is set"""
+        next_start = time.time() + (self.interval if self.delay_first else 0)
+        backoff = 0
+        while not stop_event.is_set():
+            stop_event.wait(max(0, next_start - time.time()))
+            if stop_event.is_set():
+                break
+            self.last_start = time.time()
+            try:
+                self._fn()
+                backoff = 0
+                next_start = max(self.last_start + self.interval, time.time())
+            except (SystemExit, KeyboardInterrupt):
+                return sys.exc_info()
+            except Exception as ex:
+                self.failures += 1
+                backoff = min(max(backoff * 2, 1), self.max_backoff)
+                next_start = time.time() + max(backoff, self.interval)
+                if self._on_error:
+                    try:
+                        self._on_error(self.name, ex)
+                    except (SystemExit, KeyboardInterrupt):
+                        return sys.exc_info()
+            finally:
+                self.runs += 1
+                self.last_duration = time.time() - self.last_start
+        return None
+
+    def stats(self):
+        return {'runs': self.runs, 'failures': self.failures, 'last_start': self.last_start,
+                'last_duration': self.last_duration}
+
+
+class AgentRuntime(object):
+    """Starts a set of Loops and keeps them running until one exits the agent"""
+
+    def __init__(self):
+        self.loops = []
+        self._stop_event = threading.Event()
+        self._exit_info = None
+        self._exit_lock = threading.Lock()
+
+    def add_loop(self, name, fn, interval, **kwargs):
+        loop = Loop(name, fn, interval, **kwargs)
+        self.loops.append(loop)
+        return loop
+
+    def _run_loop(self, loop):
+        exc_info = loop.run(self._stop_event)
+        if exc_info is not None:
+            with self._exit_lock:
+                if self._exit_info is None:
+                    self._exit_info = exc_info
+            self._stop_event.set()
+
+    def _start_loop(self, loop):
+        loop.thread = threading.Thread(target=self._run_loop, args=(loop,), name=loop.name)
+        loop.thread.daemon = True
+        loop.thread.start()
+
+    def start(self):
+        for loop in self.loops:
+            self._start_loop(loop)
+
+    def run_forever(self):
+        """Supervise the loops from the calling thread; re-raises SystemExit from any of them"""
+        self.start()
+        try:
+            while not self._stop_event.is_set():
+                self._stop_event.wait(SUPERVISE_INTERVAL)
+                for loop in self.loops:
+                    if not self._stop_event.is_set() and not loop.thread.is_alive():
+                        # only a bug in the loop machinery itself gets here
+                        self._start_loop(loop)
+        finally:
+            # loops still inside a long job are daemon threads; don't wait them out
+            self._stop_event.set()
+        if self._exit_info is not None:
+            raise self._exit_info[0], self._exit_info[1], self._exit_info[2]
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        for loop in self.loops:
+            if loop.thread is not None and loop.thread is not threading.current_thread():
+                loop.thread.join(timeout)
+
+    def stats(self):
+        return dict((loop.name, loop.stats()) for loop in self.loops)
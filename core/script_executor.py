@@ -0,0 +1,165 @@
+######################################################################
+# Operational script executor
+#
+# Runs operational scripts on a fixed number of worker threads so the
+# SQS loop never waits on a script. Every script has a concurrency limit:
+# 1 (the default) makes it single-flight, N lets N runs of it overlap.
+# Runs that can't start yet wait in a FIFO queue that can be inspected.
+# submit_coalesced() attaches an identical request to a run of it that
+# is still queued or running, or finished less than coalesce_window
+# seconds ago, instead of starting the script again.
+######################################################################
+import itertools
+import sys
+import threading
+import time
+from collections import defaultdict
+
+DEFAULT_SCRIPT_WORKERS = 2
+DEFAULT_SCRIPT_CONCURRENCY = 1
+DEFAULT_COALESCE_WINDOW = 10
+
+
+class ScriptRun(object):
+    """A queued, running or finished run of one script"""
+
+    def __init__(self, run_id, script_name, args):
+        self.run_id = run_id
+        self.script_name = script_name
+        self.args = args
+        self.state = 'pending'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.return_code = None
+        # identical requests that were attached to this run instead of running again
+        self.coalesced = 0
+        self._exc_info = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            raise RuntimeError("script [%s] did not finish in %s seconds" % (self.script_name, timeout))
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self.return_code
+
+    def describe(self):
+        return {
+            'run_id': self.run_id,
+            'script_name': self.script_name,
+            'state': self.state,
+            'submitted': self.submitted,
+            'started': self.started
+        }
+
+
+class ScriptExecutor(object):
+    """Worker threads running scripts with per-script concurrency limits"""
+
+    def __init__(self, run_fn, num_workers=DEFAULT_SCRIPT_WORKERS, limits=None,
+                 default_limit=DEFAULT_SCRIPT_CONCURRENCY, coalesce_window=DEFAULT_COALESCE_WINDOW):
+        self._run_fn = run_fn
+        self._limits = dict(limits or {})
+        self._default_limit = default_limit
+        self.coalesce_window = coalesce_window
+        # coalesce key -> latest run for it
+        self._by_key = {}
+        self.coalesced = 0
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = defaultdict(list)
+        self._run_ids = itertools.count(1)
+        self._shutdown = False
+        self._threads = []
+        for index in range(num_workers):
+            thread = threading.Thread(target=self._work, name="script-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def limit_for(self, script_name):
+        return self._limits.get(script_name, self._default_limit)
+
+    def submit(self, script_name, *args):
+        """Queue a run of script_name; run_fn(*args) is called once a worker and a slot are free"""
+        with self._cond:
+            return self._queue_run(script_name, args)
+
+    def _queue_run(self, script_name, args):
+        run = ScriptRun(next(self._run_ids), script_name, args)
+        self._pending.append(run)
+        self._cond.notify()
+        return run
+
+    def _expire_keys(self, now):
+        for key, run in self._by_key.items():
+            if run.finished is not None and run.finished + self.coalesce_window <= now:
+                del self._by_key[key]
+
+    def submit_coalesced(self, key, script_name, *args):
+        """Like submit, unless a run for key is queued, running or recent; returns (run, attached)"""
+        with self._cond:
+            now = time.time()
+            self._expire_keys(now)
+            run = self._by_key.get(key)
+            if run is not None:
+                run.coalesced += 1
+                self.coalesced += 1
+                return run, True
+            run = self._queue_run(script_name, args)
+            self._by_key[key] = run
+            return run, False
+
+    def pending(self):
+        with self._cond:
+            return [run.describe() for run in self._pending]
+
+    def running(self):
+        with self._cond:
+            return [run.describe() for runs in self._running.values() for run in runs]
+
+    def _next_runnable(self):
+        for run in self._pending:
+            if len(self._running[run.script_name]) < self.limit_for(run.script_name):
+                return run
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                run = self._next_runnable()
+                while run is None and not self._shutdown:
+                    self._cond.wait()
+                    run = self._next_runnable()
+                if self._shutdown:
+                    return
+                self._pending.remove(run)
+                self._running[run.script_name].append(run)
+                run.state = 'running'
+                run.started = time.time()
+
+            try:
+                run.return_code = self._run_fn(*run.args)
+            except BaseException:
+                run._exc_info = sys.exc_info()
+                if not isinstance(run._exc_info[1], Exception):
+                    # SystemExit or KeyboardInterrupt ends this worker, but only after the run is marked done
+                    raise
+            finally:
+                with self._cond:
+                    self._running[run.script_name].remove(run)
+                    run.state = 'done'
+                    run.finished = time.time()
+                    # a slot for this script opened up, a waiting run of it may be able to start
+                    self._cond.notify_all()
+                run._done.set()
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
@@ -0,0 +1,153 @@
+######################################################################
+# Heartbeat telemetry
+#
+# A background sampler that reads a handful of /proc files (host cpu and
+# memory, the agent's own rss and open fds) plus disk usage and whatever
+# agent internals the caller reports, and folds every sample into a
+# running min/max/avg per metric. The heartbeat takes the summary for
+# the window since the last one, so the message stays the same size no
+# matter how often samples are taken.
+######################################################################
+import os
+import threading
+import time
+
+DEFAULT_SAMPLE_INTERVAL = 10
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class Summary(object):
+    """Running min/max/avg per metric name"""
+
+    def __init__(self):
+        self._values = {}
+        self.samples = 0
+        self.started = time.time()
+
+    def add(self, sample):
+        self.samples += 1
+        for name, value in sample.items():
+            if value is None:
+                continue
+            current = self._values.get(name)
+            if current is None:
+                self._values[name] = [value, value, value, 1]
+            else:
+                current[0] = min(current[0], value)
+                current[1] = max(current[1], value)
+                current[2] += value
+                current[3] += 1
+
+    def report(self):
+        return dict((name, {'min': low, 'max': high, 'avg': round(float(total) / count, 2)})
+                    for name, (low, high, total, count) in self._values.items())
+
+
+class ProcSampler(object):
+    """Reads one sample of host and agent process metrics from /proc"""
+
+    def __init__(self, proc_root='/proc', disk_path='/', internals_fn=None):
+        self.proc_root = proc_root
+        self.disk_path = disk_path
+        self._internals_fn = internals_fn
+        self._last_cpu = None
+
+    def _read(self, *path):
+        with open(os.path.join(self.proc_root, *path), 'r') as proc_file:
+            return proc_file.read()
+
+    def cpu_percent(self):
+        """Host cpu busy % since the previous call; None the first time"""
+        fields = [int(field) for field in self._read('stat').split('\n', 1)[0].split()[1:]]
+        # idle + iowait
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        # guest and guest_nice (fields 9 and 10) are already counted in user and nice
+        total = sum(fields[:8])
+        last, self._last_cpu = self._last_cpu, (idle, total)
+        if last is None or total == last[1]:
+            return None
+        return round(100.0 * (1 - float(idle - last[0]) / (total - last[1])), 2)
+
+    def memory(self):
+        meminfo = {}
+        for line in self._read('meminfo').splitlines():
+            name, _, rest = line.partition(':')
+            meminfo[name] = int(rest.split()[0]) * 1024
+        available = meminfo.get('MemAvailable')
+        if available is None:
+            # kernels before 3.14
+            available = meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)
+        return {'mem_total_bytes': meminfo.get('MemTotal'), 'mem_available_bytes': available}
+
+    def disk_used_percent(self):
+        st = os.statvfs(self.disk_path)
+        total = st.f_blocks * st.f_frsize
+        if not total:
+            return None
+        return round(100.0 * (total - st.f_bfree * st.f_frsize) / total, 2)
+
+    def agent_rss_bytes(self):
+        return int(self._read('self', 'statm').split()[1]) * PAGE_SIZE
+
+    def agent_open_fds(self):
+        return len(os.listdir(os.path.join(self.proc_root, 'self', 'fd')))
+
+    def sample(self):
+        sample = {}
+        readers = [('cpu_percent', self.cpu_percent), ('disk_used_percent', self.disk_used_percent),
+                   ('agent_rss_bytes', self.agent_rss_bytes), ('agent_open_fds', self.agent_open_fds)]
+        for name, reader in readers:
+            try:
+                sample[name] = reader()
+            except (IOError, OSError, ValueError, IndexError):
+                sample[name] = None
+        try:
+            sample.update(self.memory())
+        except (IOError, OSError, ValueError, IndexError):
+            pass
+        sample['load_1m'] = os.getloadavg()[0]
+        if self._internals_fn is not None:
+            sample.update(self._internals_fn())
+        return sample
+
+
+class TelemetryCollector(object):
+    """Samples on a background thread; take_summary() hands over the current window"""
+
+    def __init__(self, sampler, interval=DEFAULT_SAMPLE_INTERVAL):
+        self._sampler = sampler
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._summary = Summary()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='telemetry')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def sample(self):
+        try:
+            sample = self._sampler.sample()
+        except Exception:
+            # telemetry must never take the agent down
+            return
+        with self._lock:
+            self._summary.add(sample)
+
+    def take_summary(self):
+        with self._lock:
+            summary, self._summary = self._summary, Summary()
+        return {'window_seconds': round(time.time() - summary.started, 1), 'samples': summary.samples,
+                'metrics': summary.report()}
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
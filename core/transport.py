@@ -0,0 +1,94 @@
+######################################################################
+# Message transport
+#
+# The agent talks to SQS and SNS only through a transport: receive and
+# batch-delete from a queue, publish to a topic. Boto3Transport wraps
+# the real clients; InMemoryTransport is an in-process stand-in with the
+# same response shapes, so the message path can be exercised and load
+# tested without AWS.
+######################################################################
+import collections
+import threading
+import time
+import uuid
+
+
+class Boto3Transport(object):
+    """SQS/SNS through boto3 clients"""
+
+    def __init__(self, sqs_client, sns_client):
+        self.sqs_client = sqs_client
+        self.sns_client = sns_client
+
+    def receive(self, queue_url, max_messages, wait_seconds, visibility_timeout):
+        return self.sqs_client.receive_message(
+            QueueUrl=queue_url,
+            VisibilityTimeout=visibility_timeout,
+            WaitTimeSeconds=wait_seconds,
+            MaxNumberOfMessages=max_messages
+        )
+
+    def delete_batch(self, queue_url, entries):
+        return self.sqs_client.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+
+    def publish(self, topic_arn, subject, message):
+        return self.sns_client.publish(TopicArn=topic_arn, Subject=subject, Message=message)
+
+
+class InMemoryTransport(object):
+    """Queues and topics held in memory, shaped like the boto3 responses the agent reads"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queues = collections.defaultdict(collections.deque)
+        # receipt handle -> (queue_url, message), for messages received but not deleted
+        self._in_flight = {}
+        self.published = collections.defaultdict(list)
+        self.sent = 0
+        self.deleted = 0
+
+    def send(self, queue_url, body):
+        message_id = str(uuid.uuid4())
+        with self._cond:
+            self._queues[queue_url].append({u'MessageId': message_id, u'Body': body, 'SentTimestamp': time.time()})
+            self.sent += 1
+            self._cond.notify_all()
+        return message_id
+
+    def depth(self, queue_url):
+        with self._cond:
+            return len(self._queues[queue_url])
+
+    def receive(self, queue_url, max_messages, wait_seconds, visibility_timeout):
+        deadline = time.time() + wait_seconds
+        with self._cond:
+            queue = self._queues[queue_url]
+            while not queue and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+            messages = []
+            while queue and len(messages) < max_messages:
+                message = dict(queue.popleft())
+                message[u'ReceiptHandle'] = str(uuid.uuid4())
+                self._in_flight[message[u'ReceiptHandle']] = (queue_url, message)
+                messages.append(message)
+        response = {u'ResponseMetadata': {u'HTTPStatusCode': 200}}
+        if messages:
+            response[u'Messages'] = messages
+        return response
+
+    def delete_batch(self, queue_url, entries):
+        successful, failed = [], []
+        with self._cond:
+            for entry in entries:
+                if self._in_flight.pop(entry['ReceiptHandle'], None) is None:
+                    failed.append({u'Id': entry['Id'], u'Message': u'ReceiptHandleIsInvalid'})
+                else:
+                    successful.append({u'Id': entry['Id']})
+                    self.deleted += 1
+        return {u'Successful': successful, u'Failed': failed}
+
+    def publish(self, topic_arn, subject, message):
+        message_id = str(uuid.uuid4())
+        with self._cond:
+            self.published[topic_arn].append({'Subject': subject, 'Message': message, 'MessageId': message_id})
+        return {u'MessageId': message_id}
@@ -0,0 +1,85 @@
+######################################################################
+# Worker pool
+#
+# A small fixed-size thread pool with a bounded work queue. submit()
+# blocks once the queue is full so producers can't run away from the
+# workers. Each submitted call gets a Task that can be waited on; any
+# exception (including SystemExit) raised by the call is kept on the
+# task and re-raised by Task.result() in the caller's thread.
+######################################################################
+import sys
+import threading
+import Queue
+
+
+class Task(object):
+    """Result of a call submitted to a WorkerPool"""
+
+    def __init__(self, fn, args, kwargs):
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._result = self._fn(*self._args, **self._kwargs)
+        except BaseException:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def exception(self):
+        return self._exc_info[1] if self._exc_info else None
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            raise RuntimeError("task did not finish in %s seconds" % timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class WorkerPool(object):
+    """Fixed number of daemon threads pulling Tasks off a bounded queue"""
+
+    def __init__(self, num_workers, max_pending=0, name='worker'):
+        self.num_workers = num_workers
+        self._queue = Queue.Queue(max_pending)
+        self._threads = []
+        for index in range(num_workers):
+            thread = threading.Thread(target=self._work, name="%s-%d" % (name, index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            task.run()
+
+    def submit(self, fn, *args, **kwargs):
+        task = Task(fn, args, kwargs)
+        self._queue.put(task)
+        return task
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def shutdown(self, wait=True):
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
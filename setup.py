@@ -16,8 +16,9 @@ setup(
     include_package_data=True,
     install_requires=[
         'boto3==1.3.1',
-        'requests==2.3.0',
+        'requests==2.4.3',
         'rsa==3.1.2',
-        'pyaml==14.5.7'
+        'pyaml==14.5.7',
+        'scandir==1.10.0'
     ]
 )
@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import sys
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.boot_plan import BootPlanner, git_head
+
+HEAD_SHA = 'a' * 40
+NEXT_SHA = 'b' * 40
+
+
+class BootPlannerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.repo_dir = os.path.join(self.tmpdir, "repo")
+        os.makedirs(os.path.join(self.repo_dir, ".git", "refs", "heads"))
+        self.write(".git/HEAD", "ref: refs/heads/master\n")
+        self.write(".git/refs/heads/master", HEAD_SHA + "\n")
+        self.order_file = self.write("boot-scripts/order.yaml", "script-order:\n  - boot.sh\n")
+        self.manifest_path = os.path.join(self.tmpdir, "overrides-manifest.json")
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump({'/repo/a': [1, 2, 'x'], '/repo/b': [3, 4, 'y']}, manifest_file)
+        self.planner = BootPlanner(os.path.join(self.tmpdir, "boot-plan.json"), self.repo_dir, self.manifest_path)
+        self.compiles = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.repo_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as out:
+            out.write(content)
+        return path
+
+    def compile_fn(self):
+        self.compiles += 1
+        boot_scripts_dir = os.path.dirname(self.order_file)
+        return [self.order_file], [(self.order_file, [os.path.join(boot_scripts_dir, 'boot.sh')])], \
+            [self.repo_dir, boot_scripts_dir]
+
+    def test_saved_plan_is_reused_until_inputs_change(self):
+        plan, compiled = self.planner.plan('servers-1', self.compile_fn)
+        self.assertTrue(compiled)
+        self.assertEqual([os.path.basename(script) for script in plan.scripts()], ['boot.sh'])
+
+        reloaded, compiled = self.planner.plan('servers-1', self.compile_fn)
+        self.assertFalse(compiled)
+        self.assertEqual((reloaded.checksum, reloaded.steps), (plan.checksum, plan.steps))
+        self.assertEqual(self.compiles, 1)
+
+        self.write("boot-scripts/order.yaml", "script-order:\n  - boot.sh\n  - more.sh\n")
+        self.assertEqual(self.planner.load('servers-1'), None)
+
+    def test_new_order_file_in_walked_dir(self):
+        plan, _ = self.planner.plan('servers-1', self.compile_fn)
+        self.assertEqual(plan.walked_dirs, sorted([self.repo_dir, os.path.dirname(self.order_file)]))
+        self.assertNotEqual(self.planner.load('servers-1'), None)
+        # the walk would find this one now, even though the saved plan never read it
+        os.mkdir(os.path.join(self.repo_dir, "stack-servers-1"))
+        # mtimes move in clock ticks, and setUp may have run in the same one
+        os.utime(self.repo_dir, (0, 0))
+        self.assertEqual(self.planner.load('servers-1'), None)
+
+    def test_head_manifest_and_key_are_inputs(self):
+        plan, _ = self.planner.plan('servers-1', self.compile_fn)
+        self.assertEqual(self.planner.load('servers-2'), None)
+
+        # same manifest entries written in another order is not a change
+        with open(self.manifest_path, 'w') as manifest_file:
+            manifest_file.write('{"/repo/b": [3, 4, "y"], "/repo/a": [1, 2, "x"]}')
+        self.assertNotEqual(self.planner.load('servers-1'), None)
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump({'/repo/a': [1, 5, 'z']}, manifest_file)
+        self.assertEqual(self.planner.load('servers-1'), None)
+
+        plan, _ = self.planner.plan('servers-1', self.compile_fn)
+        self.write(".git/refs/heads/master", NEXT_SHA + "\n")
+        self.assertEqual(self.planner.load('servers-1'), None)
+
+    def test_unknown_head_always_compiles(self):
+        self.planner.plan('servers-1', self.compile_fn)
+        os.remove(os.path.join(self.repo_dir, ".git", "refs", "heads", "master"))
+        self.assertEqual(self.planner.load('servers-1'), None)
+
+    def test_corrupt_plan_is_compiled_again(self):
+        with open(self.planner.plan_path, 'w') as plan_file:
+            plan_file.write("{not json")
+        plan, compiled = self.planner.plan('servers-1', self.compile_fn)
+        self.assertTrue(compiled)
+
+    def test_unsaved_plan(self):
+        self.planner.plan('servers-1', self.compile_fn, save=False)
+        self.assertFalse(os.path.exists(self.planner.plan_path))
+
+
+class GitHeadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_dir = mkdtemp()
+        os.mkdir(os.path.join(self.repo_dir, ".git"))
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.repo_dir, ".git", name), 'w') as out:
+            out.write(content)
+
+    def test_detached_and_packed_heads(self):
+        self.assertEqual(git_head(self.repo_dir), None)
+        self.write("HEAD", HEAD_SHA + "\n")
+        self.assertEqual(git_head(self.repo_dir), HEAD_SHA)
+        self.write("HEAD", "ref: refs/heads/master\n")
+        self.write("packed-refs", "# pack-refs with: peeled fully-peeled sorted\n%s refs/heads/master\n" % NEXT_SHA)
+        self.assertEqual(git_head(self.repo_dir), NEXT_SHA)
+
+    def test_gitdir_file(self):
+        # a submodule checkout: .git is a file pointing at the module's git dir
+        module_dir = os.path.join(self.repo_dir, "modules", "stack")
+        os.makedirs(module_dir)
+        with open(os.path.join(module_dir, "HEAD"), 'w') as head:
+            head.write(HEAD_SHA + "\n")
+        checkout = os.path.join(self.repo_dir, "stack")
+        os.mkdir(checkout)
+        with open(os.path.join(checkout, ".git"), 'w') as pointer:
+            pointer.write("gitdir: ../modules/stack\n")
+        self.assertEqual(git_head(checkout), HEAD_SHA)
+        with open(os.path.join(module_dir, "HEAD"), 'w') as head:
+            head.write("ref: refs/heads/missing\n")
+        self.assertEqual(git_head(checkout), None)
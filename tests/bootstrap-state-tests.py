@@ -0,0 +1,56 @@
+import sys
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.bootstrap_state import BootstrapState
+
+COMPLETE = "COREO::BOOTSTRAP::complete"
+
+
+class BootstrapStateTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+        self._lock_file = os.path.join(self._tmpdir, "bootstrap.lock")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_membership_is_exact(self):
+        state = BootstrapState(self._lock_file)
+        state.mark("/repo/boot-scripts/setup.sh")
+        self.assertTrue("/repo/boot-scripts/setup.sh" in state)
+        self.assertFalse("/repo/boot-scripts/set" in state)
+        self.assertFalse("setup.sh" in state)
+
+    def test_entries_survive_reload(self):
+        state = BootstrapState(self._lock_file)
+        state.mark("git@github.com:example/repo.git")
+        state.mark(COMPLETE)
+
+        reloaded = BootstrapState(self._lock_file)
+        self.assertEqual(reloaded.load(), 2)
+        self.assertTrue(COMPLETE in reloaded)
+
+    def test_legacy_lock_file(self):
+        # older agents wrote the complete marker without a newline
+        with open(self._lock_file, 'w') as lock_file:
+            lock_file.write("git@github.com:example/repo.git\n/repo/boot-scripts/a.sh\n%s/repo/boot-scripts/b.sh\n" % COMPLETE)
+
+        state = BootstrapState(self._lock_file, markers=(COMPLETE,))
+        self.assertTrue("git@github.com:example/repo.git" in state)
+        self.assertTrue("/repo/boot-scripts/a.sh" in state)
+        self.assertTrue("/repo/boot-scripts/b.sh" in state)
+        self.assertTrue(COMPLETE in state)
+
+    def test_removed_lock_file_resets_state(self):
+        state = BootstrapState(self._lock_file)
+        state.mark(COMPLETE)
+        os.remove(self._lock_file)
+
+        state.refresh()
+        self.assertFalse(COMPLETE in state)
+        self.assertTrue(os.path.isfile(self._lock_file))
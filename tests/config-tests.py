@@ -0,0 +1,75 @@
+import sys
+import os
+import shutil
+import stat
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.config import AgentConfig, ConfigError, load_config, save_config
+
+
+class AgentConfigTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+        self._path = os.path.join(self._tmpdir, "agent.conf")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def write(self, content):
+        with open(self._path, 'w') as config_file:
+            config_file.write(content)
+
+    def test_typed_options(self):
+        self.write("'debug': ''\n'sqs_workers': '8'\n'log_flush_interval': '2.5'\n'delete_handled_messages': 'True'\n"
+                   "'work_dir': '/opt/cloudcoreo/581a445b1f84592c0b18c7ce'\n'asi_id': 581\n'custom_option': 'kept'\n"
+                   "'script_concurrency': {'run_ps.sh': 2}\n")
+        config = load_config(self._path)
+        self.assertEqual(config.debug, False)
+        self.assertEqual(config.delete_handled_messages, True)
+        self.assertEqual(config.sqs_workers, 8)
+        self.assertEqual(config.log_flush_interval, 2.5)
+        self.assertEqual(config.asi_id, '581')
+        self.assertEqual(config.script_concurrency, {'run_ps.sh': 2})
+        self.assertEqual(config.queue_url, None)
+        self.assertEqual(config.get('custom_option'), 'kept')
+
+    def test_immutable(self):
+        config = AgentConfig({'work_dir': '/tmp'})
+
+        def assign():
+            config.work_dir = '/var/tmp'
+
+        self.assertRaises(AttributeError, assign)
+        self.assertEqual(config.replace(work_dir='/var/tmp').work_dir, '/var/tmp')
+        self.assertEqual(config.work_dir, '/tmp')
+
+    def test_invalid_options(self):
+        self.write("'sqs_workers': 'four'\n'debug': 'maybe'\n")
+        try:
+            load_config(self._path)
+            self.fail("expected ConfigError")
+        except ConfigError as ex:
+            self.assertEqual(len(ex.problems), 2)
+            self.assertTrue(any('sqs_workers' in problem for problem in ex.problems))
+
+    def test_legacy_python_tags(self):
+        self.write("'agent_uuid': !!python/unicode 'c644251a-a190-11e6-b650-0a597acee9d9'\n'debug': !!bool 'true'\n")
+        config = load_config(self._path)
+        self.assertEqual(config.agent_uuid, 'c644251a-a190-11e6-b650-0a597acee9d9')
+        self.assertEqual(config.debug, True)
+
+    def test_save_config(self):
+        self.write("'work_dir': '/tmp'\n'custom_option': 'kept'\n")
+        os.chmod(self._path, stat.S_IRUSR | stat.S_IWUSR)
+        config = save_config(load_config(self._path), agent_uuid=u'i-0123456789')
+        self.assertEqual(config.agent_uuid, 'i-0123456789')
+        reloaded = load_config(self._path)
+        self.assertEqual(reloaded.agent_uuid, 'i-0123456789')
+        self.assertEqual(reloaded.get('custom_option'), 'kept')
+        self.assertEqual(stat.S_IMODE(os.stat(self._path).st_mode), stat.S_IRUSR | stat.S_IWUSR)
+        self.assertEqual(os.listdir(self._tmpdir), ["agent.conf"])
+        with open(self._path) as config_file:
+            self.assertFalse('!!python' in config_file.read())
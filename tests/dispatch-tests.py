@@ -0,0 +1,56 @@
+import sys
+import json
+import unittest
+
+sys.path.append('..')
+from core.dispatch import MessageDispatcher, PRIORITY_CONTROL
+
+TARGETS = ('COREO::ALL_SERVERS', 'servers-nat')
+
+
+def sqs_message(message_id, server, message_type, payload='run_df.sh'):
+    return {u'MessageId': message_id,
+            u'Body': json.dumps({'server': server, 'type': message_type, 'payload': payload})}
+
+
+class MessageDispatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.handled = []
+        self.dispatcher = MessageDispatcher(unknown_handler=lambda body: self.handled.append(('unknown', body)))
+        self.dispatcher.register('update', lambda body: self.handled.append(('update', body)),
+                                 priority=PRIORITY_CONTROL)
+        self.dispatcher.register('runcommand', lambda body: self.handled.append(('runcommand', body)))
+
+    def test_control_messages_first(self):
+        for index, message_type in enumerate(['runcommand', 'runcommand', 'UPDATE', 'runcommand', 'reticulate']):
+            self.dispatcher.enqueue(sqs_message(str(index), 'servers-nat', message_type))
+        self.assertEqual([message[u'MessageId'] for message in self.dispatcher.drain()], ['2', '0', '1', '3', '4'])
+        self.assertEqual(self.dispatcher.drain(), [])
+
+    def test_dispatch_by_type(self):
+        self.assertTrue(self.dispatcher.dispatch(sqs_message('1', 'COREO::ALL_SERVERS', 'RunCommand'), TARGETS))
+        self.assertTrue(self.dispatcher.dispatch(sqs_message('2', 'servers-nat', 'reticulate'), TARGETS))
+        self.assertEqual([kind for kind, body in self.handled], ['runcommand', 'unknown'])
+        self.assertEqual(self.handled[0][1]['payload'], 'run_df.sh')
+        stats = self.dispatcher.stats()
+        self.assertEqual(stats['runcommand']['count'], 1)
+        self.assertEqual(stats['unknown']['count'], 1)
+
+    def test_other_servers_skipped(self):
+        self.assertFalse(self.dispatcher.dispatch(sqs_message('1', 'servers-vpn', 'runcommand'), TARGETS))
+        # a payload naming our server doesn't fool the peek into running it
+        tricky = {u'MessageId': '2', u'Body': '{"server": "servers-vpn", "type": "runcommand", '
+                                              '"payload": {"server": "servers-nat"}}'}
+        self.assertFalse(self.dispatcher.dispatch(tricky, TARGETS))
+        self.assertEqual(self.handled, [])
+        self.assertEqual(self.dispatcher.stats()['skipped_other_servers'], 2)
+
+    def test_handler_errors_counted(self):
+        def failing(body):
+            raise ValueError("bad payload")
+
+        self.dispatcher.register('runcommand', failing)
+        self.assertRaises(ValueError, self.dispatcher.dispatch, sqs_message('1', 'servers-nat', 'runcommand'),
+                          TARGETS)
+        self.assertEqual(self.dispatcher.stats()['runcommand']['errors'], 1)
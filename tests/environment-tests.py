@@ -0,0 +1,59 @@
+import sys
+import os
+import json
+import shutil
+import subprocess
+import time
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.environment import EnvironmentBuilder
+
+
+class EnvironmentBuilderTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+        self.write_sources({'VPC_NAME': {'value': 'dev-vpc'}, 'KEY_NAME': {'value': None, 'default': '"my-key"'}},
+                           "VPC_NAME=from-env-out\nNOT_A_PAIR\n")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def write_sources(self, asi_vars, env_out):
+        with open(os.path.join(self._tmpdir, "appstack_instance_config.out"), 'w') as config_file:
+            json.dump(asi_vars, config_file)
+        with open(os.path.join(self._tmpdir, "env.out"), 'w') as env_file:
+            env_file.write(env_out)
+
+    def test_merge_order(self):
+        environment = EnvironmentBuilder(self._tmpdir, base_environ={'PATH': '/bin', 'KEY_NAME': 'base'}).build()
+        self.assertEqual(environment['PATH'], '/bin')
+        self.assertEqual(environment['KEY_NAME'], 'my-key')
+        self.assertEqual(environment['VPC_NAME'], 'from-env-out')
+        self.assertFalse('NOT_A_PAIR' in environment)
+
+    def test_cached_until_sources_change(self):
+        builder = EnvironmentBuilder(self._tmpdir, base_environ={})
+        first = builder.build()
+        self.assertTrue(builder.build() is first)
+        self.assertFalse(builder.rebuild_needed())
+
+        time.sleep(.01)
+        self.write_sources({'VPC_NAME': {'value': 'prod-vpc'}}, "")
+        self.assertTrue(builder.rebuild_needed())
+        self.assertEqual(builder.build()['VPC_NAME'], 'prod-vpc')
+        self.assertEqual(first['VPC_NAME'], 'from-env-out')
+
+    def test_read_only_and_usable_by_popen(self):
+        environment = EnvironmentBuilder(self._tmpdir, base_environ={'PATH': os.environ['PATH']}).build()
+
+        def assign():
+            environment['VPC_NAME'] = 'x'
+
+        self.assertRaises(TypeError, assign)
+        output = subprocess.Popen(['/bin/sh', '-c', 'echo $VPC_NAME'], stdout=subprocess.PIPE,
+                                  env=environment).communicate()[0]
+        self.assertEqual(output.strip(), 'from-env-out')
+        self.assertFalse('VPC_NAME' in os.environ)
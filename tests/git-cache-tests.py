@@ -0,0 +1,61 @@
+import sys
+import os
+import shutil
+import subprocess
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.git_cache import GitMirrorCache
+
+
+def run_git(cwd, *args):
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(['git'] + list(args), cwd=cwd, stdout=devnull, stderr=devnull) == 0
+
+
+class GitMirrorCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+        self._origin = os.path.join(self._tmpdir, "origin")
+        os.makedirs(self._origin)
+        run_git(self._origin, "init", "-q")
+        self.commit("first")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def commit(self, message):
+        with open(os.path.join(self._origin, "README.md"), 'a') as readme:
+            readme.write("%s\n" % message)
+        run_git(self._origin, "add", "README.md")
+        run_git(self._origin, "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", message)
+
+    def test_mirror_is_created_and_refreshed(self):
+        cache = GitMirrorCache(os.path.join(self._tmpdir, "mirrors"))
+        mirror_dir = cache.update(self._origin, run_git)
+        self.assertEqual(mirror_dir, cache.mirror_dir(self._origin))
+        self.assertTrue(os.path.isfile(os.path.join(mirror_dir, "HEAD")))
+
+        self.commit("second")
+        self.assertEqual(cache.update(self._origin, run_git), mirror_dir)
+        self.assertTrue(run_git(mirror_dir, "log", "--grep=second"))
+
+        clone_dir = os.path.join(self._tmpdir, "clone")
+        self.assertTrue(run_git(self._tmpdir, "clone", "-q", "--reference", mirror_dir, "--dissociate", self._origin,
+                                clone_dir))
+        self.assertFalse(os.path.isfile(os.path.join(clone_dir, ".git", "objects", "info", "alternates")))
+        # the clone owns its objects, so losing the mirror doesn't break it
+        shutil.rmtree(mirror_dir)
+        self.assertTrue(run_git(clone_dir, "fsck", "--no-dangling"))
+
+    def test_unreachable_url(self):
+        cache = GitMirrorCache(os.path.join(self._tmpdir, "mirrors"))
+        missing = os.path.join(self._tmpdir, "missing")
+        self.assertEqual(cache.update(missing, run_git), None)
+        self.assertFalse(os.path.exists(cache.mirror_dir(missing)))
+
+    def test_distinct_urls_get_distinct_mirrors(self):
+        cache = GitMirrorCache(os.path.join(self._tmpdir, "mirrors"))
+        self.assertNotEqual(cache.mirror_dir("git@github.com:a/stack.git"), cache.mirror_dir("git@github.com:b/stack.git"))
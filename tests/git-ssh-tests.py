@@ -0,0 +1,28 @@
+import sys
+import os
+import stat
+import unittest
+
+sys.path.append('..')
+from core.git_ssh import GitSSHSession
+
+
+class GitSSHSessionTests(unittest.TestCase):
+
+    def test_session_files(self):
+        with GitSSHSession("-----BEGIN KEY-----\n") as session:
+            self.assertEqual(stat.S_IMODE(os.stat(session.key_path).st_mode), 0600)
+            self.assertTrue(os.access(session.wrapper_path, os.X_OK))
+            with open(session.wrapper_path) as wrapper:
+                script = wrapper.read()
+            self.assertTrue("ControlMaster=auto" in script)
+            self.assertTrue(session.key_path in script)
+            session_dir = session.session_dir
+        self.assertFalse(os.path.exists(session_dir))
+
+    def test_phase_times_accumulate(self):
+        session = GitSSHSession("")
+        session.record("checkout", 1.5)
+        session.record("clone", 2.0)
+        session.record("checkout", .5)
+        self.assertEqual(session.phase_times.items(), [("checkout", 2.0), ("clone", 2.0)])
@@ -0,0 +1,137 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.governor import CgroupV2, GovernedRun, ScriptLimits, LIMIT_CPU, LIMIT_OUTPUT, LIMIT_TIMEOUT
+from core.output_capture import relay_output
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # a zombie the test can't reap still answers kill(0)
+    with open('/proc/%d/stat' % pid) as stat:
+        return stat.read().split(')')[-1].split()[0] != 'Z'
+
+
+def run_governed(command, limits, cgroups=None):
+    governed = GovernedRun(limits, cgroups)
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            preexec_fn=governed.preexec_fn)
+    governed.started(proc)
+    lines = []
+
+    def on_line(line):
+        lines.append(line)
+        governed.note_output(len(line) + 1)
+
+    with open(os.devnull, 'w') as log_file:
+        return_code = relay_output(proc, log_file, on_line)
+    return return_code, governed.finished(return_code), lines
+
+
+class ScriptLimitsTests(unittest.TestCase):
+
+    def test_defaults_are_unlimited(self):
+        limits = ScriptLimits()
+        self.assertEqual(limits.timeout, None)
+        self.assertEqual(limits.kill_grace, 10)
+        self.assertFalse(limits.uses_cgroup())
+
+    def test_per_script_overrides(self):
+        limits = ScriptLimits(timeout=600, cpu_seconds=60).merged({'timeout': 30, 'cpu_seconds': None})
+        self.assertEqual((limits.timeout, limits.cpu_seconds), (30, 60))
+        self.assertRaises(ValueError, ScriptLimits().merged, {'timout': 30})
+
+
+class GovernedRunTests(unittest.TestCase):
+
+    def test_unlimited_script_runs_in_own_process_group(self):
+        return_code, limits_hit, lines = run_governed(['sh', '-c', 'ps -o pgid= -p $$; exit 3'], ScriptLimits())
+        self.assertEqual(return_code, 3)
+        self.assertEqual(limits_hit, [])
+        self.assertNotEqual(int(lines[0]), os.getpgrp())
+
+    def test_timeout_kills_process_group(self):
+        started = time.time()
+        return_code, limits_hit, lines = run_governed(['sh', '-c', 'sleep 30 & echo $!; wait'],
+                                                      ScriptLimits(timeout=.5, kill_grace=1))
+        self.assertTrue(time.time() - started < 5)
+        self.assertEqual(limits_hit, [LIMIT_TIMEOUT])
+        self.assertTrue(return_code < 0)
+        time.sleep(.2)
+        self.assertFalse(pid_alive(int(lines[0])))
+
+    def test_sigterm_escalates_to_sigkill(self):
+        started = time.time()
+        return_code, limits_hit, _ = run_governed(['sh', '-c', 'trap "" TERM; while true; do sleep .1; done'],
+                                                  ScriptLimits(timeout=.3, kill_grace=.5))
+        self.assertEqual(return_code, -9)
+        self.assertEqual(limits_hit, [LIMIT_TIMEOUT])
+        self.assertTrue(.8 <= time.time() - started < 5)
+
+    def test_output_limit(self):
+        return_code, limits_hit, lines = run_governed(['yes'], ScriptLimits(max_output_bytes=10000, kill_grace=1))
+        self.assertEqual(limits_hit, [LIMIT_OUTPUT])
+        self.assertEqual(return_code, -15)
+
+    def test_cpu_rlimit(self):
+        return_code, limits_hit, _ = run_governed(
+            [sys.executable, '-c', 'while True: pass'], ScriptLimits(cpu_seconds=1, kill_grace=1))
+        self.assertEqual(limits_hit, [LIMIT_CPU])
+        self.assertTrue(return_code < 0)
+
+    def test_finished_script_is_not_stopped(self):
+        return_code, limits_hit, _ = run_governed(['true'], ScriptLimits(timeout=.2, max_output_bytes=1))
+        time.sleep(.4)
+        self.assertEqual((return_code, limits_hit), (0, []))
+
+
+class CgroupV2Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_unavailable_without_cgroup2(self):
+        cgroups = CgroupV2(self.root)
+        self.assertFalse(cgroups.available())
+        self.assertTrue('not mounted' in cgroups.error)
+        return_code, limits_hit, _ = run_governed(['true'], ScriptLimits(cgroup_memory_bytes=1 << 20), cgroups)
+        self.assertEqual((return_code, limits_hit), (0, []))
+
+    def test_group_limits_and_oom_report(self):
+        # a plain directory stands in for the cgroup2 mount; the files are only written and read
+        for name in ('cgroup.controllers', 'cgroup.subtree_control'):
+            open(os.path.join(self.root, name), 'w').close()
+        cgroups = CgroupV2(self.root)
+        self.assertTrue(cgroups.available())
+        limits = ScriptLimits(cgroup_memory_bytes=64 << 20, cgroup_cpu_percent=50)
+        group_dir = cgroups.create('oom', limits)
+        with open(os.path.join(group_dir, 'memory.max')) as memory_max:
+            self.assertEqual(memory_max.read(), str(64 << 20))
+        with open(os.path.join(group_dir, 'cpu.max')) as cpu_max:
+            self.assertEqual(cpu_max.read(), "50000 100000")
+        with open(os.path.join(group_dir, 'memory.events'), 'w') as events:
+            events.write("low 0\nhigh 0\nmax 4\noom 1\noom_kill 1\n")
+        self.assertEqual(cgroups.oom_kills(group_dir), 1)
+        self.assertEqual(cgroups.oom_kills(self.root), 0)
+
+    @unittest.skipUnless(os.path.isfile('/sys/fs/cgroup/cgroup.controllers') and os.geteuid() == 0,
+                         "needs cgroup v2 and root")
+    def test_script_runs_in_its_group(self):
+        cgroups = CgroupV2(parent='cloudcoreo-agent-test')
+        return_code, limits_hit, lines = run_governed(['cat', '/proc/self/cgroup'],
+                                                      ScriptLimits(cgroup_cpu_percent=50), cgroups)
+        self.assertEqual((return_code, limits_hit), (0, []))
+        self.assertTrue('cloudcoreo-agent-test/run-' in lines[0])
+        os.rmdir(cgroups.parent_dir)
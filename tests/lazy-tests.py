@@ -0,0 +1,20 @@
+import sys
+import unittest
+
+sys.path.append('..')
+from core.lazy import LazyModule
+
+
+class LazyModuleTests(unittest.TestCase):
+
+    def test_imports_on_first_use(self):
+        sys.modules.pop('colorsys', None)
+        colorsys = LazyModule('colorsys')
+        self.assertFalse('colorsys' in sys.modules)
+        self.assertTrue('not loaded' in repr(colorsys))
+        self.assertEqual(colorsys.rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+        self.assertTrue('colorsys' in sys.modules)
+
+    def test_missing_module(self):
+        missing = LazyModule('no_such_module_for_the_agent')
+        self.assertRaises(ImportError, getattr, missing, 'anything')
@@ -0,0 +1,80 @@
+import sys
+import json
+import unittest
+
+sys.path.append('..')
+from core.log_pipeline import LogBuffer, LogShipper, split_batches
+
+
+class LogBufferTests(unittest.TestCase):
+
+    def test_oldest_entries_are_dropped(self):
+        log_buffer = LogBuffer(max_entries=3)
+        for i in range(5):
+            log_buffer.add("line %d" % i)
+        self.assertEqual([entry['log_message'] for entry in log_buffer.drain()], ["line 2", "line 3", "line 4"])
+        self.assertEqual(log_buffer.dropped, 2)
+
+    def test_total_size_is_bounded(self):
+        log_buffer = LogBuffer(max_entry_bytes=1000, max_bytes=3500)
+        for i in range(10):
+            log_buffer.add("%d%s" % (i, "x" * 999))
+        self.assertEqual([entry['log_message'][0] for entry in log_buffer.drain()], ['7', '8', '9'])
+        self.assertEqual(log_buffer.dropped, 7)
+        self.assertEqual(log_buffer.size_bytes(), 0)
+
+        log_buffer.add("new" * 300)
+        log_buffer.requeue([{'log_message': "old" * 333, 'date': 0}] * 4)
+        self.assertEqual(log_buffer.size_bytes(), 900 + 2 * 999)
+        self.assertEqual(log_buffer.drain()[-1]['log_message'], "new" * 300)
+
+    def test_long_entries_are_truncated(self):
+        log_buffer = LogBuffer(max_entry_bytes=100)
+        log_buffer.add("x" * 1000)
+        self.assertEqual(len(log_buffer.drain()[0]['log_message']), 100)
+        self.assertEqual(log_buffer.truncated, 1)
+
+    def test_invalid_utf8_is_replaced(self):
+        log_buffer = LogBuffer()
+        log_buffer.add("bad \xff byte")
+        json.dumps(log_buffer.drain())
+
+
+class LogShipperTests(unittest.TestCase):
+
+    def test_batches_fit_under_limit(self):
+        log_buffer = LogBuffer()
+        for i in range(2000):
+            log_buffer.add("%d %s" % (i, "y" * 500))
+        batches = split_batches(log_buffer.drain(), 64 * 1024)
+        self.assertTrue(len(batches) > 1)
+        self.assertEqual(sum(len(batch) for batch in batches), 2000)
+        for batch in batches:
+            self.assertTrue(len(json.dumps(batch)) <= 64 * 1024)
+
+    def test_failed_publish_is_requeued(self):
+        published = []
+
+        def flaky_publish(batch):
+            if not published:
+                published.append(None)
+                raise RuntimeError("sns unavailable")
+            published.append(batch)
+
+        log_buffer = LogBuffer()
+        log_buffer.add("first")
+        shipper = LogShipper(log_buffer, flaky_publish)
+        self.assertRaises(RuntimeError, shipper.flush)
+        self.assertEqual(len(log_buffer), 2)
+
+        shipper.flush()
+        self.assertEqual(published[1][0]['log_message'], "first")
+        self.assertEqual(len(log_buffer), 0)
+
+    def test_losses_are_reported(self):
+        published = []
+        log_buffer = LogBuffer(max_entries=2)
+        for i in range(4):
+            log_buffer.add("line %d" % i)
+        LogShipper(log_buffer, published.append).flush()
+        self.assertTrue("dropped 2" in published[0][-1]['log_message'])
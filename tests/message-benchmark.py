@@ -0,0 +1,183 @@
+######################################################################
+# SQS message path benchmark
+#
+# Runs the agent's receive -> process_message -> delete path against an
+# InMemoryTransport filled with a mix of runcommand, update and unknown
+# messages, some for COREO::ALL_SERVERS and some for other servers.
+# Reports throughput, queue-to-handled latency and per-message handler
+# time as json.
+#
+#   python message-benchmark.py --messages 5000 --workers 4 --output results.json
+#
+# update handlers and script runs are replaced with counters: the point
+# is the dispatch path, not pip or the scripts themselves.
+######################################################################
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import threading
+import time
+from tempfile import mkdtemp
+
+import yaml
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/000000000000/coreo-asi-benchmark'
+TOPIC_ARN = 'arn:aws:sns:us-east-1:000000000000:coreo-asi-benchmark'
+SERVER_NAME = 'servers-bench'
+OP_SCRIPT = 'run_bench.sh'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the agent SQS message path')
+    parser.add_argument('--messages', type=int, default=5000, help="messages to inject")
+    parser.add_argument('--workers', type=int, default=4, help="sqs_workers")
+    parser.add_argument('--seed', type=int, default=1, help="seed for the message mix")
+    parser.add_argument('--output', default='-', help="json output file, - for stdout")
+    return parser.parse_args()
+
+
+def write_work_dir(work_dir):
+    repo_dir = os.path.join(work_dir, "repo", "stack-%s" % SERVER_NAME, "operational-scripts")
+    os.makedirs(repo_dir)
+    with open(os.path.join(repo_dir, OP_SCRIPT), 'w') as script:
+        script.write("#!/bin/sh\nexit 0\n")
+    with open(os.path.join(work_dir, "appstack_instance_config.out"), 'w') as config_file:
+        json.dump({'VPC_NAME': {'value': 'bench-vpc'}}, config_file)
+    with open(os.path.join(work_dir, "env.out"), 'w') as env_file:
+        env_file.write("BENCH=1\n")
+    conf_path = os.path.join(work_dir, "agent.conf")
+    with open(conf_path, 'w') as conf_file:
+        conf_file.write(yaml.dump({
+            'agent_uuid': 'benchmark', 'coreo_access_id': 'AKI....', 'debug': False, 'namespace': 'ROOT::BENCH',
+            'server_name': SERVER_NAME, 'queue_url': QUEUE_URL, 'topic_arn': TOPIC_ARN, 'work_dir': work_dir,
+            'delete_handled_messages': True}))
+    return conf_path
+
+
+def message_mix(count, rng):
+    """(kind, body) pairs: mostly op script runs, some for other servers, a few unknown types and updates"""
+    messages = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < .2:
+            kind, server, message_type = 'other_server', 'servers-elsewhere', 'runcommand'
+        elif roll < .25:
+            kind, server, message_type = 'unknown', SERVER_NAME, 'reticulate'
+        elif roll < .26:
+            kind, server, message_type = 'update', 'COREO::ALL_SERVERS', 'update'
+        elif roll < .6:
+            kind, server, message_type = 'runcommand_all_servers', 'COREO::ALL_SERVERS', 'runcommand'
+        else:
+            kind, server, message_type = 'runcommand', SERVER_NAME, 'runcommand'
+        messages.append((kind, json.dumps({'server': server, 'type': message_type, 'payload': OP_SCRIPT})))
+    return messages
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def at(fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    return {'p50': at(.5), 'p95': at(.95), 'p99': at(.99), 'max': values[-1]}
+
+
+def main():
+    args = parse_args()
+    # the agent reads its own command line when it loads configs
+    sys.argv = sys.argv[:1]
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+    import cloudcoreo_agent as agent
+    from core.message_store import ProcessedMessageStore
+    from core.script_executor import ScriptExecutor
+    from core.transport import InMemoryTransport
+    from core.workers import WorkerPool
+
+    work_dir = mkdtemp()
+    stdout = sys.stdout
+    counts_lock = threading.Lock()
+    counts = {'updates': 0, 'script_runs': 0}
+
+    def count(name):
+        def counter(*args):
+            with counts_lock:
+                counts[name] += 1
+            return 0
+        return counter
+
+    try:
+        agent.load_configs(write_work_dir(work_dir))
+        transport = agent.TRANSPORT = InMemoryTransport()
+        agent.MESSAGE_WORKERS = WorkerPool(args.workers, max_pending=agent.SQS_MAX_MESSAGES, name='sqs')
+        agent.SCRIPT_EXECUTOR = ScriptExecutor(count('script_runs'), num_workers=2)
+        agent.PROCESSED_SQS_MESSAGES = ProcessedMessageStore(os.path.join(work_dir, "processed.journal"))
+        agent.update_package = count('updates')
+        agent.run_packet_start_command = lambda: None
+        agent.terminate_script = lambda: None
+        # no bootstrap runs here, so runcommand messages must not wait for one
+        agent.set_bootstrap_settled(True)
+
+        latencies = []
+        handler_times = []
+        process_message = agent.process_message
+
+        def timed_process_message(message, targets=None):
+            started = time.time()
+            process_message(message, targets)
+            done = time.time()
+            with counts_lock:
+                handler_times.append(done - started)
+                latencies.append(done - message['SentTimestamp'])
+
+        agent.process_message = timed_process_message
+
+        mix = message_mix(args.messages, random.Random(args.seed))
+        kinds = {}
+        for kind, body in mix:
+            kinds[kind] = kinds.get(kind, 0) + 1
+            transport.send(QUEUE_URL, body)
+
+        # the agent logs to stdout; keep that out of the json
+        sys.stdout = open(os.devnull, 'w')
+        started = time.time()
+        while transport.depth(QUEUE_URL):
+            agent.poll_sqs_once()
+            agent.LOGS.drain()
+        elapsed = time.time() - started
+        agent.SCRIPT_EXECUTOR.shutdown()
+        agent.MESSAGE_WORKERS.shutdown()
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(work_dir)
+
+    report = {
+        'python': platform.python_version(),
+        'params': {'messages': args.messages, 'workers': args.workers, 'seed': args.seed},
+        'message_kinds': kinds,
+        'elapsed_seconds': elapsed,
+        'messages_per_second': args.messages / max(elapsed, 0.000001),
+        'queue_to_handled_seconds': percentiles(latencies),
+        'handler_seconds': percentiles(handler_times),
+        'handled': len(handler_times),
+        'deleted': transport.deleted,
+        'published': sum(len(messages) for messages in transport.published.values()),
+        'updates': counts['updates'],
+        'dispatcher': agent.get_message_dispatcher().stats(),
+        'script_runs': counts['script_runs']
+    }
+    if args.output == '-':
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
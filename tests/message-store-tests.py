@@ -0,0 +1,79 @@
+import sys
+import os
+import shutil
+import time
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.message_store import ProcessedMessageStore
+
+
+class ProcessedMessageStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+        self._journal = os.path.join(self._tmpdir, "processed.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_add_is_idempotent(self):
+        store = ProcessedMessageStore(self._journal)
+        self.assertTrue(store.add("msg-1"))
+        self.assertFalse(store.add("msg-1"))
+        self.assertTrue("msg-1" in store)
+        self.assertFalse("msg-2" in store)
+
+    def test_expired_ids_are_evicted(self):
+        store = ProcessedMessageStore(self._journal, ttl=60)
+        store.add("old", timestamp=time.time() - 120)
+        self.assertFalse("old" in store)
+        store.add("new")
+        self.assertEqual(len(store), 1)
+
+    def test_older_timestamp_keeps_order(self):
+        store = ProcessedMessageStore(self._journal, ttl=60)
+        now = time.time()
+        store.add("first", timestamp=now - 50)
+        store.add("late", timestamp=now - 120)
+        self.assertTrue("late" in store)
+        # both expire together, nothing is left behind a newer entry
+        store.add("next", timestamp=now + 20)
+        self.assertEqual(len(store), 1)
+
+    def test_size_bound(self):
+        store = ProcessedMessageStore(self._journal, max_entries=10)
+        for i in range(25):
+            store.add("msg-%d" % i)
+        self.assertEqual(len(store), 10)
+        self.assertFalse("msg-0" in store)
+        self.assertTrue("msg-24" in store)
+
+    def test_reload_from_journal(self):
+        store = ProcessedMessageStore(self._journal)
+        store.add("msg-1")
+        store.add("msg-2")
+        store.close()
+
+        reloaded = ProcessedMessageStore(self._journal)
+        self.assertEqual(reloaded.load(), 2)
+        self.assertFalse(reloaded.add("msg-1"))
+
+    def test_journal_is_compacted(self):
+        store = ProcessedMessageStore(self._journal, max_entries=5)
+        for i in range(3000):
+            store.add("msg-%d" % i)
+        store.close()
+        with open(self._journal) as journal:
+            self.assertTrue(len(journal.readlines()) <= 1000)
+
+    def test_legacy_file_is_migrated(self):
+        legacy = os.path.join(self._tmpdir, "processed-messages.txt")
+        with open(legacy, 'w') as legacy_file:
+            legacy_file.write(str({u'msg-1': time.time()}))
+
+        store = ProcessedMessageStore(self._journal)
+        self.assertEqual(store.load(legacy_path=legacy), 1)
+        self.assertTrue("msg-1" in store)
+        self.assertFalse(os.path.exists(legacy))
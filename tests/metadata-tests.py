@@ -0,0 +1,143 @@
+import sys
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+sys.path.append('..')
+from core.metadata import MetadataClient, MetadataError, TOKEN_HEADER
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeMetadataHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        service = self.server.service
+        service.token_requests += 1
+        if service.token_hangs:
+            # a reply that is dropped on the way, as with a hop limit of 1 inside a container
+            service.released.wait(5)
+            return
+        if not service.tokens_supported:
+            self.reply(405)
+            return
+        service.token = "token-%d" % service.token_requests
+        self.reply(200, service.token)
+
+    def do_GET(self):
+        service = self.server.service
+        service.gets.append(self.headers.get(TOKEN_HEADER))
+        if service.tokens_supported and not service.token_hangs and self.headers.get(TOKEN_HEADER) != service.token:
+            self.reply(401)
+            return
+        data_path = self.path[len('/latest/meta-data/'):]
+        if data_path in service.values:
+            self.reply(200, service.values[data_path])
+        else:
+            self.reply(404)
+
+
+class FakeMetadataService(object):
+
+    def __init__(self, tokens_supported=True, token_hangs=False):
+        self.tokens_supported = tokens_supported
+        self.token_hangs = token_hangs
+        self.released = threading.Event()
+        self.token = None
+        self.token_requests = 0
+        self.gets = []
+        self.values = {'placement/availability-zone': 'us-west-2b', 'instance-id': 'i-0123456789'}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMetadataHandler)
+        self._server.service = self
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.released.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MetadataClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.service = None
+
+    def tearDown(self):
+        if self.service:
+            self.service.stop()
+
+    def client(self, **kwargs):
+        return MetadataClient(base_url=self.service.url, **kwargs)
+
+    def test_token_reused_and_values_cached(self):
+        self.service = FakeMetadataService()
+        client = self.client()
+        self.assertEqual(client.get('placement/availability-zone'), 'us-west-2b')
+        self.assertEqual(client.get('instance-id'), 'i-0123456789')
+        self.assertEqual(client.get('placement/availability-zone'), 'us-west-2b')
+        self.assertEqual(self.service.token_requests, 1)
+        self.assertEqual(len(self.service.gets), 2)
+
+    def test_cache_expires(self):
+        self.service = FakeMetadataService()
+        client = self.client(cache_ttl=0)
+        client.get('instance-id')
+        client.get('instance-id')
+        self.assertEqual(len(self.service.gets), 2)
+
+    def test_falls_back_to_v1(self):
+        self.service = FakeMetadataService(tokens_supported=False)
+        client = self.client()
+        self.assertEqual(client.get('instance-id'), 'i-0123456789')
+        self.assertEqual(client.get('placement/availability-zone'), 'us-west-2b')
+        self.assertEqual(self.service.gets, [None, None])
+        self.assertEqual(self.service.token_requests, 1)
+
+    def test_unanswered_token_request_falls_back_to_v1(self):
+        self.service = FakeMetadataService(token_hangs=True)
+        client = self.client(connect_timeout=0.5, read_timeout=0.3)
+        self.assertEqual(client.get('instance-id'), 'i-0123456789')
+        self.assertEqual(client.get('placement/availability-zone'), 'us-west-2b')
+        self.assertEqual(self.service.gets, [None, None])
+        self.assertEqual(self.service.token_requests, 1)
+
+    def test_refreshes_revoked_token(self):
+        self.service = FakeMetadataService()
+        client = self.client()
+        client.get('instance-id')
+        self.service.token = 'rotated'
+        self.assertEqual(client.get('placement/availability-zone'), 'us-west-2b')
+        self.assertEqual(self.service.token_requests, 2)
+
+    def test_missing_path(self):
+        self.service = FakeMetadataService()
+        self.assertRaises(MetadataError, self.client().get, 'no/such/path')
+
+    def test_unreachable_fails_fast(self):
+        self.service = FakeMetadataService()
+        url = self.service.url
+        self.service.stop()
+        self.service = None
+        client = MetadataClient(base_url=url, connect_timeout=0.5, read_timeout=0.5)
+        self.assertRaises(MetadataError, client.get, 'instance-id')
+        # the second lookup doesn't touch the network at all
+        try:
+            client.get('instance-id')
+            self.fail("expected MetadataError")
+        except MetadataError as ex:
+            self.assertTrue('not retrying' in str(ex))
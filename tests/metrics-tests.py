@@ -0,0 +1,55 @@
+import sys
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.metrics import MetricsRegistry
+
+
+class MetricsRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_counters_and_histograms(self):
+        metrics = MetricsRegistry(prefix='test_')
+        metrics.inc('sqs_messages_received_total', 3)
+        metrics.inc('sqs_messages_received_total', 2)
+        metrics.observe('script_duration_seconds', .3, script='a.sh')
+        metrics.observe('script_duration_seconds', 7, script='a.sh')
+        text = metrics.prometheus_text()
+        self.assertTrue("# TYPE test_sqs_messages_received_total counter\ntest_sqs_messages_received_total 5\n" in text)
+        self.assertTrue('test_script_duration_seconds_bucket{script="a.sh",le="0.5"} 1\n' in text)
+        self.assertTrue('test_script_duration_seconds_bucket{script="a.sh",le="10"} 2\n' in text)
+        self.assertTrue('test_script_duration_seconds_bucket{script="a.sh",le="+Inf"} 2\n' in text)
+        self.assertTrue('test_script_duration_seconds_sum{script="a.sh"} 7.3\n' in text)
+        self.assertTrue('test_script_duration_seconds_count{script="a.sh"} 2\n' in text)
+        self.assertEqual(text.count("# TYPE test_script_duration_seconds histogram"), 1)
+
+    def test_span_counts_errors(self):
+        metrics = MetricsRegistry()
+
+        def failing_phase():
+            with metrics.span('bootstrap_phase', phase='clone'):
+                raise RuntimeError("error cloning repo")
+
+        with metrics.span('bootstrap_phase', phase='clone'):
+            pass
+        self.assertRaises(RuntimeError, failing_phase)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['histograms']['bootstrap_phase_seconds.clone']['count'], 2)
+        self.assertEqual(snapshot['counters'], {'bootstrap_phase_errors_total.clone': 1})
+
+    def test_write_prometheus(self):
+        metrics = MetricsRegistry()
+        metrics.inc('sns_publish_total', subject='AGENT_INFO')
+        path = os.path.join(self._tmpdir, "agent.prom")
+        metrics.write_prometheus(path)
+        with open(path) as metrics_file:
+            self.assertEqual(metrics_file.read(), metrics.prometheus_text())
+        self.assertEqual(os.listdir(self._tmpdir), ["agent.prom"])
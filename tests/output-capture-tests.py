@@ -0,0 +1,52 @@
+import sys
+import os
+import shutil
+import subprocess
+import time
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.output_capture import relay_output
+
+
+class RelayOutputTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+        self._log_filename = os.path.join(self._tmpdir, "script.log")
+        self._lines = []
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def run_script(self, script, on_idle=None, idle_interval=None, **kwargs):
+        with open(self._log_filename, 'w') as log_file:
+            proc = subprocess.Popen(['/bin/sh', '-c', script],
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            return relay_output(proc, log_file, self._lines.append, on_idle, idle_interval, **kwargs)
+
+    def test_lines_are_relayed_and_teed(self):
+        rc = self.run_script("echo one; echo two >&2; printf three; exit 3")
+        self.assertEqual(rc, 3)
+        self.assertEqual(self._lines, ["one", "two", "three"])
+        with open(self._log_filename) as log_file:
+            self.assertEqual(log_file.read(), "one\ntwo\nthree")
+
+    def test_daemonized_child_does_not_block(self):
+        started = time.time()
+        rc = self.run_script("echo parent; (sleep 5 &); echo done")
+        self.assertEqual(rc, 0)
+        self.assertTrue(time.time() - started < 4, "waited for the daemonized child")
+        self.assertEqual(self._lines, ["parent", "done"])
+
+    def test_idle_callback(self):
+        ticks = []
+        self.run_script("sleep 1", lambda: ticks.append(time.time()), .3)
+        self.assertTrue(len(ticks) >= 2)
+
+    def test_output_without_newlines_is_split(self):
+        self.run_script("head -c 2500 /dev/zero | tr '\\0' x; echo; echo end", max_line_bytes=1000)
+        self.assertEqual([len(line) for line in self._lines], [1000, 1000, 500, 3])
+        with open(self._log_filename) as log_file:
+            self.assertEqual(len(log_file.read()), 2505)
@@ -0,0 +1,107 @@
+import base64
+import os
+import shutil
+import sys
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.output_spool import OutputSpooler, MAX_CHUNK_BYTES, MAX_PUBLISH_FAILURES
+
+
+def reassemble(chunks):
+    data = ''
+    for expected, chunk in enumerate(sorted(chunks, key=lambda c: c['sequence'])):
+        assert chunk['sequence'] == expected and chunk['offset'] == len(data)
+        data += base64.b64decode(chunk['data'])
+    return data
+
+
+class OutputSpoolerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.path = os.path.join(self.tmpdir, "script.log")
+        self.published = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data):
+        with open(self.path, 'ab') as log_file:
+            log_file.write(data)
+
+    def test_growing_file_is_shipped_in_order(self):
+        spooler = OutputSpooler(self.published.append, chunk_bytes=1000)
+        self.write('')
+        stream = spooler.track('big.sh', self.path)
+        expected = ''
+        for i in range(20):
+            text = ''.join("%d line %d \xff\n" % (i, j) for j in range(50))
+            self.write(text)
+            expected += text
+            spooler.flush()
+        spooler.finish(stream, 3)
+
+        self.assertEqual(reassemble(self.published), expected)
+        self.assertTrue(max(len(base64.b64decode(chunk['data'])) for chunk in self.published) <= 1000)
+        self.assertEqual([chunk['final'] for chunk in self.published].count(True), 1)
+        final = self.published[-1]
+        self.assertEqual((final['final'], final['size'], final['return_code']), (True, len(expected), 3))
+        self.assertEqual(spooler.stats()['tracked'], 0)
+        spooler.flush()
+        self.assertEqual(self.published[-1], final)
+
+    def test_empty_output_still_sends_final(self):
+        spooler = OutputSpooler(self.published.append)
+        self.write('')
+        spooler.finish(spooler.track('quiet.sh', self.path), 0)
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual((self.published[0]['data'], self.published[0]['size']), ('', 0))
+
+    def test_failed_publish_resends_from_same_offset(self):
+        def flaky_publish(chunk):
+            if len(attempts) == 1:
+                attempts.append(None)
+                raise RuntimeError("sns unavailable")
+            attempts.append(chunk)
+            self.published.append(chunk)
+
+        attempts = []
+        spooler = OutputSpooler(flaky_publish, chunk_bytes=10)
+        self.write("0123456789abcdefghij")
+        stream = spooler.track('flaky.sh', self.path)
+        self.assertRaises(RuntimeError, spooler.finish, stream, 0)
+        self.assertEqual((stream.offset, stream.sequence), (10, 1))
+
+        spooler.flush()
+        self.assertEqual(reassemble(self.published), "0123456789abcdefghij")
+        self.assertTrue(self.published[-1]['final'])
+        self.assertEqual(spooler.failed, 1)
+
+    def test_recreated_path_does_not_leak_into_stream(self):
+        spooler = OutputSpooler(self.published.append)
+        self.write("first run\n")
+        stream = spooler.track('same.sh', self.path)
+        # the next run of a script with the same name removes and rewrites the log file
+        os.remove(self.path)
+        self.write("second run, much longer output\n")
+        spooler.finish(stream, 0)
+        self.assertEqual(reassemble(self.published), "first run\n")
+
+    def test_unpublishable_stream_is_abandoned(self):
+        def failing_publish(chunk):
+            raise RuntimeError("message too long")
+
+        spooler = OutputSpooler(failing_publish, chunk_bytes=10 * MAX_CHUNK_BYTES)
+        self.assertEqual(spooler.chunk_bytes, MAX_CHUNK_BYTES)
+        self.write("output")
+        stream = spooler.track('stuck.sh', self.path)
+        self.assertRaises(RuntimeError, spooler.finish, stream, 0)
+        for _ in range(MAX_PUBLISH_FAILURES):
+            try:
+                spooler.flush()
+            except RuntimeError:
+                pass
+        self.assertEqual(spooler.failed, MAX_PUBLISH_FAILURES)
+        self.assertEqual((spooler.stats()['tracked'], spooler.abandoned), (0, 1))
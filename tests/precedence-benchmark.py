@@ -0,0 +1,94 @@
+######################################################################
+# precedence_walk benchmark
+#
+# Generates a synthetic composite repo and times the walker in override
+# and collect mode, collect_operational_scripts and boot script planning
+# (iter_boot_script_plan and compile_boot_plan, which the agent's boot
+# planner calls, without running anything). Results are written as json
+# so runs can be compared against a baseline.
+#
+#   python precedence-benchmark.py --depth 4 --stacks 8 --files 200 --output results.json
+######################################################################
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from tempfile import mkdtemp
+
+from synthetic_repo import make_repo
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark precedence_walk against a synthetic repo')
+    parser.add_argument('--depth', type=int, default=3, help="extends/ nesting depth per stack")
+    parser.add_argument('--stacks', type=int, default=4, help="number of stack-* layers")
+    parser.add_argument('--overrides', type=int, default=2, help="override targets per level")
+    parser.add_argument('--files', type=int, default=50, help="plain files per level")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument('--output', default='-', help="json output file, - for stdout")
+    return parser.parse_args()
+
+
+def time_runs(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.time()
+        result = fn()
+        times.append(time.time() - started)
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1], 'runs': repeat,
+            'results': len(result)}
+
+
+def main():
+    args = parse_args()
+    # the agent reads its own command line when it loads configs
+    sys.argv = sys.argv[:1]
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+    import cloudcoreo_agent as agent
+
+    tmpdir = mkdtemp()
+    repo_dir = os.path.join(tmpdir, "repo")
+    server_name = "servers-0"
+    stdout = sys.stdout
+    try:
+        counts = make_repo(repo_dir, args.depth, args.stacks, args.overrides, args.files)
+        benchmarks = [
+            ('precedence_walk_override', lambda: agent.precedence_walk(repo_dir, "", "", True)),
+            ('precedence_walk_collect', lambda: agent.precedence_walk(repo_dir, "boot-scripts/order.yaml",
+                                                                      server_name, False)),
+            ('collect_operational_scripts', lambda: agent.collect_operational_scripts(repo_dir, server_name)),
+            ('boot_script_plan', lambda: list(agent.iter_boot_script_plan(repo_dir, server_name))),
+            ('compile_boot_plan', lambda: agent.compile_boot_plan(repo_dir, server_name)[1]),
+        ]
+        results = {}
+        # the agent logs to stdout; keep that out of the json
+        sys.stdout = open(os.devnull, 'w')
+        for name, fn in benchmarks:
+            agent.PRECEDENCE_DIR_CACHE.clear()
+            results[name] = time_runs(fn, args.repeat)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(tmpdir)
+
+    report = {
+        'python': platform.python_version(),
+        'scandir': agent.scandir is not None,
+        'params': {'depth': args.depth, 'stacks': args.stacks, 'overrides': args.overrides, 'files': args.files},
+        'repo': counts,
+        'benchmarks': results
+    }
+    if args.output == '-':
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
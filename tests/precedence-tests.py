@@ -11,6 +11,8 @@ import yaml
 
 sys.path.append('../core')
 from cloudcoreo_agent import *
+from synthetic_repo import make_repo
+from core.config import AgentConfig
 
 # Enable DEBUG for verbose test output
 DEBUG = False
@@ -300,6 +302,30 @@ class OverridesTests(CompositeTests):
             print after_overrides_compare_files
 
 
+    def test_incremental_overrides(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        truth_files = self._truth_files_nat_overrides + self._truth_files_vpn_overrides + self._truth_files_generic_overrides
+        manifest_path = os.path.join(self._workdir, "overrides-manifest.json")
+
+        manifest = OverrideManifest(manifest_path)
+        applier = OverrideApplier(manifest)
+        test_files = apply_overrides(self._repodir, applier)
+        manifest.save()
+
+        self.assertEqual(len(truth_files), len(test_files), "before and after did not return same number of files!")
+        self.assertEqual(applier.report()['copied'], len(truth_files))
+        after_overrides_compare_files = self.compare_file_contents_to_str(self._truth_files_generic_after_overrides_content)
+        [self.assertTrue(item) for item in after_overrides_compare_files]
+
+        manifest = OverrideManifest(manifest_path)
+        manifest.load()
+        applier = OverrideApplier(manifest)
+        apply_overrides(self._repodir, applier)
+        self.assertTrue(applier.report()['skipped'] > 0, "unchanged overrides were copied again")
+        after_overrides_compare_files = self.compare_file_contents_to_str(self._truth_files_generic_after_overrides_content)
+        [self.assertTrue(item) for item in after_overrides_compare_files]
+
+
 class OldAndNewCompareTests(CompositeTests):
     _test_package = "57a1fa37c514992cf3958242-precedence-test-data-old-branch-model"
 
@@ -336,6 +362,200 @@ class RunBootScripts(CompositeTests):
         print "---> ran %d order.yaml files for %s" % (num_vpn_order_files, server_name)
         self.assertEqual(num_vpn_order_files, num_expected, "expected to run %d script for %s" % (num_expected, server_name))
 
+    def test_boot_plan_is_reused(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        load_configs(self._agent_conf)
+
+        server_name = "servers-vpn"
+        plan = get_boot_plan(self._repodir, server_name)
+        self.assertEqual(len(plan.steps), 4)
+        self.assertEqual(get_boot_plan(self._repodir, server_name).created, plan.created)
+
+        # an order.yaml that changes means compiling the plan again
+        with open(plan.steps[0][0], 'a') as order_file:
+            order_file.write("\n")
+        self.assertNotEqual(get_boot_plan(self._repodir, server_name).created, plan.created)
+        self.assertEqual(get_boot_plan(self._repodir, server_name, save=False).steps, plan.steps)
+
+
+    def test_boot_plan_sees_new_order_files(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        load_configs(self._agent_conf)
+
+        server_name = "servers-nat"
+        self.assertEqual(len(get_boot_plan(self._repodir, server_name).order_files), 1)
+        # an order.yaml the saved plan never read, in a directory the walk lists
+        new_order_dir = os.path.join(self._repodir, "stack-servers-nat", "boot-scripts")
+        os.makedirs(new_order_dir)
+        with open(os.path.join(new_order_dir, "order.yaml"), 'w') as order_file:
+            order_file.write("script-order:\n  - nat-extra.sh\n")
+        self.assertEqual(len(precedence_walk(self._repodir, "boot-scripts/order.yaml", server_name)), 2)
+        self.assertEqual(len(get_boot_plan(self._repodir, server_name).order_files), 2)
+
+    def test_boot_plan_follows_order_files_written_by_scripts(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        load_configs(self._agent_conf)
+        agent = sys.modules['cloudcoreo_agent']
+        server_name = "servers-vpn"
+        last_order_file = get_boot_plan(self._repodir, server_name).steps[-1][0]
+        ran = []
+
+        def fake_run_cmd(full_path, environment, log_filename=None):
+            ran.append(os.path.basename(full_path))
+            if ran == ['vb1']:
+                # the first boot script adds a step to a later order.yaml
+                with open(last_order_file, 'a') as order_file:
+                    order_file.write("  - vb4-generated\n")
+            return 0
+
+        real_run_cmd = agent.run_cmd
+        agent.run_cmd = fake_run_cmd
+        try:
+            (full_run_error, num_order_files) = run_all_boot_scripts(self._repodir, server_name)
+        finally:
+            agent.run_cmd = real_run_cmd
+        self.assertEqual((full_run_error, num_order_files), (None, 4))
+        self.assertEqual(ran, ['vb1', 'vb3', 'vb2', 'vb4', 'vb4-generated'])
+
+
+class BootstrapGateTests(unittest.TestCase):
+
+    def setUp(self):
+        self._agent = sys.modules['cloudcoreo_agent']
+        self._run_script = self._agent.run_script
+        self.ran = []
+        self._agent.run_script = lambda message_body: self.ran.append(message_body['payload'])
+
+    def tearDown(self):
+        self._agent.run_script = self._run_script
+        self._agent.set_bootstrap_settled(False)
+
+    def test_runcommand_waits_for_bootstrap(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        self._agent.set_bootstrap_settled(False)
+        handle_runcommand_message({'payload': 'first.sh'})
+        handle_runcommand_message({'payload': 'second.sh'})
+        self.assertEqual(self.ran, [])
+
+        self._agent.set_bootstrap_settled(True)
+        self.assertEqual(self.ran, ['first.sh', 'second.sh'])
+        handle_runcommand_message({'payload': 'third.sh'})
+        self.assertEqual(self.ran, ['first.sh', 'second.sh', 'third.sh'])
+
+
+class OpScriptFailureTests(unittest.TestCase):
+
+    def setUp(self):
+        self._agent = sys.modules['cloudcoreo_agent']
+        self._run_cmd = self._agent.run_cmd
+        self._publish_to_sns = self._agent.publish_to_sns
+        self._options = self._agent.OPTIONS_FROM_CONFIG_FILE
+        self.published = []
+        self._agent.OPTIONS_FROM_CONFIG_FILE = AgentConfig({'agent_uuid': 'test'})
+        self._agent.publish_to_sns = lambda message, subject, topic_arn: self.published.append(message)
+
+    def tearDown(self):
+        self._agent.run_cmd = self._run_cmd
+        self._agent.publish_to_sns = self._publish_to_sns
+        self._agent.OPTIONS_FROM_CONFIG_FILE = self._options
+
+    def test_failed_op_script_is_reported(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+
+        def failing_run_cmd(full_script_path, environment, log_filename=None):
+            raise OSError(8, "Exec format error")
+
+        self._agent.run_cmd = failing_run_cmd
+        executor = ScriptExecutor(run_op_script, num_workers=1)
+        run = executor.submit("run_df.sh", "/repo/operational-scripts/run_df.sh", {})
+        self.assertEqual(run.result(5), OP_SCRIPT_FAILED)
+        executor.shutdown()
+        results = [message['body']['data'] for message in self.published
+                   if message['body']['message_type'] == "SCRIPT_RESULT"]
+        self.assertEqual(results, [{'script_name': 'run_df.sh', 'return_code': OP_SCRIPT_FAILED, 'limits_hit': [],
+                                    'error': "[Errno 8] Exec format error"}])
+        self.assertTrue(any("Exec format error" in entry['log_message'] for entry in self._agent.LOGS.drain()))
+
+
+class ConfigCheckTests(unittest.TestCase):
+
+    def test_check_configs(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        options = AgentConfig({'coreo_access_id': 'AKI....', 'coreo_access_key': 'HP4....', 'work_dir': '/tmp',
+                               'queue_url': 'https://sqs.us-east-1.amazonaws.com/530342348278/coreo-asi',
+                               'topic_arn': 'arn:aws:sns:us-east-1:530342348278:coreo-asi'})
+        self.assertEqual(check_configs(options), [])
+
+        options = options.replace(topic_arn='coreo-asi', runtime='asyncio', work_dir=None)
+        self.assertEqual(check_configs(options), [
+            "missing required option [work_dir]",
+            "topic_arn [coreo-asi] is not an SNS topic ARN",
+            "runtime must be loop or threaded"])
+
+        options = options.replace(work_dir='/tmp', topic_arn=None, runtime=None, script_output_chunk_bytes=1 << 20)
+        self.assertEqual(check_configs(options), [
+            "missing required option [topic_arn]",
+            "script_output_chunk_bytes must be between 1 and 143360 so a chunk fits in one SNS message"])
+
+        options = options.replace(topic_arn='arn:aws:sns:us-east-1:530342348278:coreo-asi', script_output_chunk_bytes=None,
+                                  script_limits={'run_df.sh': {'timout': 30, 'memory_bytes': 1 << 20},
+                                                 'run_ps.sh': {'timeout': 30}, 'run_top.sh': 30})
+        self.assertEqual(check_configs(options), [
+            "script_limits for [run_df.sh] has unknown limits: timout (expected %s)" % ", ".join(LIMIT_OPTIONS),
+            "script_limits for [run_top.sh] is not a mapping"])
+
+
+class SyntheticRepoTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = mkdtemp()
+        self._repodir = os.path.join(self._tmpdir, "repo")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_walk_does_not_stat_entries(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        # scandir is a requirement on python 2; without it every entry costs an os.stat again
+        self.assertNotEqual(scan_dir(self._tmpdir).__class__, list)
+        make_repo(self._repodir, depth=2, stacks=3, overrides=2, files=5)
+        real_stat = os.stat
+        stats = []
+
+        def counting_stat(path, *args):
+            stats.append(path)
+            return real_stat(path, *args)
+
+        os.stat = counting_stat
+        try:
+            order_files = precedence_walk(self._repodir, "boot-scripts/order.yaml", "servers-1", False)
+        finally:
+            os.stat = real_stat
+        self.assertEqual(len(order_files), 3)
+        self.assertEqual(stats, [])
+
+    def test_synthetic_boot_script_plan(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        counts = make_repo(self._repodir, depth=2, stacks=3, overrides=2, files=5)
+        self.assertEqual(counts['levels'], 12)
+
+        plan = [(re.sub('.*/repo/', '', order_file), [os.path.basename(script) for script in scripts])
+                for order_file, scripts in iter_boot_script_plan(self._repodir, "servers-1")]
+        # deepest extends first, then the stack itself
+        self.assertEqual(plan, [
+            ('stack-servers-1/extends/extends/boot-scripts/order.yaml', ['servers-1-e2-e1-boot-0.sh',
+                                                                         'servers-1-e2-e1-boot-1.sh']),
+            ('stack-servers-1/extends/boot-scripts/order.yaml', ['servers-1-e2-boot-0.sh', 'servers-1-e2-boot-1.sh']),
+            ('stack-servers-1/boot-scripts/order.yaml', ['servers-1-boot-0.sh', 'servers-1-boot-1.sh'])])
+
+        overrides = precedence_walk(self._repodir, "", "", True)
+        self.assertEqual(len(overrides), counts['overrides'])
+        plan = [[os.path.basename(script) for script in scripts]
+                for order_file, scripts in iter_boot_script_plan(self._repodir, "servers-1")]
+        # an override from further out wins over the overridden level's own
+        self.assertEqual(plan, [['servers-1-e2-override-1.sh'], ['servers-1-override-1.sh'],
+                                ['servers-1-override-0.sh']])
+
 
 class OperationalScripts(CompositeTests):
 
@@ -374,6 +594,28 @@ class OperationalScripts(CompositeTests):
 
         self.assertEqual(len(self._truth_files_opscripts), len(test_files), "before and after did not return same number of files!")
 
+    def test_op_script_index(self):
+        print "<<<<< Running test:  %s  >>>>>" % inspect.currentframe().f_code.co_name
+        load_configs(self._agent_conf)
+
+        server = ""
+        walks = []
+
+        def counting_collect(repo_dir, server_name):
+            walks.append(repo_dir)
+            return collect_operational_scripts(repo_dir, server_name)
+
+        index = OperationalScriptIndex(counting_collect)
+        self.assertEqual(len(index.scripts(self._repodir, server)), len(self._truth_files_opscripts))
+        self.assertEqual([re.sub('.*/repo/', '', entry) for entry in index.lookup(self._repodir, server, "run_df.sh")],
+                         ['extends/operational-scripts/run_df.sh'])
+        self.assertEqual(index.lookup(self._repodir, server, "run_nothing.sh"), [])
+        self.assertEqual(len(walks), 1, "index walked the repo more than once")
+
+        index.invalidate()
+        index.lookup(self._repodir, server, "run_df.sh")
+        self.assertEqual(len(walks), 2)
+
 
 def suite():
     test_suite = unittest.TestSuite()
@@ -383,17 +625,31 @@ def suite():
         'test_servers_vpn_bootscripts',
         'test_servers_nat_bootscripts_overrides',
         'test_servers_vpn_bootscripts_overrides',
-        'test_general_overrides'
+        'test_general_overrides',
+        'test_incremental_overrides'
     ]
     test_suite.addTests(map(OverridesTests, overrides_tests))
 
     compare_tests = ['test_old_vs_new_bootscripts']
     test_suite.addTests(map(OldAndNewCompareTests, compare_tests))
 
-    run_script_tests = ['run_all_bootscripts']
+    run_script_tests = ['test_run_all_boot_scripts', 'test_boot_plan_is_reused',
+                        'test_boot_plan_sees_new_order_files', 'test_boot_plan_follows_order_files_written_by_scripts']
     test_suite.addTests(map(RunBootScripts, run_script_tests))
 
-    run_ops_script_tests = ['find_op_scripts']
+    gate_tests = ['test_runcommand_waits_for_bootstrap']
+    test_suite.addTests(map(BootstrapGateTests, gate_tests))
+
+    op_script_failure_tests = ['test_failed_op_script_is_reported']
+    test_suite.addTests(map(OpScriptFailureTests, op_script_failure_tests))
+
+    config_tests = ['test_check_configs']
+    test_suite.addTests(map(ConfigCheckTests, config_tests))
+
+    synthetic_tests = ['test_walk_does_not_stat_entries', 'test_synthetic_boot_script_plan']
+    test_suite.addTests(map(SyntheticRepoTests, synthetic_tests))
+
+    run_ops_script_tests = ['test_find_op_scripts', 'test_op_script_index']
     test_suite.addTests(map(OperationalScripts, run_ops_script_tests))
 
     return test_suite
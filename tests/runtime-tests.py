@@ -0,0 +1,69 @@
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append('..')
+from core.runtime import AgentRuntime
+
+
+class AgentRuntimeTests(unittest.TestCase):
+
+    def test_slow_loop_does_not_delay_others(self):
+        runtime = AgentRuntime()
+        release = threading.Event()
+        beats = []
+        runtime.add_loop('slow', lambda: release.wait(5), 0)
+        runtime.add_loop('heartbeat', lambda: beats.append(time.time()), .1)
+        runtime.start()
+        time.sleep(.55)
+        release.set()
+        runtime.stop(5)
+        self.assertTrue(len(beats) >= 4)
+
+    def test_failing_loop_backs_off_and_recovers(self):
+        runtime = AgentRuntime()
+        errors = []
+        calls = []
+
+        def flaky():
+            calls.append(time.time())
+            if len(calls) < 3:
+                raise ValueError("boom %d" % len(calls))
+
+        runtime.add_loop('flaky', flaky, 0, max_backoff=.2, on_error=lambda name, ex: errors.append((name, str(ex))))
+        runtime.start()
+        time.sleep(.8)
+        runtime.stop(5)
+        self.assertEqual(errors, [('flaky', 'boom 1'), ('flaky', 'boom 2')])
+        self.assertEqual(runtime.stats()['flaky']['failures'], 2)
+        self.assertTrue(calls[1] - calls[0] >= .2)
+
+    def test_system_exit_stops_runtime(self):
+        runtime = AgentRuntime()
+        other_runs = []
+        runtime.add_loop('other', lambda: other_runs.append(1), .05)
+
+        def exit_agent():
+            time.sleep(.2)
+            sys.exit(3)
+
+        runtime.add_loop('exit', exit_agent, 0)
+        try:
+            runtime.run_forever()
+            self.fail("expected SystemExit")
+        except SystemExit as ex:
+            self.assertEqual(ex.code, 3)
+        runtime.stop(5)
+        count = len(other_runs)
+        time.sleep(.2)
+        self.assertEqual(len(other_runs), count)
+
+    def test_delay_first(self):
+        runtime = AgentRuntime()
+        runs = []
+        runtime.add_loop('heartbeat', lambda: runs.append(1), 10, delay_first=True)
+        runtime.start()
+        time.sleep(.2)
+        runtime.stop(5)
+        self.assertEqual(runs, [])
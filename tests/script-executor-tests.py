@@ -0,0 +1,98 @@
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append('..')
+from core.script_executor import ScriptExecutor
+
+
+class ScriptExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._release = threading.Event()
+        self._active = {}
+        self._max_active = {}
+
+    def fake_script(self, script_name):
+        with self._lock:
+            self._active[script_name] = self._active.get(script_name, 0) + 1
+            self._max_active[script_name] = max(self._max_active.get(script_name, 0), self._active[script_name])
+        self._release.wait(5)
+        with self._lock:
+            self._active[script_name] -= 1
+        return 0
+
+    def test_single_flight_by_default(self):
+        executor = ScriptExecutor(self.fake_script, num_workers=4)
+        runs = [executor.submit("run_df.sh", "run_df.sh") for _ in range(3)]
+        runs[0].wait(.2)
+        self.assertEqual(len(executor.running()), 1)
+        self.assertEqual([run['state'] for run in executor.pending()], ['pending', 'pending'])
+
+        self._release.set()
+        self.assertEqual([run.result(5) for run in runs], [0, 0, 0])
+        self.assertEqual(self._max_active["run_df.sh"], 1)
+        executor.shutdown()
+
+    def test_parallel_limit(self):
+        executor = ScriptExecutor(self.fake_script, num_workers=4, limits={"run_ps.sh": 2})
+        runs = [executor.submit("run_ps.sh", "run_ps.sh") for _ in range(3)]
+        other = executor.submit("run_df.sh", "run_df.sh")
+        other.wait(.2)
+        self.assertEqual(len(executor.running()), 3)
+        self.assertEqual(len(executor.pending()), 1)
+
+        self._release.set()
+        [run.result(5) for run in runs + [other]]
+        self.assertEqual(self._max_active["run_ps.sh"], 2)
+        executor.shutdown()
+
+    def test_coalesce_in_flight(self):
+        executor = ScriptExecutor(self.fake_script, num_workers=2, coalesce_window=0)
+        first, attached = executor.submit_coalesced(("run_df.sh", '"run_df.sh"'), "run_df.sh", "run_df.sh")
+        self.assertFalse(attached)
+        first.wait(.2)
+        again, attached = executor.submit_coalesced(("run_df.sh", '"run_df.sh"'), "run_df.sh", "run_df.sh")
+        self.assertTrue(attached)
+        self.assertTrue(again is first)
+        other, attached = executor.submit_coalesced(("run_df.sh", '"run_df.sh -h"'), "run_df.sh", "run_df.sh")
+        self.assertFalse(attached)
+
+        self._release.set()
+        self.assertEqual(first.result(5), 0)
+        other.result(5)
+        self.assertEqual(first.coalesced, 1)
+        self.assertEqual(executor.coalesced, 1)
+        # with no window a finished run isn't reused
+        rerun, attached = executor.submit_coalesced(("run_df.sh", '"run_df.sh"'), "run_df.sh", "run_df.sh")
+        self.assertFalse(attached)
+        rerun.result(5)
+        executor.shutdown()
+
+    def test_coalesce_window(self):
+        self._release.set()
+        executor = ScriptExecutor(self.fake_script, num_workers=1, coalesce_window=.3)
+        first, _ = executor.submit_coalesced("key", "run_df.sh", "run_df.sh")
+        first.result(5)
+        recent, attached = executor.submit_coalesced("key", "run_df.sh", "run_df.sh")
+        self.assertTrue(attached and recent is first)
+        time.sleep(.35)
+        later, attached = executor.submit_coalesced("key", "run_df.sh", "run_df.sh")
+        self.assertFalse(attached)
+        later.result(5)
+        executor.shutdown()
+
+    def test_exit_in_script_still_finishes_run(self):
+        def exiting_script(script_name):
+            raise SystemExit(3)
+
+        executor = ScriptExecutor(exiting_script, num_workers=2)
+        run = executor.submit("exit.sh", "exit.sh")
+        self.assertTrue(run.wait(5))
+        self.assertEqual((run.state, executor.running()), ('done', []))
+        self.assertRaises(SystemExit, run.result)
+        # the other worker picks up the next run of the same script
+        self.assertTrue(executor.submit("exit.sh", "exit.sh").wait(5))
+        executor.shutdown()
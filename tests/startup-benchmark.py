@@ -0,0 +1,97 @@
+######################################################################
+# Agent cold-start benchmark
+#
+# Starts a fresh interpreter for each run and times importing the agent,
+# `--version` and `--check-config` against a generated config. Each run
+# also reports which heavy modules (boto3, botocore, requests, yaml) it
+# ended up loading, so a stray top-level import shows up immediately.
+#
+#   python startup-benchmark.py --repeat 10 --output results.json
+######################################################################
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from tempfile import mkdtemp
+
+HEAVY_MODULES = ('boto3', 'botocore', 'requests', 'yaml')
+PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+CHILD = """
+import json, sys
+sys.argv = %r
+try:
+    from core import cloudcoreo_agent
+    if len(sys.argv) > 1:
+        cloudcoreo_agent.start_agent()
+except SystemExit:
+    pass
+sys.stdout = sys.__stdout__
+print json.dumps([name for name in %r if name in sys.modules])
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Time agent startup paths in fresh interpreters')
+    parser.add_argument('--repeat', type=int, default=5, help="runs per path")
+    parser.add_argument('--output', default='-', help="json output file, - for stdout")
+    return parser.parse_args()
+
+
+def time_path(argv, repeat):
+    times = []
+    loaded = None
+    env = dict(os.environ, PYTHONPATH=PACKAGE_DIR, PYTHONDONTWRITEBYTECODE='1')
+    for _ in range(repeat):
+        started = time.time()
+        output = subprocess.Popen([sys.executable, '-c', CHILD % (argv, HEAVY_MODULES)], stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, env=env, cwd=PACKAGE_DIR).communicate()[0]
+        times.append(time.time() - started)
+        loaded = json.loads(output.strip().splitlines()[-1])
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1], 'runs': repeat,
+            'heavy_modules_loaded': loaded}
+
+
+def main():
+    args = parse_args()
+    tmpdir = mkdtemp()
+    try:
+        conf_path = os.path.join(tmpdir, "agent.conf")
+        with open(conf_path, 'w') as conf_file:
+            conf_file.write("'coreo_access_id': 'AKI....'\n'coreo_access_key': 'HP4....'\n"
+                            "'queue_url': 'https://sqs.us-east-1.amazonaws.com/000000000000/coreo-asi-bench'\n"
+                            "'topic_arn': 'arn:aws:sns:us-east-1:000000000000:coreo-asi-bench'\n"
+                            "'work_dir': '%s'\n" % tmpdir)
+        paths = [
+            ('bare_interpreter', None),
+            ('import', ['cloudcoreo_agent']),
+            ('version', ['cloudcoreo_agent', '--version']),
+            ('check_config', ['cloudcoreo_agent', '--config', conf_path, '--check-config']),
+        ]
+        results = {}
+        for name, argv in paths:
+            if argv is None:
+                started = time.time()
+                for _ in range(args.repeat):
+                    subprocess.call([sys.executable, '-c', 'pass'])
+                results[name] = {'median': (time.time() - started) / args.repeat, 'runs': args.repeat}
+            else:
+                results[name] = time_path(argv, args.repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = {'python': platform.python_version(), 'benchmarks': results}
+    if args.output == '-':
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+######################################################################
+# Synthetic composite repo generator
+#
+# Builds a repo laid out like a CloudCoreo composite: every level has
+# boot-scripts/, operational-scripts/, services/ and files/, an extends/
+# child nested `depth` levels deep, `stacks` stack-<server> children on
+# the top level, and `overrides` override targets per level (each an
+# overrides/<path>/boot-scripts/order.yaml shadowing a level below).
+######################################################################
+import os
+
+ORDER_YAML = "script-order:\n%s"
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as out:
+        out.write(content)
+
+
+def _write_level(level_dir, name, depth, overrides, files, counts):
+    scripts = ["%s-boot-%d.sh" % (name, index) for index in range(2)]
+    _write(os.path.join(level_dir, "boot-scripts", "order.yaml"),
+           ORDER_YAML % "".join("  - %s\n" % script for script in scripts))
+    for script in scripts:
+        _write(os.path.join(level_dir, "boot-scripts", script), "#!/bin/sh\necho %s\n" % script)
+    _write(os.path.join(level_dir, "operational-scripts", "%s-op.sh" % name), "#!/bin/sh\necho op\n")
+    _write(os.path.join(level_dir, "shutdown-scripts", "order.yaml"), "script-order:\n")
+    _write(os.path.join(level_dir, "services", "config.rb"), "# %s\n" % name)
+    _write(os.path.join(level_dir, "config.yaml"), "variables: {}\n")
+    for index in range(files):
+        _write(os.path.join(level_dir, "files", "file-%04d.conf" % index), "%s %d\n" % (name, index))
+    counts['levels'] += 1
+    counts['files'] += files
+
+    # override targets: this level's own boot-scripts, then the extends chain below it
+    target = ""
+    for index in range(min(overrides, depth + 1)):
+        _write(os.path.join(level_dir, "overrides", target, "boot-scripts", "order.yaml"),
+               ORDER_YAML % ("  - %s-override-%d.sh\n" % (name, index)))
+        counts['overrides'] += 1
+        target = os.path.join(target, "extends")
+
+    if depth > 0:
+        _write_level(os.path.join(level_dir, "extends"), "%s-e%d" % (name, depth), depth - 1, overrides, files, counts)
+
+
+def make_repo(repo_dir, depth=2, stacks=2, overrides=1, files=10):
+    """Write a synthetic repo under repo_dir; returns counts of what was generated"""
+    counts = {'levels': 0, 'files': 0, 'overrides': 0}
+    _write_level(repo_dir, "root", depth, overrides, files, counts)
+    for index in range(stacks):
+        _write_level(os.path.join(repo_dir, "stack-servers-%d" % index), "servers-%d" % index, depth, overrides,
+                     files, counts)
+    # a .git directory is never walked
+    _write(os.path.join(repo_dir, ".git", "HEAD"), "ref: refs/heads/master\n")
+    return counts
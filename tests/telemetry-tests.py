@@ -0,0 +1,69 @@
+import sys
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.append('..')
+from core.telemetry import ProcSampler, Summary, TelemetryCollector, PAGE_SIZE
+
+
+class TelemetryTests(unittest.TestCase):
+
+    def setUp(self):
+        self._proc = mkdtemp()
+        os.makedirs(os.path.join(self._proc, 'self', 'fd'))
+        for fd in range(3):
+            open(os.path.join(self._proc, 'self', 'fd', str(fd)), 'w').close()
+        self.write('self/statm', "660 325 300 5 0 123 0\n")
+        self.write('meminfo', "MemTotal:        2048 kB\nMemFree:          512 kB\nMemAvailable:    1024 kB\n")
+        self.write('stat', "cpu  100 0 100 700 100 0 0 0 0 0\ncpu0 100 0 100 700 100 0 0 0 0 0\n")
+
+    def tearDown(self):
+        shutil.rmtree(self._proc)
+
+    def write(self, name, content):
+        with open(os.path.join(self._proc, name), 'w') as proc_file:
+            proc_file.write(content)
+
+    def test_sample(self):
+        sampler = ProcSampler(proc_root=self._proc, disk_path=self._proc, internals_fn=lambda: {'running_scripts': 2})
+        sample = sampler.sample()
+        self.assertEqual(sample['cpu_percent'], None)
+        self.assertEqual(sample['agent_rss_bytes'], 325 * PAGE_SIZE)
+        self.assertEqual(sample['agent_open_fds'], 3)
+        self.assertEqual(sample['mem_total_bytes'], 2048 * 1024)
+        self.assertEqual(sample['mem_available_bytes'], 1024 * 1024)
+        self.assertEqual(sample['running_scripts'], 2)
+        self.assertTrue(0 <= sample['disk_used_percent'] <= 100)
+
+        # 100 more busy jiffies out of 200
+        self.write('stat', "cpu  150 0 150 780 120 0 0 0 0 0\n")
+        self.assertEqual(sampler.sample()['cpu_percent'], 50.0)
+        # 40 of the new user time was spent running a guest, it isn't busy time twice
+        self.write('stat', "cpu  190 0 190 860 120 0 0 0 40 0\n")
+        self.assertEqual(sampler.sample()['cpu_percent'], 50.0)
+
+    def test_missing_proc_files(self):
+        os.remove(os.path.join(self._proc, 'stat'))
+        os.remove(os.path.join(self._proc, 'meminfo'))
+        sample = ProcSampler(proc_root=self._proc, disk_path=self._proc).sample()
+        self.assertEqual(sample['cpu_percent'], None)
+        self.assertFalse('mem_total_bytes' in sample)
+        self.assertEqual(sample['agent_open_fds'], 3)
+
+    def test_summary(self):
+        summary = Summary()
+        for value in (3, 1, 5):
+            summary.add({'load_1m': value, 'cpu_percent': None})
+        self.assertEqual(summary.report(), {'load_1m': {'min': 1, 'max': 5, 'avg': 3.0}})
+        self.assertEqual(summary.samples, 3)
+
+    def test_take_summary_starts_new_window(self):
+        collector = TelemetryCollector(ProcSampler(proc_root=self._proc, disk_path=self._proc))
+        collector.sample()
+        collector.sample()
+        first = collector.take_summary()
+        self.assertEqual(first['samples'], 2)
+        self.assertEqual(first['metrics']['agent_open_fds'], {'min': 3, 'max': 3, 'avg': 3.0})
+        self.assertEqual(collector.take_summary()['samples'], 0)
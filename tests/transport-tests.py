@@ -0,0 +1,49 @@
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append('..')
+from core.transport import InMemoryTransport
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/000000000000/coreo-asi-test'
+
+
+class InMemoryTransportTests(unittest.TestCase):
+
+    def test_receive_and_delete(self):
+        transport = InMemoryTransport()
+        ids = [transport.send(QUEUE_URL, '{"n": %d}' % n) for n in range(12)]
+        response = transport.receive(QUEUE_URL, 10, 0, 0)
+        self.assertEqual([message[u'MessageId'] for message in response[u'Messages']], ids[:10])
+        self.assertEqual(transport.depth(QUEUE_URL), 2)
+
+        entries = [{'Id': str(index), 'ReceiptHandle': message[u'ReceiptHandle']}
+                   for index, message in enumerate(response[u'Messages'][:2])]
+        entries.append({'Id': '2', 'ReceiptHandle': 'not-a-handle'})
+        deleted = transport.delete_batch(QUEUE_URL, entries)
+        self.assertEqual(deleted[u'Successful'], [{u'Id': '0'}, {u'Id': '1'}])
+        self.assertEqual(deleted[u'Failed'][0][u'Id'], '2')
+        self.assertEqual(transport.deleted, 2)
+
+    def test_empty_receive_waits(self):
+        transport = InMemoryTransport()
+        started = time.time()
+        response = transport.receive(QUEUE_URL, 10, .2, 0)
+        self.assertFalse(u'Messages' in response)
+        self.assertTrue(time.time() - started >= .2)
+
+    def test_long_poll_wakes_on_send(self):
+        transport = InMemoryTransport()
+        timer = threading.Timer(.1, transport.send, args=(QUEUE_URL, '{}'))
+        timer.start()
+        started = time.time()
+        response = transport.receive(QUEUE_URL, 10, 5, 0)
+        timer.join()
+        self.assertEqual(len(response[u'Messages']), 1)
+        self.assertTrue(time.time() - started < 5)
+
+    def test_publish(self):
+        transport = InMemoryTransport()
+        transport.publish('arn:aws:sns:us-east-1:000000000000:topic', 'AGENT_INFO', '{}')
+        self.assertEqual(transport.published['arn:aws:sns:us-east-1:000000000000:topic'][0]['Subject'], 'AGENT_INFO')
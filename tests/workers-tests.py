@@ -0,0 +1,44 @@
+import sys
+import threading
+import unittest
+
+sys.path.append('..')
+from core.workers import WorkerPool
+
+
+class WorkerPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = WorkerPool(4, max_pending=10, name='test')
+
+    def tearDown(self):
+        self._pool.shutdown()
+
+    def test_results(self):
+        tasks = [self._pool.submit(lambda x: x * x, i) for i in range(10)]
+        self.assertEqual([task.result(5) for task in tasks], [i * i for i in range(10)])
+
+    def test_calls_run_concurrently(self):
+        lock = threading.Lock()
+        running = [0]
+        all_running = threading.Event()
+
+        def rendezvous():
+            with lock:
+                running[0] += 1
+                if running[0] == 4:
+                    all_running.set()
+            # only returns True if all four workers are running at the same time
+            return all_running.wait(5)
+
+        tasks = [self._pool.submit(rendezvous) for _ in range(4)]
+        self.assertTrue(all(task.result(10) for task in tasks))
+
+    def test_exceptions_are_reraised(self):
+        def fail():
+            sys.exit(3)
+
+        task = self._pool.submit(fail)
+        self.assertTrue(task.wait(5))
+        self.assertTrue(isinstance(task.exception(), SystemExit))
+        self.assertRaises(SystemExit, task.result)